@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+
+# Files of an export directory, next to the saved BlipProcessor
+VISION_FILE = "vision.pt"
+PREFILL_FILE = "decoder_prefill.pt"
+STEP_FILE = "decoder_step.pt"
+CONFIG_FILE = "export.json"
+
+
+class VisionEncoder(torch.nn.Module):
+    """pixel_values -> image embeddings, the cross-attention input of the text decoder."""
+
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+class DecoderPrefill(torch.nn.Module):
+    """Prompt tokens -> (logits of the next token, key/value cache of every layer)."""
+
+    def __init__(self, text_decoder):
+        super().__init__()
+        self.text_decoder = text_decoder
+
+    def forward(self, input_ids, image_embeds):
+        outputs = self.text_decoder(input_ids=input_ids, encoder_hidden_states=image_embeds,
+                                    use_cache=True, return_dict=True)
+        return outputs.logits[:, -1, :], tuple(tuple(layer) for layer in outputs.past_key_values)
+
+
+class DecoderStep(torch.nn.Module):
+    """One new token and the cache -> (logits of the next token, cache extended by that token)."""
+
+    def __init__(self, text_decoder):
+        super().__init__()
+        self.text_decoder = text_decoder
+
+    def forward(self, input_ids, image_embeds, past_key_values):
+        outputs = self.text_decoder(input_ids=input_ids, encoder_hidden_states=image_embeds,
+                                    past_key_values=past_key_values, use_cache=True, return_dict=True)
+        return outputs.logits[:, -1, :], tuple(tuple(layer) for layer in outputs.past_key_values)
+
+
+def _trace(module, example_inputs):
+    # Frozen: weights become constants of the graph, which lets the JIT fold them
+    return torch.jit.freeze(torch.jit.trace(module.eval(), example_inputs, check_trace=False))
+
+
+def export_torchscript(blip, output_dir, example_image=None):
+    """Traces the vision encoder and the cached text decoder of a BlipMed to TorchScript in output_dir.
+
+    The decoder is exported twice: the prompt pass (any length, no cache) and the single token
+    step with the key/value cache, since the two take different code paths in BLIP's attention.
+    """
+    model = blip.model.eval()
+    generation_config = model.text_decoder.generation_config
+    if generation_config.num_beams > 1 or generation_config.do_sample:
+        raise ValueError("Only greedy generation is exported, the model is configured for beam search or sampling")
+
+    example_image = example_image if example_image is not None else fixed_images(1)[0]
+    inputs = blip.processor(images=example_image, text="indication: " + blip.default_indication, return_tensors="pt")
+    prompt = inputs["input_ids"][:, :-1]
+    os.makedirs(output_dir, exist_ok=True)
+    with torch.no_grad():
+        vision = _trace(VisionEncoder(model.vision_model), (inputs["pixel_values"],))
+        image_embeds = vision(inputs["pixel_values"])
+        prefill = _trace(DecoderPrefill(model.text_decoder), (prompt, image_embeds))
+        logits, past_key_values = prefill(prompt, image_embeds)
+        next_token = logits.argmax(dim=-1, keepdim=True)
+        step = _trace(DecoderStep(model.text_decoder), (next_token, image_embeds, past_key_values))
+
+    for module, name in [(vision, VISION_FILE), (prefill, PREFILL_FILE), (step, STEP_FILE)]:
+        torch.jit.save(module, os.path.join(output_dir, name))
+    blip.processor.save_pretrained(output_dir)
+    text_config = model.config.text_config
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump({
+            "bos_token_id": text_config.bos_token_id,
+            "sep_token_id": text_config.sep_token_id,
+            "max_position_embeddings": text_config.max_position_embeddings,
+            "repetition_penalty": generation_config.repetition_penalty,
+            "torch_version": torch.__version__,
+        }, f, indent=2)
+    return output_dir
+
+
+class ExportedBlip:
+    """Greedy report generation with the TorchScript graphs of export_torchscript.
+
+    Matches BlipForConditionalGeneration.generate with greedy decoding: the prompt starts with
+    the BOS token instead of [CLS] and drops its [SEP], and generation stops after [SEP] or at
+    max_length tokens (prompt included), with at least one generated token.
+    """
+
+    def __init__(self, export_dir):
+        self.vision = torch.jit.load(os.path.join(export_dir, VISION_FILE))
+        self.prefill = torch.jit.load(os.path.join(export_dir, PREFILL_FILE))
+        self.step = torch.jit.load(os.path.join(export_dir, STEP_FILE))
+        with open(os.path.join(export_dir, CONFIG_FILE)) as f:
+            config = json.load(f)
+        self.bos_token_id = config["bos_token_id"]
+        self.sep_token_id = config["sep_token_id"]
+        self.max_positions = config["max_position_embeddings"]
+        self.repetition_penalty = config["repetition_penalty"]
+
+    def prompt(self, input_ids, attention_mask=None):
+        """The decoder prompt of a processor's input_ids: BOS instead of [CLS], without the trailing [SEP].
+
+        Only a single unpadded prompt ending in [SEP] is supported, the shape BlipProcessor gives for one image.
+        """
+        if input_ids.shape[0] != 1:
+            raise ValueError(f"Exported generation takes one prompt at a time, got a batch of {input_ids.shape[0]}")
+        if attention_mask is not None and not bool(attention_mask.all()):
+            raise ValueError("Padded prompts are not supported by the exported decoder")
+        if input_ids[0, -1].item() != self.sep_token_id:
+            raise ValueError(f"The prompt must end with [SEP] (token {self.sep_token_id}), got {input_ids[0, -1].item()}")
+        tokens = input_ids[:, :-1].clone()
+        tokens[:, 0] = self.bos_token_id
+        return tokens
+
+    def _next_token(self, logits, tokens):
+        if self.repetition_penalty != 1.0:
+            # Same rule as transformers' RepetitionPenaltyLogitsProcessor
+            score = torch.gather(logits, 1, tokens)
+            score = torch.where(score < 0, score * self.repetition_penalty, score / self.repetition_penalty)
+            logits = logits.scatter(1, tokens, score)
+        return logits.argmax(dim=-1, keepdim=True)
+
+    @torch.inference_mode()
+    def generate(self, pixel_values, input_ids, max_length, attention_mask=None):
+        """Token IDs (1, length) of the prompt followed by the generated report, for one image."""
+        tokens = self.prompt(input_ids, attention_mask)
+        image_embeds = self.vision(pixel_values)
+        logits, past_key_values = self.prefill(tokens, image_embeds)
+        limit = min(max_length, self.max_positions)
+        # The length is checked after each token, as transformers' MaxLengthCriteria does
+        while True:
+            next_token = self._next_token(logits, tokens)
+            tokens = torch.cat([tokens, next_token], dim=1)
+            if next_token.item() == self.sep_token_id or tokens.shape[1] >= limit:
+                break
+            logits, past_key_values = self.step(next_token, image_embeds, past_key_values)
+        return tokens
+
+
+def fixed_images(num_images, size=512, seed=0):
+    """A reproducible set of synthetic grayscale X-ray sized images."""
+    rng = np.random.default_rng(seed)
+    return [Image.fromarray(rng.integers(0, 256, size=(size, size), dtype=np.uint8)).convert("RGB")
+            for _ in range(num_images)]
+
+
+def check_parity(blip, export_dir, images, indication=None):
+    """Generates a report per image with the eager model and with the export, and compares them.
+
+    Returns the number of identical reports, the differing ones and the decode time per token
+    of each path.
+    """
+    from modelblip import BlipMed
+
+    exported = BlipMed(processor=blip.processor, export_dir=export_dir)
+    exported.max_lenght = blip.max_lenght
+    mismatches, seconds, tokens = [], {"eager": 0.0, "exported": 0.0}, 0
+    for index, image in enumerate(images):
+        reports = {}
+        for name, backend in [("eager", blip), ("exported", exported)]:
+            start = time.perf_counter()
+            reports[name] = backend.generate_report(image, my_indication=indication)
+            seconds[name] += time.perf_counter() - start
+        tokens += len(blip.processor.tokenizer(reports["eager"])["input_ids"])
+        if reports["eager"] != reports["exported"]:
+            mismatches.append({"image": index, **reports})
+    return {
+        "images": len(images),
+        "identical": len(images) - len(mismatches),
+        "mismatches": mismatches,
+        "seconds": seconds,
+        "seconds_per_token": {name: value / max(tokens, 1) for name, value in seconds.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export BlipMed to TorchScript and check its reports against the eager model")
+    parser.add_argument("--output", default="blip_torchscript", help="export directory")
+    parser.add_argument("--images", nargs="*", default=None,
+                        help="images of the parity check, a fixed synthetic set by default")
+    parser.add_argument("--check-images", type=int, default=3, help="size of the synthetic set, 0 to skip the check")
+    args = parser.parse_args()
+
+    from modelblip import BlipMed
+
+    blip = BlipMed()
+    export_torchscript(blip, args.output)
+    print(f"Exported to {args.output}", file=sys.stderr)
+    images = [Image.open(path).convert("RGB") for path in args.images] if args.images else fixed_images(args.check_images)
+    if images:
+        report = check_parity(blip, args.output, images)
+        json.dump(report, sys.stdout, indent=2)
+        if report["mismatches"]:
+            sys.exit(f"{len(report['mismatches'])} of {report['images']} reports differ from the eager model")
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, status, Depends 
 from fastapi.responses import HTMLResponse
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime, timedelta, timezone
 from typing import Union
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -28,12 +29,33 @@ async def get_hello():
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from modelblip import BlipMed
-from etl_report import generate_drift_report
+from etl_report import generate_drift_report, rgb_cache, embedding_cache, DRIFT_REPORT_JSON, DRIFT_REPORT_HTML
+from drift import load_drift_result
+from text_drift import TextDriftMonitor
+from timing import add_timing_middleware, stage, METRICS, snapshot, Counter
+
+# Per-stage durations of each request in its Server-Timing header (see loadtest.py), and metrics at /metrics
+add_timing_middleware(app)
+
+
+def feature_cache_metrics():
+    """Hits and misses of the drift report feature caches, read on each /metrics scrape."""
+    caches = {"rgb": rgb_cache, "embedding": embedding_cache}
+    return [
+        snapshot(Counter, "feature_cache_hits_total", "Image features read from the drift cache",
+                 {(name,): cache.hits for name, cache in caches.items()}, ("cache",)),
+        snapshot(Counter, "feature_cache_misses_total", "Image features computed because they were not cached",
+                 {(name,): cache.misses for name, cache in caches.items()}, ("cache",)),
+    ]
+
+
+METRICS.add_collector(feature_cache_metrics)
 
 load_dotenv()
 # JWT settings 
 SECRET_KEY = os.getenv('SECRET_KEY')  # Replace with your own secret key
 DATA_FOR_DRIFT_PATH=os.getenv("DATA_FOR_DRIFT_PATH")
+TEXT_DRIFT_REFERENCE=os.getenv("TEXT_DRIFT_REFERENCE", "Cleanses csv tfrecords/df_train.csv")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
@@ -85,7 +107,11 @@ def decode_token(token: str):
 
 # Load model and processor
 global blipMed 
-blipMed = BlipMed()
+# BLIP_EXPORT_DIR serves the TorchScript export of blip_export.py instead of the eager model
+blipMed = BlipMed(export_dir=os.getenv("BLIP_EXPORT_DIR"))
+
+# Live word-count / token-bucket drift of the generated reports
+text_monitor = TextDriftMonitor(os.path.join(DATA_FOR_DRIFT_PATH or "", TEXT_DRIFT_REFERENCE))
 
 
 @app.post("/token")
@@ -110,10 +136,13 @@ async def generate_report(file: UploadFile = File(...), indication: str = None,
     payload = decode_token(token)
     username = payload.get("sub")
     try:
-        image_data = await file.read()  
-        image = Image.open(io.BytesIO(image_data))  
+        with stage("upload_parse"):
+            image_data = await file.read()  
+            image = Image.open(io.BytesIO(image_data))  
+            image.load()
 
         report = blipMed.generate_report(image=image, my_indication=indication)
+        text_monitor.update(report)
 
         return {"report": report, "radiologist_name": users_db.get(username)}
     
@@ -132,7 +161,7 @@ async def show_drift(token: str = Depends(oauth2_scheme)):
         try:
             # report_html_path = "custom_report.html"
             
-            report_html_path = DATA_FOR_DRIFT_PATH + "drift_report.html"
+            report_html_path = DRIFT_REPORT_HTML
             print(report_html_path)
             # Check if the file exists
             if os.path.exists(report_html_path):
@@ -141,9 +170,8 @@ async def show_drift(token: str = Depends(oauth2_scheme)):
                     html_content = f.read()
                 return HTMLResponse(content=html_content)
             else:
-                # Generate It from data / This should take time
-                
-                generate_drift_report()
+                # Generate It from data / This should take time, so off the event loop
+                await run_in_threadpool(generate_drift_report, render_html=True)
                 with open(report_html_path, "r") as f:
                     html_content = f.read()
                 return HTMLResponse(content=html_content)
@@ -152,6 +180,37 @@ async def show_drift(token: str = Depends(oauth2_scheme)):
             return {"error": str(e)}
 
 
+@app.get('/monitoring/drift')
+async def drift_summary(refresh: bool = False, mode: str = None, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    role = payload.get("role")
+    if role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    try:
+        # Compact JSON result, cheap enough to poll every few minutes
+        result = None if refresh else load_drift_result(DRIFT_REPORT_JSON)
+        if result is None or (mode is not None and result.get("mode") != mode):
+            # Extracts the features of every image: seconds to minutes, so off the event loop
+            result = await run_in_threadpool(generate_drift_report, mode=mode)
+        return result
+
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@app.get('/monitoring/text')
+async def text_drift(token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    role = payload.get("role")
+    if role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    try:
+        return text_monitor.compare()
+
+    except Exception as e:
+        return {"error": str(e)}
+
+
 @app.post('/vqa')
 async def question_image(question: str, file: UploadFile = File(...), token: str = Depends(oauth2_scheme) ):
     # username = decode_token(token)
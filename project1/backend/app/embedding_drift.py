@@ -0,0 +1,130 @@
+import os
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from torchvision import models, transforms
+
+from drift import ks_columns, STATTEST_THRESHOLD
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", 2))
+EMBEDDING_COMPONENTS = 32
+MMD_PERMUTATIONS = 200
+
+# Define transformation for the images (resize, normalize)
+transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+])
+
+_resnet = None
+
+
+def get_resnet():
+    """Pre-trained ResNet50 without its classification layer, loaded on first use."""
+    global _resnet
+    if _resnet is None:
+        resnet = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
+        resnet = torch.nn.Sequential(*(list(resnet.children())[:-1]))  # Remove the last layer (classification)
+        resnet.eval()  # Set the model to evaluation mode
+        _resnet = resnet
+    return _resnet
+
+
+class ImageFolderDataset(Dataset):
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        img = Image.open(self.paths[index])
+        # No need to decode 512x512 JPEGs at full size for a 224x224 input
+        if img.format == "JPEG":
+            img.draft('RGB', (224, 224))
+        return transform(img.convert('RGB'))
+
+
+def extract_embeddings(paths, cache, batch_size=EMBEDDING_BATCH_SIZE, num_workers=EMBEDDING_WORKERS):
+    """ResNet50 embeddings (n_images, 2048) for the given files, computed in batches and cached on disk."""
+    embeddings = {path: cache.get(path) for path in paths}
+    missing = [path for path, embedding in embeddings.items() if embedding is None]
+
+    if missing:
+        resnet = get_resnet()
+        loader = DataLoader(ImageFolderDataset(missing), batch_size=batch_size,
+                            num_workers=num_workers, shuffle=False)
+        done = 0
+        with torch.inference_mode():
+            for batch in loader:
+                features = resnet(batch).flatten(1).numpy().astype(np.float32)
+                for path, feature in zip(missing[done:done + len(features)], features):
+                    cache.put(path, feature)
+                    embeddings[path] = feature
+                done += len(features)
+        cache.save()
+
+    return np.stack([embeddings[path] for path in paths])
+
+
+def fit_pca(embeddings, n_components=EMBEDDING_COMPONENTS):
+    """PCA of the given embeddings. Returns (mean, components)."""
+    mean = embeddings.mean(axis=0)
+    _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+    return mean, vt[:n_components]
+
+
+def reduce_embeddings(embeddings, mean, components):
+    return (embeddings - mean) @ components.T
+
+
+def mmd_permutation_test(x, y, n_permutations=MMD_PERMUTATIONS, seed=0):
+    """MMD^2 with an RBF kernel (median heuristic) and a permutation p-value.
+
+    With w = (+1/n for x, -1/m for y), the biased MMD^2 estimate is w^T K w, so all
+    permutations are scored at once as rows of a weight matrix against the same kernel.
+    """
+    z = np.concatenate([x, y], axis=0).astype(np.float64)
+    n, m = len(x), len(y)
+
+    sq_norms = np.sum(z ** 2, axis=1)
+    sq_dists = np.maximum(sq_norms[:, None] + sq_norms[None, :] - 2 * z @ z.T, 0.0)
+    sigma2 = np.median(sq_dists[sq_dists > 0]) if np.any(sq_dists > 0) else 1.0
+    kernel = np.exp(-sq_dists / sigma2)
+
+    weights = np.concatenate([np.full(n, 1.0 / n), np.full(m, -1.0 / m)])
+    mmd2 = float(weights @ kernel @ weights)
+
+    rng = np.random.default_rng(seed)
+    permuted = np.stack([rng.permutation(weights) for _ in range(n_permutations)])
+    null = np.sum((permuted @ kernel) * permuted, axis=1)
+    p_value = (np.sum(null >= mmd2) + 1) / (n_permutations + 1)
+    return mmd2, float(p_value)
+
+
+def embedding_drift(reference, current, n_components=EMBEDDING_COMPONENTS, threshold=STATTEST_THRESHOLD,
+                    n_permutations=MMD_PERMUTATIONS):
+    """MMD on the reduced embeddings plus per-component KS with a Bonferroni correction.
+
+    The PCA is fitted on both samples together: a projection fitted on the reference alone
+    captures its own noise and makes an identical current sample look drifted.
+    """
+    mean, components = fit_pca(np.concatenate([reference, current], axis=0), n_components)
+    ref_reduced = reduce_embeddings(reference, mean, components)
+    cur_reduced = reduce_embeddings(current, mean, components)
+
+    mmd2, mmd_p_value = mmd_permutation_test(ref_reduced, cur_reduced, n_permutations)
+    _, ks_p_values = ks_columns(ref_reduced, cur_reduced)
+    ks_threshold = threshold / ref_reduced.shape[1]
+
+    return {
+        "n_components": int(ref_reduced.shape[1]),
+        "mmd2": round(mmd2, 6),
+        "mmd_p_value": round(mmd_p_value, 6),
+        "mmd_drift_detected": bool(mmd_p_value < threshold),
+        "ks_min_p_value": round(float(ks_p_values.min()), 6),
+        "ks_drift_detected": bool(ks_p_values.min() < ks_threshold),
+    }, ref_reduced, cur_reduced
@@ -1,67 +1,79 @@
 import os
 import pandas as pd
-from PIL import Image
-import torch
-from torchvision import models, transforms
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageStat
 import numpy as np
 from dotenv import load_dotenv
 
 
-from evidently.report import Report
-from evidently.metric_preset import DataDriftPreset, DataQualityPreset
-from alibi_detect.cd import KSDrift, ChiSquareDrift
+from drift import detect_drift, save_drift_result, render_drift_html
+from feature_cache import FeatureCache
+from text_drift import word_counts, token_buckets
 
 load_dotenv()
 DATA_FOR_DRIFT_PATH=os.getenv("DATA_FOR_DRIFT_PATH")
+# Written by generate_drift_report, read by the /monitoring endpoints
+DRIFT_REPORT_JSON=os.path.join(DATA_FOR_DRIFT_PATH or "", "drift_report.json")
+DRIFT_REPORT_HTML=os.path.join(DATA_FOR_DRIFT_PATH or "", "drift_report.html")
 WINDOWS_SIZE=800
+# JPEGs are decoded at a reduced scale no smaller than this (None decodes at full resolution)
+DRAFT_SIZE=128
+FEATURE_WORKERS=int(os.getenv("FEATURE_WORKERS", os.cpu_count() or 1))
+FEATURE_CACHE_PATH=os.getenv("FEATURE_CACHE_PATH", os.path.join(DATA_FOR_DRIFT_PATH or ".", "feature_cache"))
+# "rgb" compares channel means, "embedding" compares ResNet50 embeddings (see embedding_drift.py)
+DRIFT_MODE=os.getenv("DRIFT_MODE", "rgb")
 
-# Pre-trained ResNet for feature extraction
-# resnet = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
-# resnet = torch.nn.Sequential(*(list(resnet.children())[:-1]))  # Remove the last layer (classification)
-# resnet.eval()  # Set the model to evaluation mode
-
-# Define transformation for the images (resize, normalize)
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
-
-# def extract_features(img_path):
-#     img = Image.open(img_path).convert('RGB')
-#     img = transform(img).unsqueeze(0)  # Add batch dimension
-#     with torch.no_grad():
-#         features = resnet(img)
-#     return features.squeeze().numpy()  # Convert to numpy array
-
-def extract_rgb_features(img_path):
-    # Open the image and convert to RGB
-    img = Image.open(img_path).convert('RGB')
-    
-    # Convert image to a NumPy array
-    img_array = np.array(img)
-    
-    # Calculate the mean for each channel (R, G, B)
-    red_mean = np.mean(img_array[:, :, 0])
-    green_mean = np.mean(img_array[:, :, 1])
-    blue_mean = np.mean(img_array[:, :, 2])
-    
-    # Return as a NumPy array
+rgb_cache = FeatureCache(os.path.join(FEATURE_CACHE_PATH, "rgb_features.npz"))
+embedding_cache = FeatureCache(os.path.join(FEATURE_CACHE_PATH, "resnet50_embeddings.npz"))
+
+
+def extract_rgb_features(img_path, draft_size=DRAFT_SIZE):
+    img = Image.open(img_path)
+
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of the full 512x512
+    if draft_size is not None and img.format == "JPEG":
+        img.draft(img.mode, (draft_size, draft_size))
+
+    # Grayscale X-rays have R = G = B, so there is no need to expand them to RGB
+    if img.mode == "L":
+        mean = ImageStat.Stat(img).mean[0]
+        return np.array([mean, mean, mean])
+
+    if img.mode != "RGB":
+        img = img.convert('RGB')
+
+    # Channel means from the band histograms, without building a NumPy array of the image
+    red_mean, green_mean, blue_mean = ImageStat.Stat(img).mean[:3]
     return np.array([red_mean, green_mean, blue_mean])
 
 
+def list_image_paths(folder, windows_size=WINDOWS_SIZE):
+    paths = [os.path.join(folder, filename) for filename in sorted(os.listdir(folder))]
+    paths = [path for path in paths if os.path.isfile(path)]
+
+    # Keep only the most recent window of images
+    if windows_size is not None:
+        paths = sorted(paths, key=os.path.getmtime)[-windows_size:]
+    return paths
+
+
 # Load images and extract features from train and test datasets
-def load_images_from_folder(folder, windows_size=WINDOWS_SIZE):
-    features = []
-    for filename in os.listdir(folder):
-        img_path = os.path.join(folder, filename)
-        # feature = extract_features(img_path)
-        feature = extract_rgb_features(img_path)
-        features.append(feature)
-    return np.array(features)
+def load_images_from_folder(folder, windows_size=WINDOWS_SIZE, workers=FEATURE_WORKERS, cache=None):
+    cache = rgb_cache if cache is None else cache
+    paths = list_image_paths(folder, windows_size)
+
+    features = {path: cache.get(path) for path in paths}
+    missing = [path for path, feature in features.items() if feature is None]
+
+    if missing:
+        # PIL releases the GIL while decoding, so threads are enough to use every core
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, feature in zip(missing, pool.map(extract_rgb_features, missing)):
+                cache.put(path, feature)
+                features[path] = feature
+        cache.save()
 
-X_ref = load_images_from_folder(os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/re_512_3ch/Valid'))  # Path to your train images
-X_test = load_images_from_folder(os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/re_512_3ch/Test'))  # Path to your test images
+    return np.array([features[path] for path in paths])
 
 
 # def generate_drift_report():
@@ -85,45 +97,56 @@ X_test = load_images_from_folder(os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/r
     
 #     return report
 
-# Modify the function to create the Evidently report
-def generate_drift_report():
+def load_embedding_features(reference_folder, current_folder, windows_size=WINDOWS_SIZE):
+    """Reduced ResNet50 embeddings of both folders as DataFrames, plus the MMD drift summary."""
+    from embedding_drift import extract_embeddings, embedding_drift
+
+    ref_embeddings = extract_embeddings(list_image_paths(reference_folder, windows_size), embedding_cache)
+    cur_embeddings = extract_embeddings(list_image_paths(current_folder, windows_size), embedding_cache)
+    summary, ref_reduced, cur_reduced = embedding_drift(ref_embeddings, cur_embeddings)
+
+    feature_names = [f"embedding_{i}" for i in range(ref_reduced.shape[1])]
+    return pd.DataFrame(ref_reduced, columns=feature_names), pd.DataFrame(cur_reduced, columns=feature_names), summary
+
+
+# Drift is computed with the lightweight engine in drift.py; the Evidently HTML is only rendered on request
+def generate_drift_report(render_html=False, mode=None):
+    mode = DRIFT_MODE if mode is None else mode
     # Load the datasets and perform drift detection
     reference_path = "Cleanses csv tfrecords/df_train.csv"
     actual_path = "Cleanses csv tfrecords/df_val.csv"
     # length_drift, token_drift, reference_reports, actual_reports = check_columns_and_detect_drift(reference_path, actual_path)
 
-    # Load image datasets
-    X_ref = load_images_from_folder(os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/re_512_3ch/Valid'))  # Reference images
-    X_test = load_images_from_folder(os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/re_512_3ch/Test'))  # Test images
+    reference_folder = os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/re_512_3ch/Valid')  # Reference images
+    current_folder = os.path.join(DATA_FOR_DRIFT_PATH, 'mimic_dset/re_512_3ch/Test')  # Test images
 
-    # Prepare data for the report
-    feature_names = ["red_mean", "green_mean", "blue_mean"]
-    X_ref_df = pd.DataFrame(X_ref, columns=feature_names)
-    X_test_df = pd.DataFrame(X_test, columns=feature_names)
+    if mode == "embedding":
+        X_ref_df, X_test_df, embedding_summary = load_embedding_features(reference_folder, current_folder)
+    elif mode == "rgb":
+        # Load image datasets
+        X_ref = load_images_from_folder(reference_folder)
+        X_test = load_images_from_folder(current_folder)
 
-    # Create an Evidently report
-    report = Report(metrics=[
-        DataDriftPreset(num_stattest="ks", stattest_threshold=0.05),
-        DataQualityPreset()
-    ])
-    # print(length_drift, token_drift)
-    # Run the report on the datasets
-    report.run(reference_data=X_ref_df, current_data=X_test_df)
+        # Prepare data for the report
+        feature_names = ["red_mean", "green_mean", "blue_mean"]
+        X_ref_df = pd.DataFrame(X_ref, columns=feature_names)
+        X_test_df = pd.DataFrame(X_test, columns=feature_names)
+        embedding_summary = None
+    else:
+        raise ValueError(f"Unknown drift mode: {mode}")
 
-    # Log custom drift results to the report's metadata or save as json modifier le fichier json et reload...
-    # report.data['length_drift'] = {
-    #     "p_value": length_drift['data']['p_val'],  # P-value for length drift
-    #     "is_drift": length_drift['data']['is_drift']  # Drift detection result for length
-    # }
-    # report.data['token_drift'] = {
-    #     "p_value": token_drift['data']['p_val'],  # P-value for token drift
-    #     "is_drift": token_drift['data']['is_drift']  # Drift detection result for tokens
-    # }
+    # KS / PSI on all feature columns in one pass
+    result = detect_drift(X_ref_df, X_test_df)
+    result["mode"] = mode
+    if embedding_summary is not None:
+        result["embedding"] = embedding_summary
+        result["dataset_drift"] = result["dataset_drift"] or embedding_summary["mmd_drift_detected"]
+    save_drift_result(result, DRIFT_REPORT_JSON)
 
-    # Save the report as HTML
-    report.save_html(os.path.join(DATA_FOR_DRIFT_PATH, 'drift_report.html'))
+    if render_html:
+        render_drift_html(X_ref_df, X_test_df, DRIFT_REPORT_HTML)
 
-    return report
+    return result
 
 
 # _________________________________Test data___________________________________#
@@ -136,34 +159,20 @@ def check_columns_and_detect_drift(reference_path, actual_path):
 
     # Check for num_words column and create if not present
     if "num_words" not in reference_reports.columns:
-        reference_reports["num_words"] = reference_reports.text.apply(lambda x: len(x.split(" ")))
+        reference_reports["num_words"] = word_counts(reference_reports.text)
     if "num_words" not in actual_reports.columns:
-        actual_reports["num_words"] = actual_reports.text.apply(lambda x: len(x.split(" ")))
+        actual_reports["num_words"] = word_counts(actual_reports.text)
 
     # Use the token_count column if it exists, otherwise create it
     if "token_count" not in reference_reports.columns:
-        reference_reports["token_count"] = reference_reports["num_words"].apply(
-            lambda x: "small" if x <= 100 else ("medium" if x <= 250 else "large")
-        )
+        reference_reports["token_count"] = token_buckets(reference_reports["num_words"])
     if "token_count" not in actual_reports.columns:
-        actual_reports["token_count"] = actual_reports["num_words"].apply(
-            lambda x: "small" if x <= 100 else ("medium" if x <= 250 else "large")
-        )
-
-    # Extracting the arrays for drift detection
-    ref_num = np.array(reference_reports["num_words"])
-    actual_num = np.array(actual_reports["num_words"])
-
-    ref_token = np.array(reference_reports["token_count"])
-    actual_token = np.array(actual_reports["token_count"])
-
-    # Perform KS Drift Detection on word counts
-    length_drift_detector = KSDrift(ref_num, p_val=0.05)
-    length_drift_result = length_drift_detector.predict(actual_num, return_p_val=True)
+        actual_reports["token_count"] = token_buckets(actual_reports["num_words"])
 
-    # Perform Chi-Square Drift Detection on token counts
-    target_drift_detector = ChiSquareDrift(ref_token, p_val=0.05)
-    token_drift_result = target_drift_detector.predict(actual_token, return_p_val=True, return_distance=True)
+    # KS drift on word counts and chi-square drift on token buckets, computed together
+    result = detect_drift(reference_reports, actual_reports, columns=["num_words", "token_count"])
+    length_drift_result = result["columns"]["num_words"]
+    token_drift_result = result["columns"]["token_count"]
 
     return length_drift_result, token_drift_result, reference_reports, actual_reports
 
@@ -0,0 +1,61 @@
+import os
+import threading
+import numpy as np
+
+
+class FeatureCache:
+    """Per-file feature vectors keyed by path + modification time, persisted as a single .npz file.
+
+    A file whose mtime changed since its features were stored is treated as a miss.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # absolute path -> (mtime_ns, features)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            for key, mtime, features in zip(data["keys"], data["mtimes"], data["features"]):
+                self.entries[str(key)] = (int(mtime), features)
+        except (OSError, KeyError, ValueError):
+            # A corrupt or old-format cache is simply rebuilt
+            self.entries = {}
+
+    def save(self):
+        with self._lock:
+            if not self.entries:
+                return
+            keys = list(self.entries)
+            mtimes = np.array([self.entries[k][0] for k in keys], dtype=np.int64)
+            features = np.stack([self.entries[k][1] for k in keys])
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Write next to the target and rename, so readers never see a half-written cache
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(keys), mtimes=mtimes, features=features)
+        os.replace(tmp_path, self.path)
+
+    def get(self, file_path):
+        key = os.path.abspath(file_path)
+        mtime = os.stat(file_path).st_mtime_ns
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, file_path, features):
+        key = os.path.abspath(file_path)
+        mtime = os.stat(file_path).st_mtime_ns
+        with self._lock:
+            self.entries[key] = (mtime, np.asarray(features))
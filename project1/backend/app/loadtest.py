@@ -0,0 +1,124 @@
+import io
+import os
+import sys
+import json
+import argparse
+import tempfile
+import numpy as np
+import requests
+from PIL import Image
+
+from load_client import start_server, run_workload, summarize, format_report
+
+# Stages reported by the /generate_report/ endpoint in its Server-Timing header (see timing.py)
+STAGES = ["upload_parse", "preprocessing", "model", "serialization"]
+# Enough of a WordPiece vocabulary for the indication prompts: special tokens, letters and punctuation
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "[DEC]"]
+CHARACTERS = list("abcdefghijklmnopqrstuvwxyz0123456789") + list(",;:.-/()")
+
+
+def tiny_blip(workdir, max_length=64):
+    """A BlipMed with a randomly initialised, few-layer BLIP and a character-level tokenizer.
+
+    It is built offline with the same processor and generate() code paths as generate-cxr.
+    """
+    from transformers import BertTokenizer, BlipConfig, BlipForConditionalGeneration, BlipImageProcessor, BlipProcessor
+    from modelblip import BlipMed
+
+    vocab_path = os.path.join(workdir, "vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(SPECIAL_TOKENS + CHARACTERS + ["##" + c for c in CHARACTERS]))
+    tokenizer = BertTokenizer(vocab_path, bos_token="[DEC]")
+    processor = BlipProcessor(BlipImageProcessor(size={"height": 64, "width": 64}), tokenizer)
+
+    config = BlipConfig(
+        text_config=dict(vocab_size=tokenizer.vocab_size, hidden_size=32, encoder_hidden_size=32,
+                         num_hidden_layers=1, num_attention_heads=2, intermediate_size=64,
+                         max_position_embeddings=1024, pad_token_id=tokenizer.pad_token_id,
+                         bos_token_id=tokenizer.bos_token_id, sep_token_id=tokenizer.sep_token_id),
+        vision_config=dict(hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64,
+                           image_size=64, patch_size=16),
+    )
+    blip = BlipMed(processor=processor, model=BlipForConditionalGeneration(config).eval())
+    blip.max_lenght = max_length
+    return blip
+
+
+def load_app(stub, workdir, max_length=64, exported=False):
+    """Imports the FastAPI app of controller.py.
+
+    With stub, the generate-cxr model is replaced by tiny_blip before the controller creates
+    its BlipMed, so nothing is downloaded. With exported, the stand-in serves its TorchScript
+    export (see blip_export.py).
+    """
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    if stub:
+        os.environ.setdefault("DATA_FOR_DRIFT_PATH", workdir + os.sep)
+        import modelblip
+        stand_in = tiny_blip(workdir, max_length)
+        if exported:
+            from blip_export import export_torchscript
+            export_dir = export_torchscript(stand_in, os.path.join(workdir, "blip_torchscript"))
+            stand_in = modelblip.BlipMed(processor=stand_in.processor, export_dir=export_dir)
+            stand_in.max_lenght = max_length
+        modelblip.BlipMed = lambda **kwargs: stand_in
+
+    import controller
+    return controller.app
+
+
+def make_upload():
+    """JPEG bytes of a synthetic 512x512 chest X-ray sized image."""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(512, 512), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).convert("RGB").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def run_loadtest(num_requests=20, concurrency_levels=(1, 4), stub=True, warmup=1, max_length=64, exported=False):
+    """Serves project1 in-process and drives /generate_report/ with a synthetic X-ray, once per concurrency level."""
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    app = load_app(stub, workdir, max_length, exported)
+    image = make_upload()
+    server, base_url = start_server(app)
+
+    # The in-repo demo account, as the frontend logs in
+    token = requests.post(f"{base_url}/token", data={"username": "user", "password": "userpass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def send(session, worker, index):
+        files = {"file": (f"loadtest_{worker}.jpg", image, "image/jpeg")}
+        return session.post(f"{base_url}/generate_report/", files=files, headers=headers)
+
+    reports = []
+    try:
+        run_workload(send, warmup, 1)
+        for concurrency in concurrency_levels:
+            samples, wall_time = run_workload(send, num_requests, concurrency)
+            reports.append({"endpoint": "/generate_report/", "concurrency": concurrency, "stub": stub, "exported": exported,
+                            **summarize(samples, wall_time, STAGES)})
+    finally:
+        server.should_exit = True
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency load test of the report generation backend")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--real-model", action="store_true", help="serve generate-cxr instead of the tiny stand-in")
+    parser.add_argument("--max-length", type=int, default=64, help="generation length of the stand-in")
+    parser.add_argument("--exported", action="store_true", help="serve the TorchScript export of the model (see blip_export.py)")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    reports = run_loadtest(args.requests, args.concurrency, stub=not args.real_model, max_length=args.max_length,
+                           exported=args.exported)
+    for report in reports:
+        print(format_report(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+    else:
+        json.dump(reports, sys.stdout, indent=2)
@@ -8,29 +8,56 @@ from dotenv import load_dotenv
 from PIL import Image
 from transformers import BlipForConditionalGeneration, BlipProcessor
 
+from timing import stage, METRICS
+
+GENERATED_TOKENS = METRICS.counter("blip_generated_tokens_total", "Report tokens generated, prompt excluded", ("backend",))
+REPORT_TOKENS = METRICS.histogram("blip_report_tokens", "Tokens generated per report", ("backend",),
+                                  buckets=(16, 32, 64, 128, 256, 512, 1024))
+
 # INDICATION = 'RLL crackles, eval for pneumonia'
 INDICATION = 'New basal consolidation, eval for pneumonia; Moderate retrocardiac atelectasis, eval for pneumonia; Mild pulmonary edema, eval for pulmonary congestion; Severe cardiomegaly, eval for heart size; Small pleural effusions, eval for pleural abnormalities; Diffuse nodular parenchymal opacities, eval for possible malignancy; Trace bilateral pleural effusions, eval for effusion; No pneumothorax, eval for pneumothorax; Irregular pleural thickening, eval for tumor involvement; Atelectasis, eval for underlying cause'
 
 class BlipMed:
-    def __init__(self) :
-        self.processor = BlipProcessor.from_pretrained("nathansutton/generate-cxr")
-        self.model = BlipForConditionalGeneration.from_pretrained("nathansutton/generate-cxr")
+    def __init__(self, processor=None, model=None, export_dir=None) :
+        # processor / model default to the pretrained generate-cxr ones (loadtest.py passes a tiny stand-in)
+        # With export_dir, reports are generated by the TorchScript graphs of blip_export.py instead
+        self.exported = None
+        if export_dir:
+            from blip_export import ExportedBlip
+            self.exported = ExportedBlip(export_dir)
+            self.processor = BlipProcessor.from_pretrained(export_dir) if processor is None else processor
+            self.model = None
+        else:
+            self.processor = BlipProcessor.from_pretrained("nathansutton/generate-cxr") if processor is None else processor
+            self.model = BlipForConditionalGeneration.from_pretrained("nathansutton/generate-cxr") if model is None else model
         self.default_indication = INDICATION
         self.max_lenght = 1024
     
     def generate_report(self, image, my_indication=None):
         
         # process the inputs
-        text_input = 'indication: ' + (self.default_indication if my_indication is None else my_indication)
-        inputs = self.processor(
-            images=image, 
-            text=text_input,
-            return_tensors="pt"
-        )
+        with stage("preprocessing"):
+            text_input = 'indication: ' + (self.default_indication if my_indication is None else my_indication)
+            inputs = self.processor(
+                images=image, 
+                text=text_input,
+                return_tensors="pt"
+            )
         
         # generate an entire radiology report
-        output = self.model.generate(**inputs,max_length=self.max_lenght)
-        report = self.processor.decode(output[0], skip_special_tokens=True, clean_up_tokenization_spaces=False)
+        with stage("model"):
+            if self.exported is not None:
+                output = self.exported.generate(inputs["pixel_values"], inputs["input_ids"], max_length=self.max_lenght,
+                                                attention_mask=inputs.get("attention_mask"))
+            else:
+                output = self.model.generate(**inputs,max_length=self.max_lenght)
+        # Both paths return the prompt, whose trailing [SEP] is dropped, followed by the report
+        tokens = output.shape[1] - (inputs["input_ids"].shape[1] - 1)
+        backend = "torchscript" if self.exported is not None else "eager"
+        GENERATED_TOKENS.inc(tokens, backend=backend)
+        REPORT_TOKENS.observe(tokens, backend=backend)
+        with stage("serialization"):
+            report = self.processor.decode(output[0], skip_special_tokens=True, clean_up_tokenization_spaces=False)
         
         return report
     
@@ -0,0 +1,101 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from drift import ks_p_value, chi_square_counts, STATTEST_THRESHOLD
+
+# Reports are generated with max_length=1024 tokens, longer ones share the last bin
+MAX_WORDS = 1024
+TOKEN_BUCKETS = ["small", "medium", "large"]
+TOKEN_BUCKET_LIMITS = [100, 250]  # small <= 100 < medium <= 250 < large
+
+
+def word_counts(texts):
+    """Number of space-separated words of every text in a pandas Series."""
+    return texts.fillna("").astype(str).str.split(" ").str.len().to_numpy()
+
+
+def token_buckets(num_words):
+    """Bucket names (small / medium / large) for an array of word counts."""
+    return np.array(TOKEN_BUCKETS)[np.searchsorted(TOKEN_BUCKET_LIMITS, num_words, side="left")]
+
+
+class TextDriftMonitor:
+    """Running word-count histogram and token-bucket counts of generated reports.
+
+    The reference profile is computed once from the reference CSV; every new report
+    updates the current counts in O(1), and comparing only works on the two histograms.
+    """
+
+    def __init__(self, reference_path, threshold=STATTEST_THRESHOLD):
+        self.reference_path = reference_path
+        self.threshold = threshold
+        self.reference_words = None
+        self.reference_buckets = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.current_words = np.zeros(MAX_WORDS + 1, dtype=np.int64)
+            self.current_buckets = np.zeros(len(TOKEN_BUCKETS), dtype=np.int64)
+
+    def load_reference(self):
+        if self.reference_words is not None:
+            return
+        reports = pd.read_csv(self.reference_path)
+        if "num_words" in reports.columns:
+            num_words = reports["num_words"].to_numpy()
+        else:
+            num_words = word_counts(reports["text"])
+
+        self.reference_words = np.bincount(np.minimum(num_words, MAX_WORDS), minlength=MAX_WORDS + 1)
+        bucket_index = np.searchsorted(TOKEN_BUCKET_LIMITS, num_words, side="left")
+        self.reference_buckets = np.bincount(bucket_index, minlength=len(TOKEN_BUCKETS))
+
+    def update(self, report):
+        num_words = len(report.split(" "))
+        bucket = int(np.searchsorted(TOKEN_BUCKET_LIMITS, num_words, side="left"))
+        with self._lock:
+            self.current_words[min(num_words, MAX_WORDS)] += 1
+            self.current_buckets[bucket] += 1
+
+    def compare(self):
+        self.load_reference()
+        with self._lock:
+            current_words = self.current_words.copy()
+            current_buckets = self.current_buckets.copy()
+
+        n_reference = int(self.reference_words.sum())
+        n_current = int(current_words.sum())
+        result = {
+            "n_reference": n_reference,
+            "n_current": n_current,
+            "threshold": self.threshold,
+            "token_buckets": dict(zip(TOKEN_BUCKETS, current_buckets.tolist())),
+        }
+        if n_current == 0:
+            result.update({"length_drift": None, "token_drift": None})
+            return result
+
+        # Word counts are integers, so unit bins give the exact empirical CDFs
+        ref_cdf = np.cumsum(self.reference_words) / n_reference
+        cur_cdf = np.cumsum(current_words) / n_current
+        statistic = float(np.max(np.abs(ref_cdf - cur_cdf)))
+        p_value = float(ks_p_value(statistic, n_reference, n_current))
+        result["length_drift"] = {
+            "stattest": "ks",
+            "statistic": round(statistic, 6),
+            "p_value": round(p_value, 6),
+            "drift_detected": p_value < self.threshold,
+        }
+
+        statistic, p_value = chi_square_counts(self.reference_buckets, current_buckets)
+        result["token_drift"] = {
+            "stattest": "chisquare",
+            "statistic": round(statistic, 6),
+            "p_value": round(p_value, 6),
+            "drift_detected": p_value < self.threshold,
+        }
+        return result
@@ -0,0 +1,40 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+
+@pytest.fixture(scope="module")
+def exported(tmp_path_factory):
+    from loadtest import tiny_blip
+    from blip_export import export_torchscript, ExportedBlip
+
+    workdir = tmp_path_factory.mktemp("blip")
+    blip = tiny_blip(str(workdir), max_length=32)
+    export_dir = export_torchscript(blip, str(workdir / "blip_torchscript"))
+    return blip, ExportedBlip(export_dir)
+
+
+# A short prompt decoded for 16 tokens, and the default indication, longer than max_length
+@pytest.mark.parametrize("indication, new_tokens", [("effusion", 16), (None, None)])
+def test_exported_generate_matches_eager(exported, indication, new_tokens):
+    from blip_export import fixed_images
+
+    blip, exported_blip = exported
+    text = "indication: " + (blip.default_indication if indication is None else indication)
+    for image in fixed_images(3, size=64):
+        inputs = blip.processor(images=image, text=text, return_tensors="pt")
+        max_length = inputs["input_ids"].shape[1] + new_tokens if new_tokens else blip.max_lenght
+        expected = blip.model.generate(**inputs, max_length=max_length)
+        actual = exported_blip.generate(inputs["pixel_values"], inputs["input_ids"], max_length=max_length,
+                                        attention_mask=inputs["attention_mask"])
+        assert torch.equal(actual, expected)
+
+
+def test_prompt_without_trailing_sep_is_rejected(exported):
+    blip, exported_blip = exported
+    input_ids = blip.processor(text="indication: effusion", return_tensors="pt")["input_ids"]
+    with pytest.raises(ValueError):
+        exported_blip.prompt(input_ids[:, :-1])
+    with pytest.raises(ValueError):
+        exported_blip.prompt(input_ids, attention_mask=torch.zeros_like(input_ids))
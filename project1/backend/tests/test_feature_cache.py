@@ -0,0 +1,59 @@
+import os
+import numpy as np
+
+from feature_cache import FeatureCache
+
+
+def _image(tmp_path, name="a.jpg"):
+    path = tmp_path / name
+    path.write_bytes(b"jpeg bytes")
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    return str(path)
+
+
+def test_hit_after_put_and_miss_when_the_file_changes(tmp_path):
+    path = _image(tmp_path)
+    cache = FeatureCache(str(tmp_path / "cache.npz"))
+    assert cache.get(path) is None
+    cache.put(path, [0.1, 0.2, 0.3])
+    np.testing.assert_array_equal(cache.get(path), [0.1, 0.2, 0.3])
+
+    # Rewritten in place: same path, newer mtime
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert cache.get(path) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entries_survive_save_and_load(tmp_path):
+    first, second = _image(tmp_path, "a.jpg"), _image(tmp_path, "b.jpg")
+    cache_path = str(tmp_path / "cache" / "features.npz")
+    cache = FeatureCache(cache_path)
+    cache.put(first, [1.0, 2.0])
+    cache.put(second, [3.0, 4.0])
+    cache.save()
+
+    reloaded = FeatureCache(cache_path)
+    np.testing.assert_array_equal(reloaded.get(first), [1.0, 2.0])
+    np.testing.assert_array_equal(reloaded.get(second), [3.0, 4.0])
+    # Relative and absolute paths of a file share its entry
+    assert reloaded.get(os.path.relpath(first)) is not None
+
+
+def test_stale_entries_from_disk_are_misses(tmp_path):
+    path = _image(tmp_path)
+    cache_path = str(tmp_path / "cache.npz")
+    cache = FeatureCache(cache_path)
+    cache.put(path, [1.0])
+    cache.save()
+    os.utime(path, ns=(3_000_000_000, 3_000_000_000))
+    assert FeatureCache(cache_path).get(path) is None
+
+
+def test_corrupt_cache_file_starts_empty(tmp_path):
+    cache_path = tmp_path / "cache.npz"
+    cache_path.write_bytes(b"not an npz file")
+    cache = FeatureCache(str(cache_path))
+    assert cache.entries == {}
+    # Nothing to write: the corrupt file is left for the next save to replace
+    cache.save()
+    assert cache_path.read_bytes() == b"not an npz file"
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+stats = pytest.importorskip("scipy.stats")
+
+from text_drift import MAX_WORDS, TextDriftMonitor, token_buckets, word_counts
+
+
+def _report(num_words):
+    return " ".join(["opacity"] * num_words)
+
+
+@pytest.fixture
+def reference_path(tmp_path):
+    lengths = np.random.default_rng(0).integers(20, 200, size=300)
+    path = tmp_path / "reference.csv"
+    pd.DataFrame({"text": [_report(n) for n in lengths]}).to_csv(path, index=False)
+    return str(path), lengths
+
+
+def test_word_counts_and_buckets():
+    assert word_counts(pd.Series(["no acute findings", None, "effusion"])).tolist() == [3, 1, 1]
+    assert token_buckets(np.array([1, 100, 101, 250, 251, 5000])).tolist() == \
+        ["small", "small", "medium", "medium", "large", "large"]
+
+
+def test_no_reports_yet(reference_path):
+    result = TextDriftMonitor(reference_path[0]).compare()
+    assert result["n_current"] == 0
+    assert result["length_drift"] is None and result["token_drift"] is None
+
+
+def test_length_statistic_matches_ks_on_the_raw_counts(reference_path):
+    path, reference_lengths = reference_path
+    monitor = TextDriftMonitor(path)
+    current_lengths = np.random.default_rng(1).integers(20, 200, size=80)
+    for n in current_lengths:
+        monitor.update(_report(n))
+
+    result = monitor.compare()
+    expected = stats.ks_2samp(reference_lengths, current_lengths)
+    assert result["n_reference"] == 300 and result["n_current"] == 80
+    assert result["length_drift"]["statistic"] == pytest.approx(expected.statistic, abs=1e-6)
+    assert not result["length_drift"]["drift_detected"]
+    assert sum(result["token_buckets"].values()) == 80
+
+
+def test_longer_reports_drift_and_reset_clears_the_window(reference_path):
+    monitor = TextDriftMonitor(reference_path[0])
+    for _ in range(50):
+        monitor.update(_report(MAX_WORDS + 500))
+    result = monitor.compare()
+    assert result["length_drift"]["drift_detected"]
+    assert result["token_drift"]["drift_detected"]
+    assert result["token_buckets"] == {"small": 0, "medium": 0, "large": 50}
+    # Beyond MAX_WORDS every report shares the last bin
+    assert monitor.current_words[MAX_WORDS] == 50
+
+    monitor.reset()
+    assert monitor.compare()["n_current"] == 0
+
+
+def test_precomputed_word_counts_are_used(tmp_path):
+    path = tmp_path / "reference.csv"
+    pd.DataFrame({"num_words": [10, 150, 300]}).to_csv(path, index=False)
+    monitor = TextDriftMonitor(str(path))
+    monitor.load_reference()
+    assert monitor.reference_buckets.tolist() == [1, 1, 1]
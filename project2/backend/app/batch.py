@@ -0,0 +1,236 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from functools import partial
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nib
+
+from config import SEGMENT_CLASSES, INFERENCE_MODE, INFERENCE_MODES, SKIP_EMPTY_SLICES, TTA_VARIANTS
+from preprocess import build_input, inference_slab
+from postprocess import labels_of, label_image
+from prediction_cache import geometry_of
+from tta import MAX_VARIANTS
+
+# One case of a cohort: its ID and the paths of its flair and t1ce volumes
+BatchCase = namedtuple("BatchCase", ["case_id", "flair", "t1ce"])
+MODALITY_SUFFIXES = [".nii", ".nii.gz"]
+
+
+def _find_volume(case_dir, case_id, modality):
+    for suffix in MODALITY_SUFFIXES:
+        path = os.path.join(case_dir, f"{case_id}_{modality}{suffix}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def discover_cases(input_dir):
+    """BraTS case folders of input_dir (<case_id>/<case_id>_flair.nii and _t1ce.nii), sorted by ID.
+
+    Folders without both volumes are skipped.
+    """
+    cases = []
+    for case_id in sorted(os.listdir(input_dir)):
+        case_dir = os.path.join(input_dir, case_id)
+        if not os.path.isdir(case_dir):
+            continue
+        flair, t1ce = _find_volume(case_dir, case_id, "flair"), _find_volume(case_dir, case_id, "t1ce")
+        if flair and t1ce:
+            cases.append(BatchCase(case_id, flair, t1ce))
+    return cases
+
+
+def read_manifest(manifest_path):
+    """Cases of a CSV manifest with case_id, flair and t1ce columns; relative paths are relative to the manifest."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    cases = []
+    with open(manifest_path, newline="") as f:
+        for row in csv.DictReader(f):
+            flair, t1ce = (os.path.join(base_dir, row[column].strip()) for column in ["flair", "t1ce"])
+            cases.append(BatchCase(row["case_id"].strip(), flair, t1ce))
+    return cases
+
+
+def load_cases(input_path):
+    """Cases of a directory of case folders or of a .csv manifest."""
+    if os.path.isdir(input_path):
+        return discover_cases(input_path)
+    return read_manifest(input_path)
+
+
+def load_input(case, mode=INFERENCE_MODE):
+    """(model input X, flair geometry, first predicted slice) of one case in an inference mode."""
+    flair_image = nib.load(case.flair)
+    flair = flair_image.get_fdata(dtype=np.float32)
+    t1ce = nib.load(case.t1ce).get_fdata(dtype=np.float32)
+    start, count = inference_slab(mode, flair.shape[2])
+    return build_input(flair, t1ce, start, count), geometry_of(flair_image), start
+
+
+def volume_predictor(unet_model, tta=TTA_VARIANTS):
+    """predict_fn of the U-Net for any inference mode: chunked, skipping the slices without brain tissue."""
+    return partial(unet_model.predict_volume, skip_empty=SKIP_EMPTY_SLICES, tta=tta)
+
+
+def write_labels(labels, geometry, start, path):
+    """Writes a label volume in the input geometry, atomically so a killed run never leaves half a file."""
+    tmp_path = os.path.join(os.path.dirname(path), ".tmp-" + os.path.basename(path))
+    nib.save(label_image(labels, geometry, start), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class BatchPredictor:
+    """Predicts a cohort of cases and writes their label volumes to output_dir.
+
+    Reading and preprocessing of the next cases and writing of the previous ones run in
+    background threads while the current case is on the model, with at most `prefetch` inputs
+    and `writers` outputs in memory. Each case is logged to predictions.jsonl in output_dir once
+    its volume is written; a run resumes by skipping the cases already logged. Failed cases are
+    logged with their error and retried on the next run.
+    """
+
+    def __init__(self, predict_fn, cases, output_dir, prefetch=2, writers=1, suffix=".nii.gz", mode=INFERENCE_MODE,
+                 load_fn=load_input):
+        self.predict_fn = predict_fn
+        self.cases = list(cases)
+        self.output_dir = output_dir
+        self.prefetch = prefetch
+        self.writers = writers
+        self.suffix = suffix
+        self.mode = mode
+        self.load_fn = load_fn
+        self.log_path = os.path.join(output_dir, "predictions.jsonl")
+
+    def output_path(self, case_id):
+        return os.path.join(self.output_dir, f"{case_id}_pred{self.suffix}")
+
+    def load_log(self):
+        """Cases already written, by case_id."""
+        done = {}
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r") as f:
+                for line in f:
+                    # A run killed mid-write leaves an incomplete last line, that case is redone
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # Cases written in the other inference mode are predicted again
+                    if record.get("error") is None and record.get("mode") == self.mode and os.path.exists(record["path"]):
+                        done[record["case_id"]] = record
+                    else:
+                        done.pop(record["case_id"], None)
+        return done
+
+    def _write(self, case_id, labels, geometry, start):
+        write_labels(labels, geometry, start, self.output_path(case_id))
+        counts = np.bincount(labels.ravel(), minlength=len(SEGMENT_CLASSES))
+        return {"case_id": case_id, "path": self.output_path(case_id), "error": None,
+                "mode": self.mode, "slices": [start, start + len(labels)],
+                "voxels": {name: int(counts[c]) for c, name in SEGMENT_CLASSES.items()}}
+
+    def run(self, resume=True, progress_callback=None, should_stop=None):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not resume and os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        done = self.load_log() if resume else {}
+        todo = [case for case in self.cases if case.case_id not in done]
+        stats = {"cases": len(self.cases), "skipped": len(done), "predicted": 0, "failed": 0}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.prefetch) as readers, \
+                ThreadPoolExecutor(max_workers=self.writers) as writers, \
+                open(self.log_path, "a") as log:
+
+            def finish(case_id, future=None, error=None):
+                try:
+                    if error is not None:
+                        raise error
+                    record = future.result()
+                    stats["predicted"] += 1
+                except Exception as e:
+                    record = {"case_id": case_id, "path": None, "error": str(e)}
+                    stats["failed"] += 1
+                log.write(json.dumps(record) + "\n")
+                log.flush()
+                if progress_callback is not None:
+                    progress_callback(stats["skipped"] + stats["predicted"] + stats["failed"], stats["cases"])
+
+            pending, writing = deque(), deque()
+            next_case = 0
+            while next_case < len(todo) or pending:
+                while next_case < len(todo) and len(pending) < self.prefetch:
+                    case = todo[next_case]
+                    pending.append((case.case_id, readers.submit(self.load_fn, case, self.mode)))
+                    next_case += 1
+
+                if should_stop is not None and should_stop():
+                    for _, future in pending:
+                        future.cancel()
+                    break
+
+                case_id, future = pending.popleft()
+                try:
+                    X, geometry, start = future.result()
+                    # Only the uint8 labels are kept, not the float softmax
+                    labels = labels_of(self.predict_fn(X))
+                except Exception as e:
+                    finish(case_id, error=e)
+                    continue
+
+                # Bounded number of volumes waiting to be written
+                while len(writing) >= self.writers:
+                    finish(*writing.popleft())
+                writing.append((case_id, writers.submit(self._write, case_id, labels, geometry, start)))
+
+            while writing:
+                finish(*writing.popleft())
+
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        stats["output_dir"] = self.output_dir
+        return stats
+
+
+def load_unet(weights_path):
+    """The U-Net of a .keras model, or of an .onnx export on ONNX Runtime (without importing TensorFlow)."""
+    if weights_path.endswith(".onnx"):
+        from onnx_backend import OnnxUnet
+
+        return OnnxUnet(weights_path, img_size=128, num_classes=4)
+    from model import Unet
+
+    unet_model = Unet(img_size=128, num_classes=4)
+    unet_model.compile_and_load_weights(weights_path)
+    return unet_model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch segmentation of a cohort of BraTS cases")
+    parser.add_argument("input", help="directory of BraTS case folders, or a CSV manifest with case_id, flair and t1ce columns")
+    parser.add_argument("--output", required=True, help="directory of the predicted label volumes")
+    parser.add_argument("--weights", default="my_model.keras", help=".keras model, or .onnx export run with ONNX Runtime")
+    parser.add_argument("--prefetch", type=int, default=2, help="cases read and preprocessed ahead of the model")
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--mode", default=INFERENCE_MODE, choices=INFERENCE_MODES,
+                        help="window: the training slab only, full: every axial slice")
+    parser.add_argument("--tta", type=int, default=TTA_VARIANTS, choices=range(1, MAX_VARIANTS + 1),
+                        metavar="N", help="test-time augmentation variants averaged per slice")
+    parser.add_argument("--suffix", default=".nii.gz", choices=[".nii.gz", ".nii"])
+    parser.add_argument("--no-resume", action="store_true", help="predict every case again instead of skipping the ones already written")
+    args = parser.parse_args()
+
+    cases = load_cases(args.input)
+    unet_model = load_unet(args.weights)
+    predictor = BatchPredictor(volume_predictor(unet_model, args.tta), cases, args.output,
+                               prefetch=args.prefetch, writers=args.writers, suffix=args.suffix, mode=args.mode)
+
+    def report(done, total):
+        print(f"{done}/{total} cases", file=sys.stderr)
+
+    json.dump(predictor.run(resume=not args.no_resume, progress_callback=report), sys.stdout, indent=2)
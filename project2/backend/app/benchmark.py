@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import nibabel as nib
+import tensorflow as tf
+
+from config import IMG_SIZE, VOLUME_SLICES
+
+# Shape of a BraTS 2020 volume
+BRATS_SHAPE = (240, 240, 155)
+
+
+def make_synthetic_cases(directory, num_cases, shape=BRATS_SHAPE, seed=0):
+    """Writes num_cases BraTS-shaped cases (flair, t1ce, seg .nii files) laid out like the dataset."""
+    rng = np.random.default_rng(seed)
+    case_ids = [f"BraTS20_Training_{i:03d}" for i in range(1, num_cases + 1)]
+    for case_id in case_ids:
+        case_path = os.path.join(directory, case_id)
+        os.makedirs(case_path, exist_ok=True)
+        for modality in ["flair", "t1ce"]:
+            volume = rng.integers(0, 1000, size=shape).astype(np.int16)
+            nib.save(nib.Nifti1Image(volume, np.eye(4)), os.path.join(case_path, f"{case_id}_{modality}.nii"))
+        seg = rng.choice(np.array([0, 1, 2, 4], dtype=np.uint8), size=shape, p=[0.9, 0.03, 0.05, 0.02])
+        nib.save(nib.Nifti1Image(seg, np.eye(4)), os.path.join(case_path, f"{case_id}_seg.nii"))
+    return case_ids
+
+
+def _timed(fn, repeats):
+    """Best wall time of repeats calls to fn (the least disturbed by other load on the host)."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _generator(directory, case_ids):
+    """The training DataGenerator, reading the cases from directory."""
+    import eda
+    eda.TRAIN_DATASET_PATH = directory
+    return eda.DataGenerator(case_ids, dtype='float32')
+
+
+# The stages of DataGenerator batches, each timed with the generator's own method
+
+def bench_decode(generator, case_ids, repeats):
+    def run():
+        for case_id in case_ids:
+            generator.load_volumes(case_id)
+    seconds = _timed(run, repeats)
+    return {"seconds": seconds, "cases_per_sec": len(case_ids) / seconds}
+
+
+def bench_resize(generator, volumes, repeats):
+    def run():
+        for flair, t1ce, _ in volumes:
+            generator.resize_inputs(flair, t1ce)
+    seconds = _timed(run, repeats)
+    return {"seconds": seconds, "cases_per_sec": len(volumes) / seconds}
+
+
+def bench_one_hot(generator, volumes, repeats):
+    def run():
+        for _, _, seg in volumes:
+            generator.label_masks(seg).numpy()
+    seconds = _timed(run, repeats)
+    return {"seconds": seconds, "cases_per_sec": len(volumes) / seconds}
+
+
+def bench_pipeline_epoch(generator, case_ids, repeats):
+
+    def run():
+        for index in range(len(generator)):
+            generator[index]
+        generator.on_epoch_end()
+    seconds = _timed(run, repeats)
+    return {"seconds": seconds, "cases_per_sec": len(case_ids) / seconds}
+
+
+def bench_train_step(steps, warmup=2, mixed_precision=False, jit_compile=False):
+    from model import Unet
+
+    unet = Unet(img_size=IMG_SIZE, num_classes=4)
+    unet.compile_model(mixed_precision=mixed_precision, jit_compile=jit_compile)
+    rng = np.random.default_rng(0)
+    X = rng.random((VOLUME_SLICES, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32)
+    Y = np.eye(4, dtype=np.float32)[rng.integers(0, 4, size=(VOLUME_SLICES, IMG_SIZE, IMG_SIZE))]
+    # The first steps trace and compile the train function
+    for _ in range(warmup):
+        unet.model.train_on_batch(X, Y)
+    step_times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        unet.model.train_on_batch(X, Y)
+        step_times.append(time.perf_counter() - start)
+    step_time = float(np.median(step_times))
+    return {"step_time": step_time, "cases_per_sec": 1 / step_time, "slices_per_sec": VOLUME_SLICES / step_time}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(num_cases=4, repeats=3, train_steps=10, data_dir=None, only=None,
+                   mixed_precision=False, jit_compile=False):
+    """Runs the training pipeline benchmarks on synthetic cases and returns the report dict."""
+    def selected(name):
+        return only is None or name in only
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = data_dir or tmp_dir
+        case_ids = make_synthetic_cases(directory, num_cases)
+        generator = _generator(directory, case_ids)
+        if selected("nifti_decode"):
+            results["nifti_decode"] = bench_decode(generator, case_ids, repeats)
+        if selected("slice_resize") or selected("one_hot_mask"):
+            volumes = [generator.load_volumes(case_id) for case_id in case_ids]
+            if selected("slice_resize"):
+                results["slice_resize"] = bench_resize(generator, volumes, repeats)
+            if selected("one_hot_mask"):
+                results["one_hot_mask"] = bench_one_hot(generator, volumes, repeats)
+        if selected("pipeline_epoch"):
+            results["pipeline_epoch"] = bench_pipeline_epoch(generator, case_ids, repeats)
+    if selected("train_step"):
+        results["train_step"] = bench_train_step(train_steps, mixed_precision=mixed_precision, jit_compile=jit_compile)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "tensorflow": tf.__version__,
+            "devices": [d.name for d in tf.config.list_physical_devices()],
+            "num_cases": num_cases,
+            "repeats": repeats,
+            "mixed_precision": mixed_precision,
+            "jit_compile": jit_compile,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """Speedup of report over baseline (cases/sec ratio) for every benchmark in both."""
+    return {name: result["cases_per_sec"] / baseline["results"][name]["cases_per_sec"]
+            for name, result in report["results"].items() if name in baseline["results"]}
+
+
+BENCHMARKS = ["nifti_decode", "slice_resize", "one_hot_mask", "pipeline_epoch", "train_step"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Training pipeline throughput benchmarks on synthetic BraTS volumes")
+    parser.add_argument("--cases", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--train-steps", type=int, default=10)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=None)
+    parser.add_argument("--data-dir", default=None, help="write the synthetic cases here instead of a temporary directory")
+    parser.add_argument("--mixed-precision", action="store_true")
+    parser.add_argument("--jit-compile", action="store_true")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.cases, args.repeats, args.train_steps, args.data_dir, args.only,
+                            args.mixed_precision, args.jit_compile)
+    for name, result in report["results"].items():
+        print(f"{name:16s} {result['cases_per_sec']:10.2f} cases/sec", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            speedups = compare(report, json.load(f))
+        report["speedup_vs_baseline"] = speedups
+        for name, speedup in speedups.items():
+            print(f"{name:16s} {speedup:10.2f}x vs baseline", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
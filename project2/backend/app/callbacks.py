@@ -0,0 +1,35 @@
+import time
+import keras
+
+
+class ThroughputLogger(keras.callbacks.Callback):
+    """Adds the mean training step time and examples/sec of each epoch to the logs.
+
+    Put it before CSVLogger in the callbacks list so both columns end up in training.log.
+    """
+
+    def __init__(self, examples_per_step):
+        super().__init__()
+        self.examples_per_step = examples_per_step
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._steps = 0
+        self._step_time = 0.0
+        self._epoch_start = time.perf_counter()
+        self._train_end = self._epoch_start
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._train_end = time.perf_counter()
+        self._step_time += self._train_end - self._batch_start
+        self._steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None or self._steps == 0:
+            return
+        # Wall time of the training part of the epoch (data loading included, validation excluded)
+        train_time = self._train_end - self._epoch_start
+        logs["step_time"] = self._step_time / self._steps
+        logs["examples_per_sec"] = self._steps * self.examples_per_step / train_time
@@ -0,0 +1,185 @@
+import os
+import json
+import shutil
+import keras
+import numpy as np
+
+MANIFEST = "checkpoints.json"
+WEIGHTS_FILE = "model.weights.h5"
+OPTIMIZER_FILE = "optimizer.npz"
+STATE_FILE = "state.json"
+# Attributes of Keras callbacks carried from one epoch to the next (ReduceLROnPlateau, ModelCheckpoint, EarlyStopping)
+CALLBACK_STATE = ("best", "wait", "cooldown_counter")
+
+
+def _write_json(path, data):
+    # Write next to the target then rename, so a reader never sees a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_optimizer_state(model, path):
+    """Writes the variables of the model's optimizer (iteration count, moments) to an .npz file."""
+    np.savez(path, *[v.numpy() for v in model.optimizer.variables])
+
+
+def load_optimizer_state(model, path):
+    """Restores the optimizer variables written by save_optimizer_state."""
+    optimizer = model.optimizer
+    if not optimizer.built:
+        optimizer.build(model.trainable_variables)
+    with np.load(path) as saved:
+        values = [saved[f"arr_{i}"] for i in range(len(saved.files))]
+    if len(values) != len(optimizer.variables):
+        raise ValueError(f"{path} has {len(values)} optimizer variables, "
+                         f"the optimizer has {len(optimizer.variables)}.")
+    for variable, value in zip(optimizer.variables, values):
+        variable.assign(value)
+
+
+def callback_state(callback):
+    """The CALLBACK_STATE attributes a callback has, as JSON numbers."""
+    state = {}
+    for name in CALLBACK_STATE:
+        if hasattr(callback, name):
+            value = getattr(callback, name)
+            state[name] = int(value) if isinstance(value, (int, np.integer)) else float(value)
+    return state
+
+
+class CheckpointManager(keras.callbacks.Callback):
+    """Saves resumable training checkpoints (model weights, optimizer state, position in the data).
+
+    A checkpoint is written every `save_every_steps` training steps and at the end of every epoch.
+    Each one is built in a temporary directory and renamed into place, and the manifest listing
+    the usable checkpoints is replaced atomically afterwards, so a job killed mid-save always
+    leaves the previous checkpoint intact. The `keep_latest` most recent checkpoints and the
+    `keep_best` epoch-end checkpoints with the lowest `monitor` value are kept; the rest are deleted.
+
+    The state of the callbacks in `tracked_callbacks` (name -> callback, e.g. the plateau counter of
+    ReduceLROnPlateau and the best value of ModelCheckpoint) is saved with each checkpoint and put
+    back at the start of every fit, after Keras has reset it.
+    """
+
+    def __init__(self, directory, save_every_steps=100, keep_latest=2, keep_best=3, monitor="val_loss"):
+        super().__init__()
+        self.directory = directory
+        self.save_every_steps = save_every_steps
+        self.keep_latest = keep_latest
+        self.keep_best = keep_best
+        self.monitor = monitor
+        self.seed = None
+        self.step_offset = 0
+        self.tracked_callbacks = {}
+        self.callback_states = None
+        os.makedirs(directory, exist_ok=True)
+        self._remove_partial()
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {"latest": [], "best": []}
+        with open(path) as f:
+            return json.load(f)
+
+    def _remove_partial(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                path = os.path.join(self.directory, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    def latest_state(self):
+        """State dict of the most recent checkpoint, or None if there is none."""
+        if not self.manifest["latest"]:
+            return None
+        with open(os.path.join(self.directory, self.manifest["latest"][-1], STATE_FILE)) as f:
+            return json.load(f)
+
+    def restore(self, model):
+        """Loads the latest checkpoint into model and returns its state (None if there is nothing to resume)."""
+        state = self.latest_state()
+        if state is None:
+            return None
+        path = os.path.join(self.directory, self.manifest["latest"][-1])
+        model.load_weights(os.path.join(path, WEIGHTS_FILE))
+        load_optimizer_state(model, os.path.join(path, OPTIMIZER_FILE))
+        self.seed = state["seed"]
+        self.callback_states = state.get("callbacks")
+        return state
+
+    def save(self, epoch, step, logs=None, end_of_epoch=False):
+        name = f"ckpt-e{epoch:03d}-end" if end_of_epoch else f"ckpt-e{epoch:03d}-s{step:06d}"
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        os.makedirs(tmp_path)
+        self.model.save_weights(os.path.join(tmp_path, WEIGHTS_FILE))
+        save_optimizer_state(self.model, os.path.join(tmp_path, OPTIMIZER_FILE))
+        # Callbacks listed before this one have already updated their state for the epoch
+        self.callback_states = {name: callback_state(callback) for name, callback in self.tracked_callbacks.items()}
+        state = {"epoch": epoch, "step": step, "end_of_epoch": end_of_epoch, "seed": self.seed,
+                 "logs": {key: float(value) for key, value in (logs or {}).items()},
+                 "callbacks": self.callback_states}
+        _write_json(os.path.join(tmp_path, STATE_FILE), state)
+        if os.path.exists(path):
+            # Left over from a run killed before its manifest update, so nothing refers to it
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+        manifest = {"latest": [n for n in self.manifest["latest"] if n != name] + [name],
+                    "best": [b for b in self.manifest["best"] if b["name"] != name]}
+        if end_of_epoch and self.monitor in state["logs"]:
+            manifest["best"].append({"name": name, self.monitor: state["logs"][self.monitor]})
+            manifest["best"] = sorted(manifest["best"], key=lambda b: b[self.monitor])[:self.keep_best]
+        manifest["latest"] = manifest["latest"][-self.keep_latest:]
+        _write_json(os.path.join(self.directory, MANIFEST), manifest)
+
+        # Only delete once the new manifest no longer points at them
+        kept = set(manifest["latest"]) | {b["name"] for b in manifest["best"]}
+        previous = set(self.manifest["latest"]) | {b["name"] for b in self.manifest["best"]}
+        self.manifest = manifest
+        for stale in previous - kept:
+            shutil.rmtree(os.path.join(self.directory, stale), ignore_errors=True)
+
+    def on_train_begin(self, logs=None):
+        # ReduceLROnPlateau resets its counters in its own on_train_begin, which runs first
+        for name, values in (self.callback_states or {}).items():
+            callback = self.tracked_callbacks.get(name)
+            if callback is not None:
+                for attribute, value in values.items():
+                    setattr(callback, attribute, value)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._step = self.step_offset
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step = self.step_offset + batch + 1
+        if self.save_every_steps and self._step % self.save_every_steps == 0:
+            self.save(self._epoch, self._step, logs)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.step_offset = 0
+        self.save(epoch, self._step, logs, end_of_epoch=True)
+
+
+class ResumedEpoch(keras.utils.Sequence):
+    """The batches of a DataGenerator epoch from batch `start` on, to finish an interrupted epoch."""
+
+    def __init__(self, generator, start):
+        super().__init__()
+        self.generator = generator
+        self.start = start
+
+    def __len__(self):
+        return len(self.generator) - self.start
+
+    def __getitem__(self, index):
+        return self.generator[index + self.start]
+
+    def on_epoch_end(self):
+        self.generator.on_epoch_end()
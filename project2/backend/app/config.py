@@ -1,9 +1,47 @@
 
+import os
+
 # Select Slices and Image Size
+# The slab the model is trained and evaluated on, and inferred on in "window" mode
 VOLUME_SLICES = 100
 VOLUME_START_AT = 22
 IMG_SIZE = 128
+# Seed of the train/validation/test split, so every process (training, serving, evaluation) sees the same one
+SPLIT_SEED = int(os.getenv("SPLIT_SEED", 42))
+
+# Inference mode: "window" predicts the training slab only, "full" every axial slice of the volume
+INFERENCE_MODES = ["window", "full"]
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "window")
+# Slices per model call, bounds the activation memory whatever the volume depth
+INFERENCE_CHUNK_SLICES = 32
+# Slices with less brain tissue than this are predicted as background without running the model:
+# tissue is the flair above BRAIN_INTENSITY_THRESHOLD (scaled input), as a fraction of the slice
+SKIP_EMPTY_SLICES = True
+BRAIN_INTENSITY_THRESHOLD = 0.02
+MIN_TISSUE_FRACTION = 0.005
+# Test-time augmentation: flipped/rotated variants averaged per slice, 1 for none (see tta.py)
+TTA_VARIANTS = 1
+# Runtime of the U-Net at serving time: "keras" (my_model.keras) or "onnx" (my_model.onnx with
+# ONNX Runtime on CPU, exported by onnx_export.py)
+INFERENCE_BACKENDS = ["keras", "onnx"]
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+# Bytes of weights the model registry keeps loaded across versions (see registry.py)
+MODEL_MEMORY_BUDGET = int(os.getenv("MODEL_MEMORY_BUDGET", 2 * 1024 ** 3))
 MODELS_DIR = "./"
 DATASET_BASE_PATH = "./brain_data/BraTS2020/BraTS2020_TrainingData/MICCAI_BraTS2020_TrainingData"
-DRIFT_BASE_PATH="./brain_data/"
+DRIFT_BASE_PATH = os.getenv("PATH_FOR_DRIFT_REPORT", "./brain_data/")
+# Written by elt_report.generate_drift_report, read by /showdrift/
+DRIFT_REPORT_JSON = os.path.join(DRIFT_BASE_PATH, "drift_seg_report.json")
+DRIFT_REPORT_HTML = os.path.join(DRIFT_BASE_PATH, "drift_seg_report.html")
+
+EVALUATION_DIR="./evaluation/"
 
+# Define seg-areas
+SEGMENT_CLASSES = {
+    0 : 'NOT tumor',
+    1 : 'NECROTIC/CORE', # or NON-ENHANCING tumor CORE
+    2 : 'EDEMA',
+    3 : 'ENHANCING' # original 4 -> converted into 3
+}
+# BraTS label of each class index, written back in NIfTI outputs (enhancing tumour is 4 in BraTS, 3 in the model)
+BRATS_LABELS = [0, 1, 2, 4]
@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import subprocess
+import keras
+import numpy as np
+import tensorflow as tf
+from dotenv import load_dotenv
+from keras.callbacks import CSVLogger, ModelCheckpoint, ReduceLROnPlateau
+
+from config import IMG_SIZE, VOLUME_SLICES, SPLIT_SEED
+from eda import DataGenerator
+from callbacks import ThroughputLogger
+from metrics import segmentation_counts, SEGMENTATION_METRICS
+
+load_dotenv()
+MODELS_DIR = os.getenv('MODELS_DIR')
+# "default" (single device), "mirrored" (all local devices) or "multi_worker" (cluster from TF_CONFIG)
+TRAINING_STRATEGY = os.getenv('TRAINING_STRATEGY', 'default')
+
+
+def get_strategy(name=TRAINING_STRATEGY):
+    if name == "default":
+        return tf.distribute.get_strategy()
+    if name == "mirrored":
+        return tf.distribute.MirroredStrategy()
+    if name == "multi_worker":
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    raise ValueError(f"Unknown training strategy: {name}")
+
+
+def worker_info(strategy):
+    """(task_type, task_id, number of workers) of this process; (None, 0, 1) outside a cluster."""
+    resolver = getattr(strategy, "cluster_resolver", None)
+    if resolver is None or not resolver.cluster_spec().as_dict():
+        return None, 0, 1
+    cluster = resolver.cluster_spec().as_dict()
+    num_workers = len(cluster.get("worker", [])) + len(cluster.get("chief", []))
+    task_id = resolver.task_id
+    # With a separate chief task the workers come after it
+    if resolver.task_type == "worker" and "chief" in cluster:
+        task_id += 1
+    return resolver.task_type, task_id, num_workers
+
+
+def is_chief(task_type, task_id):
+    return task_type in (None, "chief") or (task_type == "worker" and task_id == 0)
+
+
+def shard_ids(ids, num_workers, worker_index):
+    return list(ids)[worker_index::num_workers]
+
+
+def make_dataset(generator, steps):
+    """tf.data pipeline yielding `steps` batches of a DataGenerator per epoch.
+
+    Auto-sharding is off since every worker already reads its own shard of ids.
+    """
+    def batches():
+        for index in range(steps):
+            yield generator[index]
+        generator.on_epoch_end()
+
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec(shape=(None, IMG_SIZE, IMG_SIZE, generator.n_channels), dtype=tf.float32),
+        tf.TensorSpec(shape=(None, IMG_SIZE, IMG_SIZE, 4), dtype=tf.float32),
+    ))
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options).repeat().prefetch(tf.data.AUTOTUNE)
+
+
+def _step_totals(y_true, y_pred):
+    """Per-replica sums the epoch logs are computed from, so they can be added across workers."""
+    y_true = tf.cast(y_true, tf.float32)
+    y_pred = tf.cast(y_pred, tf.float32)
+    return {
+        "correct": tf.reduce_sum(tf.cast(tf.equal(tf.argmax(y_true, -1), tf.argmax(y_pred, -1)), tf.float32)),
+        "pixels": tf.cast(tf.reduce_prod(tf.shape(y_true)[:-1]), tf.float32),
+        # Same (int cast) inputs as the compiled MeanIoU metric
+        "iou_confusion": tf.cast(tf.math.confusion_matrix(
+            tf.reshape(tf.cast(y_true, tf.int64), [-1]), tf.reshape(tf.cast(y_pred, tf.int64), [-1]),
+            num_classes=4, dtype=tf.int64), tf.float32),
+        "segmentation": segmentation_counts(y_true, y_pred),
+    }
+
+
+def _epoch_logs(totals, batches, prefix=""):
+    confusion = totals["iou_confusion"]
+    union = confusion.sum(axis=0) + confusion.sum(axis=1) - np.diag(confusion)
+    logs = {
+        "loss": totals["loss"] / batches,
+        "accuracy": totals["correct"] / totals["pixels"],
+        "mean_io_u": np.mean(np.diag(confusion)[union > 0] / union[union > 0]),
+    }
+    counts = tf.constant(totals["segmentation"])
+    logs.update({name: fn(counts) for name, fn in SEGMENTATION_METRICS})
+    return {prefix + name: float(value) for name, value in logs.items()}
+
+
+class DistributedTrainer:
+    """Custom train/validation loop for a compiled Unet under a tf.distribute strategy.
+
+    Keras' fit cannot reduce its scalar logs across MultiWorkerMirroredStrategy workers, so the
+    steps run through strategy.run and every per-replica sum (loss, pixel counts, segmentation
+    counts) is reduced explicitly. The usual Keras callbacks are driven with the resulting logs.
+    """
+
+    def __init__(self, unet, strategy, global_batch_size, jit_compile=False):
+        self.model = unet.model
+        self.optimizer = self.model.optimizer
+        self.strategy = strategy
+        self.global_batch_size = global_batch_size
+        with strategy.scope():
+            self.optimizer.build(self.model.trainable_variables)
+        self._train_step = tf.function(self._replica_train_step, jit_compile=jit_compile)
+        self._val_step = tf.function(self._replica_val_step, jit_compile=jit_compile)
+
+    def _loss(self, y_true, y_pred):
+        per_slice = tf.reduce_mean(keras.losses.categorical_crossentropy(y_true, tf.cast(y_pred, tf.float32)), axis=[1, 2])
+        return tf.nn.compute_average_loss(per_slice, global_batch_size=self.global_batch_size)
+
+    def _replica_train_step(self, X, Y):
+        with tf.GradientTape() as tape:
+            y_pred = self.model(X, training=True)
+            loss = self._loss(Y, y_pred)
+            scaled_loss = self.optimizer.scale_loss(loss)
+        gradients = tape.gradient(scaled_loss, self.model.trainable_variables)
+        self.optimizer.apply(gradients, self.model.trainable_variables)
+        return dict(_step_totals(Y, y_pred), loss=loss)
+
+    def _replica_val_step(self, X, Y):
+        y_pred = self.model(X, training=False)
+        return dict(_step_totals(Y, y_pred), loss=self._loss(Y, y_pred))
+
+    def _run(self, step, iterator, steps):
+        totals = None
+        for _ in range(steps):
+            per_replica = self.strategy.run(step, args=next(iterator))
+            # Reduced one tensor at a time: the multi-worker reduce does not take nested structures
+            reduced = {key: self.strategy.reduce(tf.distribute.ReduceOp.SUM, value, axis=None).numpy()
+                       for key, value in per_replica.items()}
+            totals = reduced if totals is None else {key: totals[key] + reduced[key] for key in totals}
+            yield totals
+
+    def fit(self, train_dataset, train_steps, val_dataset, val_steps, epochs, callbacks, verbose=1):
+        train_iterator = iter(self.strategy.experimental_distribute_dataset(train_dataset))
+        val_iterator = iter(self.strategy.experimental_distribute_dataset(val_dataset))
+        callbacks = keras.callbacks.CallbackList(callbacks, add_history=True, add_progbar=verbose != 0,
+                                                 model=self.model, epochs=epochs, steps=train_steps, verbose=verbose)
+        self.model.stop_training = False
+        callbacks.on_train_begin()
+        for epoch in range(epochs):
+            callbacks.on_epoch_begin(epoch)
+            running = self._run(self._train_step, train_iterator, train_steps)
+            for step in range(train_steps):
+                callbacks.on_train_batch_begin(step)
+                totals = next(running)
+                callbacks.on_train_batch_end(step, _epoch_logs(totals, step + 1))
+            logs = _epoch_logs(totals, train_steps)
+
+            for totals in self._run(self._val_step, val_iterator, val_steps):
+                pass
+            logs.update(_epoch_logs(totals, val_steps, prefix="val_"))
+            callbacks.on_epoch_end(epoch, logs)
+            if self.model.stop_training:
+                break
+        callbacks.on_train_end(logs)
+        return self.model.history
+
+
+def train_distributed(train_ids, val_ids, epochs=35, strategy_name=TRAINING_STRATEGY,
+                      mixed_precision=False, jit_compile=False, unet_kwargs=None):
+    """Builds, compiles and trains the Unet under a tf.distribute strategy.
+
+    Each worker trains on its own shard of train_ids (and val_ids). Every worker must run the
+    same number of steps, so epochs are cut to the smallest shard. Checkpoints and the CSV
+    log are only written by the chief.
+    """
+    from model import Unet
+
+    strategy = get_strategy(strategy_name)
+    task_type, task_id, num_workers = worker_info(strategy)
+    chief = is_chief(task_type, task_id)
+
+    train_steps = len(train_ids) // num_workers
+    val_steps = len(val_ids) // num_workers
+    if train_steps == 0 or val_steps == 0:
+        raise ValueError(f"Need at least {num_workers} train and validation cases, one per worker.")
+
+    with strategy.scope():
+        unet = Unet(img_size=IMG_SIZE, num_classes=4, **(unet_kwargs or {}))
+        unet.compile_model(mixed_precision=mixed_precision)
+
+    training_generator = DataGenerator(shard_ids(train_ids, num_workers, task_id), dtype='float32')
+    validation_generator = DataGenerator(shard_ids(val_ids, num_workers, task_id), shuffle=False, dtype='float32')
+    global_batch_size = training_generator.batch_size * VOLUME_SLICES * num_workers
+
+    callbacks = [
+        ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=2, min_lr=0.000001, verbose=1 if chief else 0),
+        ThroughputLogger(examples_per_step=global_batch_size),
+    ]
+    if chief:
+        callbacks += [
+            ModelCheckpoint(filepath=os.path.join(MODELS_DIR, 'model_.{epoch:02d}-{val_loss:.6f}.weights.h5'), verbose=1, save_best_only=True, save_weights_only=True),
+            CSVLogger(os.path.join(MODELS_DIR, 'training.log'), separator=',', append=False),
+        ]
+
+    trainer = DistributedTrainer(unet, strategy, global_batch_size, jit_compile=jit_compile)
+    history = trainer.fit(make_dataset(training_generator, train_steps), train_steps,
+                          make_dataset(validation_generator, val_steps), val_steps,
+                          epochs=epochs, callbacks=callbacks, verbose=1 if chief else 0)
+    return unet, history
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def launch_local_workers(num_workers, args):
+    """Runs num_workers multi-worker processes on this host (CPU only), one TF_CONFIG each."""
+    cluster = {"worker": [f"localhost:{_free_port()}" for _ in range(num_workers)]}
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ, CUDA_VISIBLE_DEVICES="", TRAINING_STRATEGY="multi_worker",
+                   TF_CONFIG=json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}}))
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), *args], env=env))
+    return max(p.wait() for p in processes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed U-Net training")
+    parser.add_argument("--epochs", type=int, default=35)
+    parser.add_argument("--strategy", default=TRAINING_STRATEGY, choices=["default", "mirrored", "multi_worker"])
+    parser.add_argument("--local-workers", type=int, default=0,
+                        help="spawn this many multi-worker processes on this host instead of training here")
+    parser.add_argument("--max-cases", type=int, default=None, help="only use the first N train/val cases")
+    parser.add_argument("--mixed-precision", action="store_true")
+    parser.add_argument("--jit-compile", action="store_true")
+    args, _ = parser.parse_known_args()
+
+    if args.local_workers:
+        forwarded = ["--epochs", str(args.epochs)]
+        if args.max_cases is not None:
+            forwarded += ["--max-cases", str(args.max_cases)]
+        forwarded += ["--mixed-precision"] * args.mixed_precision + ["--jit-compile"] * args.jit_compile
+        sys.exit(launch_local_workers(args.local_workers, forwarded))
+
+    from load_data import Datasource
+
+    # Same seed on every worker, so they all agree on the split before sharding it
+    source = Datasource()
+    source.pathListIntoIds(random_state=SPLIT_SEED)
+    train_ids, val_ids = source.train_ids[:args.max_cases], source.val_ids[:args.max_cases]
+
+    strategy = args.strategy if os.getenv("TF_CONFIG") is None else "multi_worker"
+    unet, _ = train_distributed(train_ids, val_ids, epochs=args.epochs, strategy_name=strategy,
+                                mixed_precision=args.mixed_precision, jit_compile=args.jit_compile)
@@ -0,0 +1,168 @@
+# Kept identical in project1/backend/app/drift.py and project2/backend/app/drift.py: each image only
+# copies its own backend/app. Change both (project2/backend/tests/test_shared_modules.py checks it).
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Defaults mirror the Evidently presets we used before (KS at 0.05, dataset drift at 50% of columns)
+STATTEST_THRESHOLD = 0.05
+DRIFT_SHARE = 0.5
+PSI_BINS = 10
+PSI_EPSILON = 1e-4
+
+
+def ks_columns(reference, current):
+    """Two-sample KS test on every column of two 2D arrays in one sorted pass.
+
+    Both samples are stacked and sorted per column; walking the sorted values, each
+    reference sample moves the CDF difference by +1/n and each current sample by -1/m,
+    so the KS statistic is the max absolute cumulative sum (evaluated after ties).
+
+    Returns:
+        (statistic, p_value): two arrays of shape (n_columns,)
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    n, m = reference.shape[0], current.shape[0]
+    if n == 0 or m == 0:
+        raise ValueError("Both reference and current data must contain at least one row.")
+
+    values = np.concatenate([reference, current], axis=0)
+    order = np.argsort(values, axis=0, kind="mergesort")
+    sorted_values = np.take_along_axis(values, order, axis=0)
+
+    steps = np.where(order < n, 1.0 / n, -1.0 / m)
+    cdf_diff = np.cumsum(steps, axis=0)
+
+    # Only the last position of a run of equal values is a valid point of comparison
+    last_of_run = np.ones(sorted_values.shape, dtype=bool)
+    last_of_run[:-1] = sorted_values[1:] != sorted_values[:-1]
+    statistic = np.max(np.abs(cdf_diff) * last_of_run, axis=0)
+
+    return statistic, ks_p_value(statistic, n, m)
+
+
+def ks_p_value(statistic, n, m):
+    """Same asymptotic two-sided distribution scipy.stats.ks_2samp uses for large samples."""
+    return np.clip(stats.kstwo.sf(statistic, np.round(n * m / (n + m))), 0.0, 1.0)
+
+
+def psi_columns(reference, current, bins=PSI_BINS):
+    """Population Stability Index of every column, using reference quantiles as bin edges."""
+    reference = np.asarray(reference, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    n_columns = reference.shape[1]
+
+    # Inner edges only: values below the first edge fall in bin 0, above the last in bin (bins - 1)
+    inner_edges = np.quantile(reference, np.linspace(0, 1, bins + 1)[1:-1], axis=0)
+    offsets = bins * np.arange(n_columns)
+
+    def proportions(data):
+        bin_index = (data[:, None, :] > inner_edges[None, :, :]).sum(axis=1)
+        counts = np.bincount((bin_index + offsets).ravel(), minlength=bins * n_columns)
+        counts = counts.reshape(n_columns, bins).T
+        return np.maximum(counts / data.shape[0], PSI_EPSILON)
+
+    ref_prop = proportions(reference)
+    cur_prop = proportions(current)
+    return np.sum((cur_prop - ref_prop) * np.log(cur_prop / ref_prop), axis=0)
+
+
+def chi_square_column(reference, current):
+    """Chi-square test of homogeneity between the category counts of two 1D samples."""
+    reference = np.asarray(reference).astype(str)
+    current = np.asarray(current).astype(str)
+    categories, codes = np.unique(np.concatenate([reference, current]), return_inverse=True)
+    if len(categories) < 2:
+        return 0.0, 1.0
+
+    n = len(reference)
+    return chi_square_counts(np.bincount(codes[:n], minlength=len(categories)),
+                             np.bincount(codes[n:], minlength=len(categories)))
+
+
+def chi_square_counts(reference_counts, current_counts):
+    """Chi-square test of homogeneity from per-category counts of two samples."""
+    table = np.vstack([reference_counts, current_counts])
+    table = table[:, table.sum(axis=0) > 0]
+    if table.shape[1] < 2 or np.any(table.sum(axis=1) == 0):
+        return 0.0, 1.0
+    statistic, p_value, _, _ = stats.chi2_contingency(table, correction=False)
+    return float(statistic), float(p_value)
+
+
+def detect_drift(reference_df, current_df, columns=None, threshold=STATTEST_THRESHOLD,
+                 drift_share=DRIFT_SHARE, psi_bins=PSI_BINS):
+    """Computes drift for all feature columns and returns a compact, JSON-serialisable result.
+
+    Numerical columns are tested together (KS + PSI), categorical columns with a chi-square test.
+    """
+    if columns is None:
+        columns = [c for c in reference_df.columns if c in current_df.columns]
+
+    numerical = [c for c in columns if pd.api.types.is_numeric_dtype(reference_df[c])]
+    categorical = [c for c in columns if c not in numerical]
+
+    results = {}
+    if numerical:
+        reference = reference_df[numerical].to_numpy(dtype=np.float64)
+        current = current_df[numerical].to_numpy(dtype=np.float64)
+        statistic, p_value = ks_columns(reference, current)
+        psi = psi_columns(reference, current, bins=psi_bins)
+        for i, column in enumerate(numerical):
+            results[column] = {
+                "stattest": "ks",
+                "statistic": round(float(statistic[i]), 6),
+                "p_value": round(float(p_value[i]), 6),
+                "psi": round(float(psi[i]), 6),
+                "drift_detected": bool(p_value[i] < threshold),
+            }
+
+    for column in categorical:
+        statistic, p_value = chi_square_column(reference_df[column], current_df[column])
+        results[column] = {
+            "stattest": "chisquare",
+            "statistic": round(statistic, 6),
+            "p_value": round(p_value, 6),
+            "drift_detected": bool(p_value < threshold),
+        }
+
+    n_drifted = sum(r["drift_detected"] for r in results.values())
+    share = n_drifted / len(results) if results else 0.0
+    return {
+        "n_reference": int(len(reference_df)),
+        "n_current": int(len(current_df)),
+        "threshold": threshold,
+        "n_drifted_columns": n_drifted,
+        "share_drifted_columns": round(share, 4),
+        "dataset_drift": bool(results) and share >= drift_share,
+        "columns": results,
+    }
+
+
+def save_drift_result(result, path):
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+
+def load_drift_result(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def render_drift_html(reference_df, current_df, path, threshold=STATTEST_THRESHOLD):
+    """Renders the full Evidently report. Expensive, so only call it when the HTML is requested."""
+    from evidently.report import Report
+    from evidently.metric_preset import DataDriftPreset, DataQualityPreset
+
+    report = Report(metrics=[
+        DataDriftPreset(num_stattest="ks", stattest_threshold=threshold),
+        DataQualityPreset()
+    ])
+    report.run(reference_data=reference_df, current_data=current_df)
+    report.save_html(path)
+    return report
@@ -5,21 +5,19 @@ import nibabel as nib
 from PIL import Image
 
 from dotenv import load_dotenv
-from evidently.report import Report
-from evidently.metric_preset import DataDriftPreset, DataQualityPreset
 # from alibi_detect.cd import KSDrift, ChiSquareDrift
+from drift import detect_drift, save_drift_result, render_drift_html
 
 from load_data import Datasource
-from eda import DataGenerator
+from config import SPLIT_SEED, DRIFT_REPORT_JSON, DRIFT_REPORT_HTML
 
 load_dotenv()
 DATASET_BASE_PATH=os.getenv("DATASET_BASE_PATH")
-PATH_FOR_DRIFT_REPORT=os.getenv("PATH_FOR_DRIFT_REPORT")
 WINDOWS_SIZE=800
 
 # Get a train data and test data windows 
 source_for_drift = Datasource()
-train_and_test_ids = source_for_drift.pathListIntoIds()
+train_and_test_ids = source_for_drift.pathListIntoIds(random_state=SPLIT_SEED)
 
 # Function to calculate the characteristics of an image
 def compute_features(image_data):
@@ -102,20 +100,17 @@ def load_images(test_ids, train_dataset_path, windows=None):
     return df
 
 
-def generate_drift_report():
+def generate_drift_report(render_html=False):
     
     df_train_ref = load_images(source_for_drift.train_ids, DATASET_BASE_PATH)
     df_test_actual = load_images( source_for_drift.test_ids, DATASET_BASE_PATH, WINDOWS_SIZE)
         
-    # Create an Evidently report
-    report = Report(metrics=[
-        DataDriftPreset(num_stattest="ks", stattest_threshold=0.05),
-        DataQualityPreset()
-    ])
-    
-    # Run the report on the datasets
-    report.run(reference_data=df_train_ref, current_data=df_test_actual)
-    # Save the report as HTML
-    report.save_html(os.path.join(PATH_FOR_DRIFT_REPORT, 'drift_seg_report.html'))
+    # KS / PSI on all feature columns in one pass
+    result = detect_drift(df_train_ref, df_test_actual)
+    save_drift_result(result, DRIFT_REPORT_JSON)
+
+    # The Evidently HTML is expensive, only render it when asked
+    if render_html:
+        render_drift_html(df_train_ref, df_test_actual, DRIFT_REPORT_HTML)
 
-    return report
\ No newline at end of file
+    return result
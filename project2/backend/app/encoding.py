@@ -0,0 +1,88 @@
+import io
+import gzip
+import numpy as np
+import nibabel as nib
+
+from config import VOLUME_START_AT
+from postprocess import labels_of, brats_labels, segmentation_bytes
+
+# Response formats of a (slices, H, W, classes) softmax prediction
+JSON = "application/json"            # legacy: the full float probabilities as nested lists
+NPY = "application/x-npy"            # argmax labels (or float16 probabilities) as one .npy array
+NPZ = "application/x-npz"            # compressed .npz with "labels" and optionally "probabilities"
+NIFTI = "application/x-nifti"        # BraTS labels (0, 1, 2, 4) as a gzipped .nii.gz volume in the input geometry
+MEDIA_TYPES = [JSON, NPY, NPZ, NIFTI]
+
+
+def negotiate(accept, supported=MEDIA_TYPES, default=JSON):
+    """Best supported media type for an Accept header, the default when any type is fine,
+    None when nothing acceptable is supported."""
+    if not accept:
+        return default
+    candidates = []
+    for position, entry in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, position, media_type.lower()))
+    for _, _, media_type in sorted(candidates):
+        if media_type in ("*/*", "application/*"):
+            return default
+        if media_type in supported:
+            return media_type
+    return None
+
+
+def _npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def encode_prediction(prediction, media_type, probabilities=False, accept_gzip=False, reference=None,
+                      start=VOLUME_START_AT):
+    """Encodes a prediction as (body bytes, extra response headers) in a binary media type.
+
+    The labels are the argmax class per voxel; probabilities adds the per-class softmax as float16
+    (npy returns only the probabilities then, npz both). NIfTI only carries the labels, as BraTS
+    labels (class 3, enhancing tumour, written as 4 like the input segmentations), mapped back
+    to the shape, affine and header of the reference input image (see postprocess.py) with the
+    first predicted slice at axial index start, or at model resolution with an identity affine
+    without one.
+    """
+    headers = {}
+    if media_type == NPY:
+        body = _npy_bytes(prediction.astype(np.float16) if probabilities else labels_of(prediction))
+        # .npy is uncompressed, unlike npz and .nii.gz
+        if accept_gzip:
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+    elif media_type == NPZ:
+        arrays = {"labels": labels_of(prediction)}
+        if probabilities:
+            arrays["probabilities"] = prediction.astype(np.float16)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        body = buffer.getvalue()
+    elif media_type == NIFTI:
+        if probabilities:
+            raise ValueError("NIfTI responses only carry the labels, request npz for probabilities")
+        if reference is not None:
+            body = segmentation_bytes(prediction, reference, start)
+        else:
+            volume = np.ascontiguousarray(brats_labels(labels_of(prediction)).transpose(1, 2, 0))
+            image = nib.Nifti1Image(volume, np.eye(4))
+            image.set_data_dtype(np.uint8)
+            body = gzip.compress(image.to_bytes(), compresslevel=1)
+        headers["Content-Disposition"] = 'attachment; filename="segmentation.nii.gz"'
+    else:
+        raise ValueError(f"Unsupported media type: {media_type}")
+    headers["X-Prediction-Shape"] = ",".join(str(n) for n in prediction.shape)
+    return body, headers
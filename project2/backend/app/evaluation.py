@@ -0,0 +1,168 @@
+import os
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from config import SEGMENT_CLASSES
+from preprocess import load_case
+
+NUM_CLASSES = len(SEGMENT_CLASSES)
+CLASS_KEYS = ["Not tumor", "Necrotic", "Edema", "Enhancing"]
+# Probabilities are clipped like Keras' categorical_crossentropy before taking the log
+EPSILON = 1e-7
+
+
+def confusion_matrix(labels, predicted, num_classes=NUM_CLASSES):
+    """(num_classes, num_classes) confusion matrix, rows = ground truth, columns = prediction."""
+    index = labels.astype(np.int64).ravel() * num_classes + predicted.astype(np.int64).ravel()
+    return np.bincount(index, minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.full(numerator.shape, np.nan), where=denominator > 0)
+
+
+def metrics_from_confusion(cm):
+    """Per-class dice, precision, sensitivity and specificity from a confusion matrix."""
+    cm = cm.astype(np.float64)
+    tp = np.diag(cm)
+    fp = cm.sum(axis=0) - tp
+    fn = cm.sum(axis=1) - tp
+    tn = cm.sum() - tp - fp - fn
+    return {
+        "accuracy": tp.sum() / cm.sum() if cm.sum() > 0 else np.nan,
+        "iou": _ratio(tp, tp + fp + fn),
+        "dice": _ratio(2 * tp, 2 * tp + fp + fn),
+        "precision": _ratio(tp, tp + fp),
+        "sensitivity": _ratio(tp, tp + fn),
+        "specificity": _ratio(tn, tn + fp),
+    }
+
+
+def cross_entropy_sum(labels, probabilities):
+    """Summed categorical cross-entropy of the softmax against integer labels, over all voxels."""
+    p = np.take_along_axis(probabilities, labels.astype(np.int64)[..., None], axis=-1)
+    return float(-np.log(np.clip(p, EPSILON, 1.0)).sum())
+
+
+def _to_json(value):
+    value = np.asarray(value, dtype=np.float64)
+    if value.ndim == 0:
+        return None if np.isnan(value) else round(float(value), 4)
+    return [_to_json(v) for v in value]
+
+
+def summarize(confusions, case_metrics, cross_entropy=None):
+    """Flat metric dict: aggregate (summed confusion) metrics per class plus mean per-case dice.
+
+    Has the keys of the former Keras model.evaluate result (Loss, Accuracy, MeanIOU, ...);
+    cross_entropy is the (summed cross-entropy, voxels) of the cases, Loss is None without it.
+    """
+    confusion = np.sum(confusions, axis=0)
+    metrics = metrics_from_confusion(confusion)
+    loss = cross_entropy[0] / cross_entropy[1] if cross_entropy and cross_entropy[1] else np.nan
+    summary = {
+        "Cases": len(confusions),
+        "Loss": _to_json(loss),
+        "Accuracy": _to_json(metrics["accuracy"]),
+        # Mean over the classes present in the labels or the prediction, as keras.metrics.MeanIoU
+        "MeanIOU": _to_json(np.nanmean(metrics["iou"])),
+        "Dice coefficient": _to_json(np.nanmean(metrics["dice"])),
+        "Precision": _to_json(np.nanmean(metrics["precision"][1:])),
+        "Sensitivity": _to_json(np.nanmean(metrics["sensitivity"][1:])),
+        "Specificity": _to_json(np.nanmean(metrics["specificity"][1:])),
+    }
+    for c in range(1, NUM_CLASSES):
+        for name in ["dice", "precision", "sensitivity", "specificity"]:
+            summary[f"{name.capitalize()} {CLASS_KEYS[c]}"] = _to_json(metrics[name][c])
+        summary[f"Dice coef {CLASS_KEYS[c]}"] = summary[f"Dice {CLASS_KEYS[c]}"]
+
+    case_dice = np.array([m["dice"] for m in case_metrics], dtype=np.float64)
+    for c in range(1, NUM_CLASSES):
+        summary[f"Mean case dice {CLASS_KEYS[c]}"] = _to_json(np.nanmean(case_dice[:, c]))
+    return summary
+
+
+class StreamingEvaluator:
+    """Streams test cases through the model one volume at a time.
+
+    The next cases are loaded in background threads while the current one runs through the
+    model, per-case results are appended to a JSON lines file as they are produced, and a run
+    resumes from that file by skipping the cases already in it.
+    """
+
+    def __init__(self, predict_fn, case_ids, results_path, prefetch=2, load_fn=load_case):
+        self.predict_fn = predict_fn
+        self.case_ids = list(case_ids)
+        self.results_path = results_path
+        self.prefetch = prefetch
+        self.load_fn = load_fn
+
+    def load_results(self):
+        results = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r") as f:
+                for line in f:
+                    # A run killed mid-write leaves an incomplete last line, that case is redone
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    results[record["case_id"]] = record
+        return results
+
+    def run(self, resume=True, progress_callback=None, should_stop=None):
+        done = self.load_results() if resume else {}
+        if not resume and os.path.exists(self.results_path):
+            os.remove(self.results_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.results_path)), exist_ok=True)
+
+        todo = [case_id for case_id in self.case_ids if case_id not in done]
+        records = [done[case_id] for case_id in self.case_ids if case_id in done]
+
+        with ThreadPoolExecutor(max_workers=self.prefetch) as pool, open(self.results_path, "a") as out:
+            pending = deque()
+            next_case = 0
+            while next_case < len(todo) or pending:
+                while next_case < len(todo) and len(pending) < self.prefetch:
+                    pending.append((todo[next_case], pool.submit(self.load_fn, todo[next_case])))
+                    next_case += 1
+
+                if should_stop is not None and should_stop():
+                    for _, future in pending:
+                        future.cancel()
+                    break
+
+                case_id, future = pending.popleft()
+                X, labels = future.result()
+                probabilities = self.predict_fn(X)
+                predicted = np.argmax(probabilities, axis=-1)
+
+                cm = confusion_matrix(labels, predicted)
+                metrics = metrics_from_confusion(cm)
+                record = {
+                    "case_id": case_id,
+                    "confusion": cm.tolist(),
+                    "cross_entropy": cross_entropy_sum(labels, probabilities),
+                    "dice": _to_json(metrics["dice"]),
+                    "precision": _to_json(metrics["precision"]),
+                    "sensitivity": _to_json(metrics["sensitivity"]),
+                    "specificity": _to_json(metrics["specificity"]),
+                }
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                records.append(record)
+
+                if progress_callback is not None:
+                    progress_callback(len(records), len(self.case_ids))
+
+        if not records:
+            return {"Cases": 0}
+        confusions = np.array([r["confusion"] for r in records])
+        case_metrics = [metrics_from_confusion(np.asarray(r["confusion"])) for r in records]
+        # Records written before the loss was stored do not count towards it
+        with_loss = [r for r in records if "cross_entropy" in r]
+        cross_entropy = (sum(r["cross_entropy"] for r in with_loss),
+                         sum(int(np.sum(r["confusion"])) for r in with_loss))
+        return summarize(confusions, case_metrics, cross_entropy)
@@ -0,0 +1,49 @@
+import threading
+import numpy as np
+
+from config import INFERENCE_CHUNK_SLICES
+from preprocess import tissue_slices
+from tta import augment, merge
+
+
+class SliceCounter:
+    """Slices run through the model and skipped as background, since startup."""
+
+    def __init__(self):
+        self.predicted = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def add(self, predicted, skipped):
+        with self._lock:
+            self.predicted += predicted
+            self.skipped += skipped
+
+    def to_dict(self):
+        with self._lock:
+            return {"predicted": self.predicted, "skipped": self.skipped}
+
+
+def predict_volume(predict_slices, X, num_classes, chunk_slices=INFERENCE_CHUNK_SLICES, skip_empty=False, tta=1,
+                   counter=None):
+    """Softmax of every slice of X with predict_slices, at most chunk_slices per call.
+
+    With skip_empty, slices with too little brain tissue (see preprocess.tissue_slices) are not
+    run through the model and predicted as background; both are counted in counter.
+    With tta > 1, the softmax is the mean over that many flipped/rotated variants of each slice
+    (see tta.py), all run in the same call as their slice.
+    """
+    prediction = np.zeros((*X.shape[:3], num_classes), dtype=np.float32)
+    prediction[..., 0] = 1
+    indices = tissue_slices(X) if skip_empty else np.arange(len(X))
+    # The variants share the batch, so a call still holds at most chunk_slices slices
+    step = max(1, chunk_slices // tta)
+    for chunk_start in range(0, len(indices), step):
+        chunk = indices[chunk_start:chunk_start + step]
+        if tta > 1:
+            prediction[chunk] = merge(predict_slices(augment(X[chunk], tta)), tta)
+        else:
+            prediction[chunk] = predict_slices(X[chunk])
+    if counter is not None:
+        counter.add(len(indices), len(X) - len(indices))
+    return prediction
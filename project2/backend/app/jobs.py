@@ -0,0 +1,147 @@
+import os
+import json
+import uuid
+import queue
+import threading
+import traceback
+from datetime import datetime, timezone
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Job:
+    def __init__(self, name, fn, cache_key=None, metadata=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.fn = fn
+        self.cache_key = cache_key
+        self.metadata = metadata or {}
+        self.status = "queued"
+        self.progress = {"done": 0, "total": None}
+        self.result = None
+        self.error = None
+        self.cached = False
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    def set_progress(self, done, total=None):
+        self.progress = {"done": done, "total": total}
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "cached": self.cached,
+            "result": self.result,
+            "error": self.error,
+            "metadata": self.metadata,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs long jobs (evaluation, batch prediction) on background worker threads.
+
+    Jobs submitted with a cache_key are only run once: the results of finished jobs are
+    persisted to history_path, and submitting the same key again returns the stored result
+    (or the job already queued/running for that key).
+    """
+
+    def __init__(self, history_path=None, workers=1):
+        self.history_path = history_path
+        self.jobs = {}
+        self.history = self._load_history()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _load_history(self):
+        if self.history_path is None or not os.path.exists(self.history_path):
+            return []
+        with open(self.history_path, "r") as f:
+            return json.load(f)
+
+    def _save_history(self):
+        if self.history_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.history_path)), exist_ok=True)
+        tmp_path = self.history_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.history, f, indent=2)
+        os.replace(tmp_path, self.history_path)
+
+    def submit(self, name, fn, cache_key=None, metadata=None):
+        """Queues fn(job). Returns the Job, already finished if cache_key has a stored result."""
+        with self._lock:
+            if cache_key is not None:
+                for record in reversed(self.history):
+                    if record["cache_key"] == cache_key:
+                        job = Job(name, fn, cache_key, metadata)
+                        job.status, job.cached, job.result = "done", True, record["result"]
+                        job.started_at = job.finished_at = record["finished_at"]
+                        self.jobs[job.id] = job
+                        return job
+                for job in self.jobs.values():
+                    if job.cache_key == cache_key and job.status in ("queued", "running"):
+                        return job
+
+            job = Job(name, fn, cache_key, metadata)
+            self.jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and job.status in ("queued", "running"):
+            job.cancel()
+        return job
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job.is_cancelled():
+                job.status, job.finished_at = "cancelled", _now()
+                continue
+
+            job.status, job.started_at = "running", _now()
+            try:
+                result = job.fn(job)
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+                traceback.print_exc()
+            else:
+                job.result = result
+                job.status = "cancelled" if job.is_cancelled() else "done"
+            job.finished_at = _now()
+
+            if job.status == "done" and job.cache_key is not None:
+                with self._lock:
+                    self.history.append({
+                        "cache_key": job.cache_key,
+                        "name": job.name,
+                        "metadata": job.metadata,
+                        "result": job.result,
+                        "finished_at": job.finished_at,
+                    })
+                    self._save_history()
@@ -0,0 +1,108 @@
+# Kept identical in project1/backend/app/load_client.py and project2/backend/app/load_client.py: each image only
+# copies its own backend/app. Change both (project2/backend/tests/test_shared_modules.py checks it).
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+PERCENTILES = [50, 95, 99]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app):
+    """Serves app with uvicorn on a background thread of this process; returns (server, base_url)."""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def parse_server_timing(header):
+    """{stage: seconds} from a Server-Timing header value."""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                stages[name] = float(value) / 1000
+    return stages
+
+
+def run_workload(send, num_requests, concurrency):
+    """Sends num_requests requests from `concurrency` client threads.
+
+    send(session, worker, index) does one request and returns the response. Each sample holds
+    the client-side latency, the status code and the server stage durations.
+    """
+    local = threading.local()
+    counter = iter(range(num_requests))
+    lock = threading.Lock()
+    samples = []
+
+    def worker(worker_id):
+        local.session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            try:
+                response = send(local.session, worker_id, index)
+                status, stages = response.status_code, parse_server_timing(response.headers.get("Server-Timing"))
+            except requests.RequestException:
+                status, stages = None, {}
+            latency = time.perf_counter() - start
+            with lock:
+                samples.append({"latency": latency, "status": status, "stages": stages})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+
+
+def summarize(samples, wall_time, stages):
+    """Throughput and latency percentiles (seconds), in total and per server stage.
+
+    "other" is the part of the client latency outside every reported stage: HTTP transfer,
+    multipart parsing by the framework and queueing behind other requests.
+    """
+    ok = [s for s in samples if s["status"] == 200]
+    latencies = np.array([s["latency"] for s in ok])
+    breakdown = {name: _percentiles([s["stages"][name] for s in ok if name in s["stages"]]) for name in stages}
+    breakdown["other"] = _percentiles([s["latency"] - sum(s["stages"].values()) for s in ok])
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "wall_time": wall_time,
+        "throughput": len(ok) / wall_time if wall_time > 0 else None,
+        "latency": _percentiles(latencies),
+        "stages": breakdown,
+    }
+
+
+def format_report(report):
+    latency = report["latency"]
+    if latency["p50"] is None:
+        return f"concurrency={report['concurrency']:3d} no successful requests, errors={report['errors']}"
+    return (f"concurrency={report['concurrency']:3d} {report['throughput']:.2f} req/s "
+            f"p50={latency['p50']:.3f}s p95={latency['p95']:.3f}s p99={latency['p99']:.3f}s errors={report['errors']}")
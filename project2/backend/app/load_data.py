@@ -8,7 +8,6 @@ import shutil
 import numpy as np
 import pandas as pd
 import matplotlib
-import matplotlib.pyplot as plt
 from skimage import data
 from skimage.util import montage
 import skimage.transform as skTrans
@@ -16,19 +15,10 @@ from skimage.transform import rotate
 from skimage.transform import resize
 from PIL import Image, ImageOps
 import nibabel as nib
-import keras
-# import keras.backend as K
-import tensorflow.keras.backend as K
-from keras.callbacks import CSVLogger
-import tensorflow as tf
-from tensorflow.keras.utils import plot_model
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
-from tensorflow.keras.models import *
-from tensorflow.keras.layers import *
-from tensorflow.keras.optimizers import *
-from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, EarlyStopping, TensorBoard
+# pyplot is imported by the plotting methods: the API only needs the split, without TensorFlow or a GUI backend
 
 load_dotenv()
 
@@ -75,6 +65,7 @@ class Datasource:
             load .nii file as a numpy array,
             Rescaling pixel values is essential
         """
+        import matplotlib.pyplot as plt
         
         test_image_flair = nib.load(TRAIN_DATASET_PATH +  "/BraTS20_Training_355/BraTS20_Training_355_flair.nii").get_fdata()
         print("Shape: ", test_image_flair.shape)
@@ -116,6 +107,7 @@ class Datasource:
         self.show_img_plane( test_image_t1ce)
         
     def expert_segmentation(self):
+        import matplotlib.pyplot as plt
         # We have to check that all those arrays are not empty.
         # Isolation of class 0
         seg_0 = self.test_image_seg.copy()
@@ -157,19 +149,20 @@ class Datasource:
 
         plt.show()  
 
-    def pathListIntoIds(self, data_path=TRAIN_DATASET_PATH ):
-        # lists of directories with studies
-        dirList = [f.path for f in os.scandir(data_path) if f.is_dir()]
+    def pathListIntoIds(self, data_path=TRAIN_DATASET_PATH, random_state=None):
+        # lists of directories with studies (sorted, so a fixed random_state gives the same split on every host)
+        dirList = sorted(f.path for f in os.scandir(data_path) if f.is_dir())
         x = []
         for i in range(0,len(dirList)):
             x.append(dirList[i][dirList[i].rfind('/')+1:])
             
-        self.train_test_ids, self.val_ids = train_test_split(x,test_size=0.2)
-        self.train_ids, self.test_ids = train_test_split(self.train_test_ids,test_size=0.15)
+        self.train_test_ids, self.val_ids = train_test_split(x,test_size=0.2, random_state=random_state)
+        self.train_ids, self.test_ids = train_test_split(self.train_test_ids,test_size=0.15, random_state=random_state)
         
         return x 
     
     def plot_train_val_test_frequence(self):
+        import matplotlib.pyplot as plt
         plt.bar(["Train","Valid","Test"],
         [len(self.train_ids), len(self.val_ids), len(self.test_ids)],
         align='center',
@@ -185,12 +178,14 @@ class Datasource:
         plt.show()   
     
     def show_img_feature(self, arr, title):
+        import matplotlib.pyplot as plt
         plt.subplot(2, 3, 1)
         plt.imshow(arr[:,:,slice_tumor], cmap='gray')
         plt.title(title)
         
     def show_img_plane(self, arr):
         # Apply a 90° rotation with an automatic resizing, otherwise the display is less obvious to analyze
+        import matplotlib.pyplot as plt
         slice = slice_tumor
 
         print("Slice number: " + str(slice))
@@ -215,6 +210,7 @@ class Datasource:
         plt.show()
         
     def display_slice_and_segmentation(self, flair, t1ce, segmentation):
+        import matplotlib.pyplot as plt
         fig, axes = plt.subplots(1, 3, figsize=(10, 5))
 
         axes[0].imshow(flair, cmap='gray')
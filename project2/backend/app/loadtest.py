@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+from load_client import start_server, run_workload, summarize, format_report
+
+# Stages reported by the /predictbypath/ endpoint in its Server-Timing header (see timing.py)
+STAGES = ["upload_parse", "nifti_decode", "preprocessing", "model", "serialization"]
+
+
+def _tiny_build_model(self):
+    import keras
+
+    # Same input and output shapes as the U-Net, a fraction of its compute
+    inputs = keras.Input((self.img_size, self.img_size, 2))
+    x = keras.layers.Conv2D(8, 3, activation='relu', padding='same')(inputs)
+    outputs = keras.layers.Conv2D(self.num_classes, 1, activation='softmax', dtype='float32')(x)
+    return keras.Model(inputs=inputs, outputs=outputs)
+
+
+def load_app(stub, workdir):
+    """Imports the FastAPI app of main.py.
+
+    With stub, it runs in workdir against a handful of empty case folders and a tiny model with
+    the U-Net's input and output shapes, so no dataset, DVC pull or trained weights are needed.
+    """
+    if stub:
+        data_dir = os.path.join(workdir, "brain_data")
+        for i in range(1, 11):
+            os.makedirs(os.path.join(data_dir, f"BraTS20_Training_{i:03d}"), exist_ok=True)
+        os.environ["DATASET_BASE_PATH"] = data_dir
+        os.environ.setdefault("SECRET_KEY", "loadtest")
+        os.chdir(workdir)
+
+        import model
+        model.Unet.build_model = _tiny_build_model
+        tiny_model = model.Unet(img_size=128, num_classes=4)
+        tiny_model.model.save("my_model.keras")
+        if os.getenv("INFERENCE_BACKEND") == "onnx":
+            from onnx_export import export_onnx
+            export_onnx(tiny_model, "my_model.onnx")
+
+    import main
+    return main.app
+
+
+def make_upload(workdir):
+    """flair / t1ce bytes of one synthetic BraTS-shaped case."""
+    from benchmark import make_synthetic_cases
+
+    upload_dir = os.path.join(workdir, "uploads")
+    case_id = make_synthetic_cases(upload_dir, 1)[0]
+    payload = {}
+    for modality in ["flair", "t1ce"]:
+        with open(os.path.join(upload_dir, case_id, f"{case_id}_{modality}.nii"), "rb") as f:
+            payload[modality] = f.read()
+    return payload
+
+
+def run_loadtest(num_requests=20, concurrency_levels=(1, 4), stub=True, warmup=1, accept="application/json",
+                 backend="keras"):
+    """Serves project2 in-process and drives /predictbypath/ with synthetic uploads, once per concurrency level."""
+    workdir = tempfile.mkdtemp(prefix="loadtest_") if stub else os.getcwd()
+    # Read by config.py when main is imported
+    os.environ["INFERENCE_BACKEND"] = backend
+    # Every request uploads the same case: without this it would measure prediction cache hits
+    os.environ.setdefault("PREDICTION_CACHE_SIZE", "0")
+    app = load_app(stub, workdir)
+    payload = make_upload(workdir)
+    server, base_url = start_server(app)
+
+    def send(session, worker, index):
+        files = {modality: (f"loadtest_{modality}.nii", data, "application/octet-stream")
+                 for modality, data in payload.items()}
+        return session.post(f"{base_url}/predictbypath/", files=files, headers={"Accept": accept})
+
+    reports = []
+    try:
+        run_workload(send, warmup, 1)
+        for concurrency in concurrency_levels:
+            samples, wall_time = run_workload(send, num_requests, concurrency)
+            reports.append({"endpoint": "/predictbypath/", "concurrency": concurrency, "stub": stub, "accept": accept,
+                            "backend": backend, **summarize(samples, wall_time, STAGES)})
+    finally:
+        server.should_exit = True
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency load test of the segmentation backend")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--real-model", action="store_true",
+                        help="serve the real weights and dataset from the current directory instead of the stub")
+    parser.add_argument("--accept", default="application/json", help="response format to request (see encoding.py)")
+    parser.add_argument("--backend", default="keras", choices=["keras", "onnx"], help="inference backend to serve (see config.py)")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    reports = run_loadtest(args.requests, args.concurrency, stub=not args.real_model, accept=args.accept,
+                           backend=args.backend)
+    for report in reports:
+        print(format_report(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+    else:
+        json.dump(reports, sys.stdout, indent=2)
@@ -1,11 +1,11 @@
 import os
-from typing import List
-import streamlit as st
+from typing import List, Optional
 
 from elt_report import generate_drift_report
 
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Header
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from pydantic import BaseModel
@@ -18,20 +18,83 @@ from auth import (
     oauth2_scheme
 )
 # from model import predictByPath, showPredictsById, show_predicted_segmentations, evaluate
-from model import Unet
 from load_data import Datasource
-from eda import DataGenerator
-from config import MODELS_DIR, DRIFT_BASE_PATH
+from config import MODELS_DIR, DRIFT_REPORT_JSON, DRIFT_REPORT_HTML, EVALUATION_DIR, INFERENCE_MODE, INFERENCE_MODES, TTA_VARIANTS
+from config import INFERENCE_BACKEND, MODEL_MEMORY_BUDGET, SPLIT_SEED
 from elt_report import generate_drift_report
+from drift import load_drift_result
+from jobs import JobManager
+from timing import add_timing_middleware, stage, METRICS, snapshot, Counter, Gauge
+from encoding import negotiate, encode_prediction, JSON, NIFTI, MEDIA_TYPES
+from postprocess import labels_of, segmentation_summary
+from preprocess import load_nifti, build_input, inference_slab
+from render import render_slice, FORMATS
+from prediction_cache import PredictionCache, content_id, geometry_of
+from batch import BatchPredictor, load_cases, volume_predictor, load_unet
+from tta import MAX_VARIANTS
+from registry import ModelRegistry
+import hashlib
+import shutil
+import tempfile
+import nibabel as nib
 app = FastAPI()
+# Per-stage durations of each request in its Server-Timing header (see loadtest.py), and metrics at /metrics
+add_timing_middleware(app)
 
 source = Datasource()
-train_and_test_ids = source.pathListIntoIds()
-test_generator = DataGenerator(source.test_ids)
+# Seeded, so the test split, and with it the /evaluate/ cache key, is the same after a restart
+train_and_test_ids = source.pathListIntoIds(random_state=SPLIT_SEED)
 
-# Initialize the Unet model (set appropriate parameters)
-unet_model = Unet(img_size=128, num_classes=4)
-unet_model.compile_and_load_weights( os.path.join(MODELS_DIR,'my_model.keras') )
+# Initialize the Unet model, with Keras or as its ONNX export on ONNX Runtime (see config.py).
+# Other versions are loaded next to it at runtime through /models/ and swapped in without a restart.
+MODEL_PATH = os.path.join(MODELS_DIR, 'my_model.onnx' if INFERENCE_BACKEND == "onnx" else 'my_model.keras')
+registry = ModelRegistry(load_unet, byte_budget=MODEL_MEMORY_BUDGET)
+registry.load(MODEL_PATH, activate=True, background=False)
+
+
+def serving_model(version=None):
+    """The loaded ModelVersion a request names, else the active one (or the canary, for its share of requests)."""
+    try:
+        return registry.get(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not loaded")
+
+
+def selected_model(x_model_version: Optional[str] = Header(None)):
+    # Per-request version for canary checks: X-Model-Version: <version>
+    return serving_model(x_model_version)
+
+
+job_manager = JobManager(history_path=os.path.join(EVALUATION_DIR, "history.json"))
+# Predictions of uploaded cases by content hash: one inference per case, however many views of it
+prediction_cache = PredictionCache(max_items=int(os.getenv("PREDICTION_CACHE_SIZE", 8)),
+                                   spill_dir=os.getenv("PREDICTION_SPILL_DIR"))
+
+
+def serving_metrics():
+    """Prediction cache, job queue and model registry state, read on each /metrics scrape."""
+    cache = prediction_cache.stats()
+    models = registry.describe()
+    ready = [v for v in models["versions"] if v["status"] == "ready"]
+    return [
+        snapshot(Counter, "prediction_cache_hits_total", "Predictions served from the cache", cache["hits"]),
+        snapshot(Counter, "prediction_cache_misses_total", "Predictions run because the case was not cached", cache["misses"]),
+        snapshot(Gauge, "prediction_cache_items", "Predictions held in memory", cache["in_memory"]),
+        snapshot(Gauge, "job_queue_depth", "Evaluation and batch jobs waiting for the worker", job_manager.queue_depth()),
+        snapshot(Gauge, "model_loaded_bytes", "Weights of each loaded model version",
+                 {(v["version"],): v["bytes"] for v in ready}, ("version",)),
+        snapshot(Gauge, "model_traffic_share", "Share of the default traffic served by each model version",
+                 {(v["version"],): (1 - models["canary_fraction"] if v["version"] == models["active"] else
+                                    models["canary_fraction"] if v["version"] == models["canary"] else 0)
+                  for v in ready}, ("version",)),
+        snapshot(Counter, "model_slices_predicted_total", "Slices run through each model version",
+                 {(v["version"],): v["slices"]["predicted"] for v in ready}, ("version",)),
+        snapshot(Counter, "model_slices_skipped_total", "Slices predicted as background without the model",
+                 {(v["version"],): v["slices"]["skipped"] for v in ready}, ("version",)),
+    ]
+
+
+METRICS.add_collector(serving_metrics)
 
 @app.post("/")
 async def hello():
@@ -93,25 +156,201 @@ async def get_samples_list():
 #         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Endpoint to evaluate the model on test data
+# Endpoint to evaluate the model on test data, queued as a background job
 @app.post("/evaluate/")
-async def evaluate_model_api(token: str = Depends(oauth2_scheme)):
+async def evaluate_model_api(version: Optional[str] = None, token: str = Depends(oauth2_scheme)):
     payload = decode_token(token)
     role = payload.get("role")
     
     if role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
     
+    # The active version unless another loaded one is named, never the canary at random
+    model = serving_model(version or registry.active)
     try:
-        # Evaluate the model
-        decode_token(token)
-        metrics_dict = unet_model.evaluate(test_generator)
-        print(metrics_dict)
-        return metrics_dict
+        test_ids = sorted(source.test_ids)
+        split_id = hashlib.sha256(f"{SPLIT_SEED}\n".encode() + "\n".join(test_ids).encode()).hexdigest()
+        # Evaluation results are cached per model weights and test split
+        results_path = os.path.join(EVALUATION_DIR, f"{model.version}_{split_id[:12]}.jsonl")
+
+        def run_evaluation(job):
+            # Per-case results go to results_path, so a cancelled job resumes where it stopped
+            return model.model.evaluate_streaming(test_ids, results_path,
+                                                 progress_callback=job.set_progress,
+                                                 should_stop=job.is_cancelled)
+
+        job = job_manager.submit("evaluate", run_evaluation,
+                                 cache_key=f"{model.digest}:{split_id}",
+                                 metadata={"model_version": model.digest, "split_id": split_id, "cases": len(test_ids)})
+        return job.to_dict()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/evaluate/history")
+async def evaluation_history(token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return job_manager.history
+
+
+@app.get("/evaluate/{job_id}")
+async def evaluation_status(job_id: str, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/evaluate/{job_id}")
+async def cancel_evaluation(job_id: str, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+class BatchRequest(BaseModel):
+    # Directory of BraTS case folders or CSV manifest (case_id, flair, t1ce), on the server
+    input_path: str
+    output_dir: str
+    resume: bool = True
+    mode: str = INFERENCE_MODE
+    tta: int = TTA_VARIANTS
+    # Loaded model version to run, the active one by default
+    version: Optional[str] = None
+
+
+# Endpoint to segment a whole cohort of cases, queued as a background job
+@app.post("/batch/")
+def batch_predict(request: BatchRequest, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    if request.mode not in INFERENCE_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {', '.join(INFERENCE_MODES)}")
+    if not 1 <= request.tta <= MAX_VARIANTS:
+        raise HTTPException(status_code=422, detail=f"tta must be between 1 and {MAX_VARIANTS}")
+    if not os.path.exists(request.input_path):
+        raise HTTPException(status_code=404, detail=f"Input not found: {request.input_path}")
+    model = serving_model(request.version or registry.active)
+
+    try:
+        cases = load_cases(request.input_path)
+        predictor = BatchPredictor(volume_predictor(model.model, request.tta), cases, request.output_dir,
+                                   mode=request.mode)
+
+        def run_batch(job):
+            # Written cases are logged in output_dir, so a cancelled job resumes where it stopped
+            return predictor.run(resume=request.resume, progress_callback=job.set_progress,
+                                 should_stop=job.is_cancelled)
+
+        job = job_manager.submit("batch", run_batch,
+                                 metadata={"model_version": model.digest, "input_path": request.input_path,
+                                           "output_dir": request.output_dir, "mode": request.mode, "tta": request.tta,
+                                           "cases": len(cases)})
+        return job.to_dict()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/batch/{job_id}")
+async def batch_status(job_id: str, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    job = job_manager.get(job_id)
+    if job is None or job.name != "batch":
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/batch/{job_id}")
+async def cancel_batch(job_id: str, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    job = job_manager.get(job_id)
+    if job is None or job.name != "batch":
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_manager.cancel(job_id).to_dict()
+
+
+def require_admin(token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return payload
+
+
+class ModelRequest(BaseModel):
+    # Keras (.keras) or ONNX (.onnx) weights, on the server
+    path: str
+    activate: bool = False
+    # Share of the default traffic sent to the new version once it is ready, 0 for none
+    canary_fraction: float = 0.0
+
+
+@app.get("/models")
+async def list_models(admin=Depends(require_admin)):
+    return registry.describe()
+
+
+# Loads a model version in the background while the active one keeps serving; its version
+# (hash of the file) shows up in GET /models once the file has been hashed
+@app.post("/models")
+async def load_model(request: ModelRequest, admin=Depends(require_admin)):
+    if not os.path.exists(request.path):
+        raise HTTPException(status_code=404, detail=f"Model not found: {request.path}")
+    if not 0.0 <= request.canary_fraction <= 1.0:
+        raise HTTPException(status_code=422, detail="canary_fraction must be between 0 and 1")
+    return registry.load(request.path, activate=request.activate,
+                         canary_fraction=request.canary_fraction).to_dict()
+
+
+@app.post("/models/{version}/activate")
+async def activate_model(version: str, admin=Depends(require_admin)):
+    try:
+        return registry.activate(version).to_dict()
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not loaded")
+
+
+@app.post("/models/{version}/canary")
+async def canary_model(version: str, fraction: float = 0.1, admin=Depends(require_admin)):
+    if not 0.0 <= fraction <= 1.0:
+        raise HTTPException(status_code=422, detail="fraction must be between 0 and 1")
+    try:
+        registry.set_canary(version, fraction)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not loaded")
+    return registry.describe()
+
+
+@app.delete("/models/canary")
+async def stop_canary(admin=Depends(require_admin)):
+    registry.set_canary(None, 0.0)
+    return registry.describe()
+
+
+@app.delete("/models/{version}")
+async def unload_model(version: str, admin=Depends(require_admin)):
+    try:
+        registry.unload(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not loaded")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.describe()
+
+
 # Endpoint to predict brain segmentation from image file path
 # @app.post("/predict/")
 # async def predict(case_path: str, case: str, token: str = Depends(oauth2_scheme)):
@@ -133,7 +372,7 @@ async def show_drift(token: str = Depends(oauth2_scheme)):
     
     try:
         # report_html_path = "custom_report.html"
-        report_html_path = DRIFT_BASE_PATH + "drift_seg_report.html"
+        report_html_path = DRIFT_REPORT_HTML
         print(report_html_path)
     # Check if the file exists
         if os.path.exists(report_html_path):
@@ -142,8 +381,8 @@ async def show_drift(token: str = Depends(oauth2_scheme)):
                 html_content = f.read()
             return HTMLResponse(content=html_content)
         else:
-            # Generate It from data / This should take time
-            generate_drift_report()
+            # Generate It from data / This should take time, so off the event loop
+            await run_in_threadpool(generate_drift_report, render_html=True)
             with open(report_html_path, "r") as f:
                 html_content = f.read()
             return HTMLResponse(content=html_content)
@@ -152,62 +391,220 @@ async def show_drift(token: str = Depends(oauth2_scheme)):
         return {"error": str(e)}
 
 
-@app.post("/predictbypath/")
-async def predict(flair: UploadFile = File(...), t1ce: UploadFile = File(...)):
+@app.get("/showdrift/summary")
+async def drift_summary(refresh: bool = False, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    role = payload.get("role")
+    
+    if role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    
     try:
-        # Save and process FLAIR and T1CE files separately
-        flair_file_path = f"{flair.filename}"
-        t1ce_file_path = f"{t1ce.filename}"
+        # Compact JSON result, cheap enough to poll every few minutes
+        result = None if refresh else load_drift_result(DRIFT_REPORT_JSON)
+        if result is None:
+            # Reads and featurises every case: seconds to minutes, so off the event loop
+            result = await run_in_threadpool(generate_drift_report)
+        return result
+    
+    except Exception as e:
+        return {"error": str(e)}
 
-        with open(flair_file_path, "wb") as f:
-            f.write(await flair.read())
-        
-        with open(t1ce_file_path, "wb") as f:
-            f.write(await t1ce.read())
 
-        # Call the prediction method with the paths to both files
-        prediction = unet_model.predictFromFiles(flair_file_path, t1ce_file_path)
+async def cached_prediction(flair: UploadFile, t1ce: UploadFile, model, mode: str = INFERENCE_MODE, tta: int = TTA_VARIANTS):
+    """(case_id, cache entry, cached) of an uploaded flair/t1ce pair, running the model (a ModelVersion)
+    only on a cache miss.
 
-        # Return the prediction as a list (to handle numpy arrays)
-        return {"prediction": prediction.tolist()}
-    
+    mode "window" predicts the training slab of the volume, "full" all its axial slices (see config.py);
+    tta is the number of test-time augmentation variants averaged per slice (see tta.py).
+    """
+    if mode not in INFERENCE_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {', '.join(INFERENCE_MODES)}")
+    if not 1 <= tta <= MAX_VARIANTS:
+        raise HTTPException(status_code=422, detail=f"tta must be between 1 and {MAX_VARIANTS}")
+    with stage("upload_parse"):
+        flair_bytes = await flair.read()
+        t1ce_bytes = await t1ce.read()
+    # Decoding and inference block for seconds, so they run on a worker thread, not the event loop
+    return await run_in_threadpool(predict_upload, flair.filename, flair_bytes, t1ce.filename, t1ce_bytes,
+                                   model, mode, tta)
+
+
+def upload_path(upload_dir, modality, filename):
+    """Where an uploaded volume is written: a fixed name in upload_dir, keeping only the .nii or .nii.gz
+    extension of the client's file name, which nibabel reads the format from."""
+    extension = ".nii.gz" if (filename or "").lower().endswith(".gz") else ".nii"
+    return os.path.join(upload_dir, modality + extension)
+
+
+def predict_upload(flair_filename, flair_bytes, t1ce_filename, t1ce_bytes, model, mode, tta):
+    """The blocking part of cached_prediction."""
+    # Salted with the weights digest, so a new model never serves an old prediction
+    key = content_id(flair_bytes, t1ce_bytes, salt=f"{model.digest}:{mode}:{tta}")
+    entry = prediction_cache.get(key)
+    if entry is not None:
+        return key, entry, True
+
+    # Each request writes its FLAIR and T1CE files to a directory of its own, removed once they are decoded
+    upload_dir = tempfile.mkdtemp(prefix="upload_")
+    try:
+        flair_file_path = upload_path(upload_dir, "flair", flair_filename)
+        t1ce_file_path = upload_path(upload_dir, "t1ce", t1ce_filename)
+        with stage("upload_parse"):
+            with open(flair_file_path, "wb") as f:
+                f.write(flair_bytes)
+            with open(t1ce_file_path, "wb") as f:
+                f.write(t1ce_bytes)
+
+        with stage("nifti_decode"):
+            flair_volume = load_nifti(flair_file_path)
+            t1ce_volume = load_nifti(t1ce_file_path)
+            geometry = geometry_of(nib.load(flair_file_path))
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+    with stage("preprocessing"):
+        start, count = inference_slab(mode, flair_volume.shape[2])
+        X = build_input(flair_volume, t1ce_volume, start, count)
+    with stage("model"):
+        prediction = volume_predictor(model.model, tta)(X)
+    entry = {"prediction": prediction, "flair": X[..., 0], "geometry": geometry, "start": start,
+             "model_version": model.version}
+    prediction_cache.put(key, entry)
+    return key, entry, False
+
+
+def cached_entry(case_id: str):
+    entry = prediction_cache.get(case_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired case, upload it to /predictions/ again")
+    return entry
+
+
+def encoded_response(request: Request, entry, probabilities=False, headers=None):
+    """The prediction of a cache entry in the format negotiated from the Accept header (see encoding.py)."""
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Supported response types: {', '.join(MEDIA_TYPES)}")
+    if media_type == NIFTI and probabilities:
+        raise HTTPException(status_code=406, detail="NIfTI responses only carry the labels, request application/x-npz for probabilities")
+    prediction = entry["prediction"]
+    with stage("serialization"):
+        if media_type == JSON:
+            # Return the prediction as a list (to handle numpy arrays)
+            return JSONResponse({"prediction": prediction.tolist()}, headers=headers)
+        accept_gzip = "gzip" in request.headers.get("accept-encoding", "")
+        # NIfTI responses are mapped back to the geometry of the uploaded flair
+        body, encoded_headers = encode_prediction(prediction, media_type, probabilities=probabilities,
+                                                  accept_gzip=accept_gzip, reference=entry["geometry"],
+                                                  start=entry["start"])
+        return Response(content=body, media_type=media_type, headers={**encoded_headers, **(headers or {})})
+
+
+def render_prediction(entry, slice_index, layout="overlay", fmt="png", alpha=0.4, scale=1):
+    """Preview of one predicted slice over the flair slice the model saw, without matplotlib."""
+    if layout not in ("overlay", "panels") or fmt not in FORMATS or not 1 <= scale <= 8:
+        raise HTTPException(status_code=422, detail="layout must be overlay or panels, fmt png or webp, scale 1 to 8")
+    prediction = entry["prediction"]
+    if not 0 <= slice_index < len(prediction):
+        raise HTTPException(status_code=422, detail=f"Slice must be between 0 and {len(prediction) - 1}")
+    labels = labels_of(prediction[slice_index:slice_index + 1])[0]
+    with stage("rendering"):
+        body, media_type = render_slice(entry["flair"][slice_index], labels, layout=layout, alpha=alpha, scale=scale, fmt=fmt)
+    return Response(content=body, media_type=media_type)
+
+
+@app.post("/predictbypath/")
+async def predict(request: Request, flair: UploadFile = File(...), t1ce: UploadFile = File(...), probabilities: bool = False,
+                  mode: str = INFERENCE_MODE, tta: int = TTA_VARIANTS, model=Depends(selected_model)):
+    try:
+        key, entry, cached = await cached_prediction(flair, t1ce, model, mode, tta)
+        return await run_in_threadpool(encoded_response, request, entry, probabilities,
+                                       headers={"X-Case-Id": key, "X-Model-Version": entry["model_version"]})
+    except HTTPException:
+        raise
     except Exception as e:
         # If any error occurs, raise an HTTP exception with the error details
         raise HTTPException(status_code=500, detail=str(e))
-    
-    
+
+
+@app.post("/predictions/")
+async def create_prediction(flair: UploadFile = File(...), t1ce: UploadFile = File(...), mode: str = INFERENCE_MODE,
+                            tta: int = TTA_VARIANTS, model=Depends(selected_model)):
+    """Predicts an uploaded case once; its slices, metrics and encodings are then served by case_id."""
+    try:
+        key, entry, cached = await cached_prediction(flair, t1ce, model, mode, tta)
+        summary = await run_in_threadpool(segmentation_summary, entry["prediction"], entry["geometry"], entry["start"])
+        return {"case_id": key, "cached": cached, "model_version": entry["model_version"],
+                "mode": mode, "tta": tta, "slices": len(entry["prediction"]), "summary": summary}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/predictions/{case_id}")
+def get_prediction(case_id: str, request: Request, probabilities: bool = False):
+    return encoded_response(request, cached_entry(case_id), probabilities)
+
+
+@app.get("/predictions/{case_id}/slices/{slice_index}")
+def get_prediction_slice(case_id: str, slice_index: int, layout: str = "overlay", fmt: str = "png",
+                               alpha: float = 0.4, scale: int = 1):
+    return render_prediction(cached_entry(case_id), slice_index, layout, fmt, alpha, scale)
+
+
+@app.get("/predictions/{case_id}/metrics")
+def get_prediction_metrics(case_id: str):
+    entry = cached_entry(case_id)
+    return segmentation_summary(entry["prediction"], entry["geometry"], entry["start"])
+
+
+@app.get("/inference/stats")
+async def inference_stats():
+    # Slices skipped by the brain mask per model version, and the prediction cache usage
+    return {"models": registry.describe(), "prediction_cache": prediction_cache.stats()}
+
+
+@app.post("/render/{slice_index}")
+async def render_slice_api(slice_index: int, flair: UploadFile = File(...), t1ce: UploadFile = File(...),
+                           layout: str = "overlay", fmt: str = "png", alpha: float = 0.4, scale: int = 1,
+                           mode: str = INFERENCE_MODE, tta: int = TTA_VARIANTS, model=Depends(selected_model)):
+    try:
+        key, entry, cached = await cached_prediction(flair, t1ce, model, mode, tta)
+        response = await run_in_threadpool(render_prediction, entry, slice_index, layout, fmt, alpha, scale)
+        response.headers["X-Case-Id"] = key
+        response.headers["X-Model-Version"] = entry["model_version"]
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/showPredictSegmented/")
-async def show_predicted_segmentations_api(files: List[UploadFile] = File(...)):
+async def show_predicted_segmentations_api(files: List[UploadFile] = File(...), slice_to_plot: int = 60,
+                                          mode: str = INFERENCE_MODE, tta: int = TTA_VARIANTS,
+                                          model=Depends(selected_model)):
     try:
         # Check if exactly two files are uploaded
         if len(files) != 2:
             raise HTTPException(status_code=400, detail="Please upload exactly two files.")
 
-        # Initialize variables to store file paths for flair and t1ce images
-        flair_file_path = None
-        t1ce_file_path = None
-
-        # Iterate over the uploaded files and verify their filenames
-        for file in files:
-            if file.filename.endswith("_flair.nii"):
-                flair_file_path = f"{file.filename}"
-                with open(flair_file_path, "wb") as f:
-                    content = await file.read()
-                    f.write(content)
-            elif file.filename.endswith("_t1ce.nii"):
-                t1ce_file_path = f"{file.filename}"
-                with open(t1ce_file_path, "wb") as f:
-                    content = await file.read()
-                    f.write(content)
-            else:
-                raise HTTPException(status_code=400, detail="File names must end with '_flair.nii' and '_t1ce.nii'.")
+        # Pick the flair and t1ce images by their filenames
+        flair_file = next((file for file in files if file.filename.endswith("_flair.nii")), None)
+        t1ce_file = next((file for file in files if file.filename.endswith("_t1ce.nii")), None)
 
         # Ensure both flair and t1ce files were uploaded
-        if not flair_file_path or not t1ce_file_path:
+        if flair_file is None or t1ce_file is None:
             raise HTTPException(status_code=400, detail="Both _flair.nii and _t1ce.nii files must be provided.")
 
-        # Call the prediction method with the paths to both files
-        unet_model.show_predicted_segmentations(flair_file_path, t1ce_file_path, 60)
+        # Predicted once per case (see cached_prediction), then returned as the preview panels PNG
+        key, entry, cached = await cached_prediction(flair_file, t1ce_file, model, mode, tta)
+        response = await run_in_threadpool(render_prediction, entry, slice_to_plot, layout="panels")
+        response.headers["X-Case-Id"] = key
+        response.headers["X-Model-Version"] = entry["model_version"]
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
\ No newline at end of file
@@ -1,3 +1,5 @@
+import keras
+import tensorflow as tf
 import tensorflow.keras.backend as K
 import matplotlib.pyplot as plt
 
@@ -52,6 +54,121 @@ def specificity(y_true, y_pred):
     possible_negatives = K.sum(K.round(K.clip(1-y_true, 0, 1)))
     return true_negatives / (possible_negatives + K.epsilon())
 
+
+# ______________________________Fused metrics______________________________ #
+# The functions above each re-read the full (batch, 128, 128, 4) tensors and are averaged per batch.
+# SegmentationCounts gathers every per-class sum they need once per batch and accumulates it over batches,
+# and the SegmentationMetric views derive the reported values from those totals.
+
+# Rows of SegmentationCounts.counts, one column per class
+INTERSECTION, SUM_TRUE, SUM_PRED, SUM_TRUE_SQ, SUM_PRED_SQ, TP, PRED_POS, TRUE_POS, TN, TRUE_NEG = range(10)
+
+
+def segmentation_counts(y_true, y_pred):
+    """(10, num_classes) tensor of the per-class sums in the rows above, for one batch."""
+    product = y_true * y_pred
+    # Sum over every axis but the class axis; with jit_compile XLA fuses these into one multi-output reduction
+    axes = list(range(len(y_true.shape) - 1))
+    stats = [
+        product,
+        y_true,
+        y_pred,
+        tf.square(y_true),
+        tf.square(y_pred),
+        tf.round(tf.clip_by_value(product, 0, 1)),
+        tf.round(tf.clip_by_value(y_pred, 0, 1)),
+        tf.round(tf.clip_by_value(y_true, 0, 1)),
+        tf.round(tf.clip_by_value((1 - y_true) * (1 - y_pred), 0, 1)),
+        tf.round(tf.clip_by_value(1 - y_true, 0, 1)),
+    ]
+    return tf.stack([tf.reduce_sum(stat, axis=axes) for stat in stats], axis=0)
+
+
+class SegmentationCounts(keras.metrics.Metric):
+    def __init__(self, num_classes=4, name="segmentation_counts", **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.num_classes = num_classes
+        # float64: a float32 total stops counting single voxels past 2**24, a few BraTS volumes
+        self.counts = self.add_variable(shape=(10, num_classes), initializer="zeros", dtype="float64", name="counts")
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        batch_counts = segmentation_counts(tf.cast(y_true, self.dtype), tf.cast(y_pred, self.dtype))
+        self.counts.assign_add(tf.cast(batch_counts, "float64"))
+
+    def result(self):
+        return self.counts
+
+    def reset_state(self):
+        self.counts.assign(tf.zeros_like(self.counts))
+
+
+class SegmentationMetric(keras.metrics.Metric):
+    """One reported value derived from a shared SegmentationCounts.
+
+    Only the view created with owner=True updates and resets the counts, so the tensors are
+    read once per batch whatever the number of views.
+    """
+
+    def __init__(self, counts, fn, name, owner=False, **kwargs):
+        super().__init__(name=name, **kwargs)
+        self._counts = counts
+        self._fn = fn
+        self._owner = owner
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        if self._owner:
+            self._counts.update_state(y_true, y_pred, sample_weight)
+
+    def result(self):
+        return tf.cast(self._fn(self._counts.counts), self.dtype)
+
+    def reset_state(self):
+        if self._owner:
+            self._counts.reset_state()
+
+
+def _dice_coef(counts, smooth=1.0):
+    dice = (2. * counts[INTERSECTION] + smooth) / (counts[SUM_TRUE] + counts[SUM_PRED] + smooth)
+    return tf.reduce_mean(dice)
+
+
+def _class_dice(class_index, epsilon=1e-6):
+    def dice(counts):
+        return (2. * counts[INTERSECTION, class_index]) / (counts[SUM_TRUE_SQ, class_index] + counts[SUM_PRED_SQ, class_index] + epsilon)
+    return dice
+
+
+def _precision(counts):
+    return tf.reduce_sum(counts[TP]) / (tf.reduce_sum(counts[PRED_POS]) + K.epsilon())
+
+
+def _sensitivity(counts):
+    return tf.reduce_sum(counts[TP]) / (tf.reduce_sum(counts[TRUE_POS]) + K.epsilon())
+
+
+def _specificity(counts):
+    return tf.reduce_sum(counts[TN]) / (tf.reduce_sum(counts[TRUE_NEG]) + K.epsilon())
+
+
+# Reported name and function of the counts, in the order of the old compiled metrics
+SEGMENTATION_METRICS = [
+    ("dice_coef", _dice_coef),
+    ("precision", _precision),
+    ("sensitivity", _sensitivity),
+    ("specificity", _specificity),
+    ("dice_coef_necrotic", _class_dice(1)),
+    ("dice_coef_edema", _class_dice(2)),
+    ("dice_coef_enhancing", _class_dice(3)),
+]
+
+
+def segmentation_metrics(num_classes=4):
+    """Fused, batch-accumulated versions of dice_coef, precision, sensitivity, specificity and
+    the per-class dice functions, under the same names (so training logs keep their columns)."""
+    counts = SegmentationCounts(num_classes)
+    return [SegmentationMetric(counts, fn, name, owner=(i == 0)) for i, (name, fn) in enumerate(SEGMENTATION_METRICS)]
+
+
 def plot_training_history(history_df):
     """
     Plots training history including accuracy, loss, dice coefficient, and mean IoU.
@@ -19,7 +19,14 @@ from tensorflow.keras.layers import *
 from tensorflow.keras.optimizers import *
 from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, EarlyStopping, TensorBoard
 
-from metrics import dice_coef, precision, sensitivity, specificity, dice_coef_necrotic, dice_coef_edema, dice_coef_enhancing
+from metrics import segmentation_metrics
+from callbacks import ThroughputLogger
+from checkpointing import CheckpointManager, ResumedEpoch
+from evaluation import StreamingEvaluator
+from timing import stage
+from config import VOLUME_SLICES, VOLUME_START_AT, IMG_SIZE, INFERENCE_CHUNK_SLICES, SKIP_EMPTY_SLICES
+from preprocess import build_input
+from inference import predict_volume, SliceCounter
 import streamlit as st
 load_dotenv()
 # Get the base directory from the .env file
@@ -27,9 +34,6 @@ MODELS_DIR = os.getenv('MODELS_DIR')
 TRAIN_DATASET_PATH = os.getenv('DATASET_BASE_PATH')
 MODELS_DIR = os.getenv('MODELS_DIR')
 
-VOLUME_SLICES = 100
-VOLUME_START_AT = 22 # first slice of volume that we will include
-IMG_SIZE=128
 
 class Unet:
     def __init__(self, img_size, num_classes, ker_init='he_normal', dropout=0.2, learning_rate=0.001):
@@ -39,6 +43,12 @@ class Unet:
         self.dropout = dropout
         self.learning_rate = learning_rate
         self.model = self.build_model()
+        self._compiled = False
+        # (mixed_precision, jit_compile) of the last compile_model
+        self._compile_settings = None
+        self._forward = None
+        # Slices run through the model and skipped as background by predict_volume
+        self.slice_counter = SliceCounter()
 
     def build_model(self):
         inputs = Input((self.img_size, self.img_size, 2))
@@ -82,51 +92,137 @@ class Unet:
         conv = Conv2D(32, 3, activation='relu', padding='same', kernel_initializer=self.ker_init)(merge)
         conv = Conv2D(32, 3, activation='relu', padding='same', kernel_initializer=self.ker_init)(conv)
 
-        conv10 = Conv2D(self.num_classes, (1, 1), activation='softmax')(conv)
+        # Softmax kept in float32 so mixed precision training stays numerically stable
+        conv10 = Conv2D(self.num_classes, (1, 1), activation='softmax', dtype='float32')(conv)
 
         return Model(inputs=inputs, outputs=conv10)
 
-    def compile_model(self, loss="categorical_crossentropy"):
+    def compile_model(self, loss="categorical_crossentropy", mixed_precision=False, jit_compile=False):
+        """Compiles the model for training.
+
+        mixed_precision rebuilds the model under the mixed_float16 policy (weights are kept) and wraps
+        the optimizer in a LossScaleOptimizer; jit_compile compiles the train step with XLA.
+        """
+        self.set_dtype_policy("mixed_float16" if mixed_precision else "float32")
+        optimizer = keras.optimizers.Adam(learning_rate=self.learning_rate)
+        if mixed_precision:
+            optimizer = keras.optimizers.LossScaleOptimizer(optimizer)
+
         metrics = [
             'accuracy', 
             tf.keras.metrics.MeanIoU(num_classes=4), 
-            dice_coef, 
-            precision, 
-            sensitivity, 
-            specificity, 
-            dice_coef_necrotic, 
-            dice_coef_edema, 
-            dice_coef_enhancing
+            # dice_coef, precision, sensitivity, specificity and the per-class dice, from one pass per batch
+            *segmentation_metrics(self.num_classes)
         ]
         self.model.compile(loss=loss,
-                           optimizer=keras.optimizers.Adam(learning_rate=self.learning_rate),
-                           metrics=metrics)
+                           optimizer=optimizer,
+                           metrics=metrics,
+                           jit_compile=jit_compile)
+        self._compiled = True
+        self._compile_settings = (mixed_precision, jit_compile)
+
+    def set_dtype_policy(self, policy):
+        """Rebuilds the model with the given dtype policy if it differs from the current one."""
+        if self.model.dtype_policy.name == policy:
+            return
+        weights = self.model.get_weights()
+        previous_policy = keras.config.dtype_policy()
+        keras.config.set_dtype_policy(policy)
+        try:
+            self.model = self.build_model()
+        finally:
+            keras.config.set_dtype_policy(previous_policy)
+        self.model.set_weights(weights)
+        self._compiled = False
+        self._forward = None
         
 
     def plot_model(self, file_path='unet_model.png'):
         plot_model(self.model, show_shapes=True, show_layer_names=True, to_file=MODELS_DIR + file_path)
         # print("Successfully Completed!") 
 
-    def train(self, training_generator, validation_generator, epochs=35, train_ids=None):
+    def train(self, training_generator, validation_generator, epochs=35, train_ids=None,
+              mixed_precision=False, jit_compile=False, input_dtype='float32',
+              checkpoint_dir=None, save_every_steps=100, keep_latest=2, keep_best=3, resume=True):
+        """Trains the model.
+
+        mixed_precision / jit_compile recompile the model for mixed float16 training and XLA
+        (see compile_model); input_dtype is the dtype the generators produce their inputs in.
+        Weights, optimizer state and the position in the data are checkpointed to checkpoint_dir
+        (MODELS_DIR/checkpoints by default) every save_every_steps steps; with resume, a run that
+        was killed continues from its latest checkpoint, mid-epoch and with the same batch order.
+        """
+        # A model compiled with other settings (e.g. mixed precision by an earlier call) is recompiled,
+        # which also restores the float32 policy and a plain optimizer
+        if not self._compiled or self._compile_settings != (mixed_precision, jit_compile):
+            self.compile_model(mixed_precision=mixed_precision, jit_compile=jit_compile)
+        training_generator.dtype = input_dtype
+        validation_generator.dtype = input_dtype
         
         # Ensure the checkpoint directory exists
         if not os.path.exists(MODELS_DIR):
             os.makedirs(MODELS_DIR)
 
+        checkpoints = CheckpointManager(checkpoint_dir or os.path.join(MODELS_DIR, 'checkpoints'),
+                                        save_every_steps=save_every_steps, keep_latest=keep_latest, keep_best=keep_best)
+        K.clear_session()
+        state = checkpoints.restore(self.model) if resume else None
+
+        steps_per_epoch = len(train_ids)
+        initial_epoch, start_step = 0, 0
+        if state is None:
+            # The shuffle seed is part of the checkpoint, so a resumed run sees the same batch order
+            checkpoints.seed = training_generator.seed if training_generator.seed is not None else int(np.random.randint(2**31))
+        else:
+            initial_epoch, start_step = state['epoch'], state['step']
+            if state['end_of_epoch'] or start_step >= steps_per_epoch:
+                initial_epoch, start_step = initial_epoch + 1, 0
+            print(f"Resuming from epoch {initial_epoch + 1}, step {start_step}")
+        training_generator.seed = checkpoints.seed
+        training_generator.set_epoch(initial_epoch)
+
+        csv_logger = CSVLogger('training.log', separator=',', append=state is not None)
+        reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=2, min_lr=0.000001, verbose=1)
+        model_checkpoint = ModelCheckpoint(filepath=os.path.join(MODELS_DIR, 'model_.{epoch:02d}-{val_loss:.6f}.weights.h5'), verbose=1, save_best_only=True, save_weights_only=True)
+        # Saved with every checkpoint, so a resumed run keeps the LR schedule and never overwrites a better model
+        checkpoints.tracked_callbacks = {"reduce_lr": reduce_lr, "model_checkpoint": model_checkpoint}
         callbacks = [
-            ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=2, min_lr=0.000001, verbose=1),
-            ModelCheckpoint(filepath=os.path.join(MODELS_DIR, 'model_.{epoch:02d}-{val_loss:.6f}.weights.h5'), verbose=1, save_best_only=True, save_weights_only=True),
-            CSVLogger('training.log', separator=',', append=False)
+            reduce_lr,
+            model_checkpoint,
+            ThroughputLogger(examples_per_step=training_generator.batch_size * VOLUME_SLICES),
+            checkpoints,
+            csv_logger
         ]
 
-        K.clear_session()
-        history = self.model.fit(
-            training_generator,
-            epochs=epochs,
-            steps_per_epoch=len(train_ids),
-            callbacks=callbacks,
-            validation_data=validation_generator
-        )
+        histories = []
+        if start_step:
+            # Finish the interrupted epoch first, then carry on with whole epochs
+            checkpoints.step_offset = start_step
+            histories.append(self.model.fit(
+                ResumedEpoch(training_generator, start_step),
+                epochs=initial_epoch + 1,
+                initial_epoch=initial_epoch,
+                steps_per_epoch=steps_per_epoch - start_step,
+                callbacks=callbacks,
+                validation_data=validation_generator
+            ))
+            initial_epoch += 1
+            csv_logger.append = True
+        if initial_epoch < epochs:
+            histories.append(self.model.fit(
+                training_generator,
+                epochs=epochs,
+                initial_epoch=initial_epoch,
+                steps_per_epoch=steps_per_epoch,
+                callbacks=callbacks,
+                validation_data=validation_generator
+            ))
+        if not histories:
+            return None
+        history = histories[-1]
+        for earlier in reversed(histories[:-1]):
+            history.epoch = earlier.epoch + history.epoch
+            history.history = {key: earlier.history.get(key, []) + values for key, values in history.history.items()}
         return history
 
     def save_model(self, file_path=os.path.join(MODELS_DIR,'my_model.keras')):
@@ -138,6 +234,8 @@ class Unet:
                 "accuracy": tf.keras.metrics.MeanIoU(num_classes=self.num_classes)
             }
         self.model = keras.models.load_model(file_path, custom_objects=custom_objects, compile=False)
+        self._compiled = False
+        self._forward = None
         
     def compile_and_load_weights(self, weights_path):
         """A method to compile the model and load pre-trained weights.
@@ -148,7 +246,9 @@ class Unet:
         
         self.model.compile(loss="categorical_crossentropy",
                            optimizer=tf.keras.optimizers.Adam(learning_rate=self.learning_rate),
-                           metrics=['accuracy', tf.keras.metrics.MeanIoU(num_classes=4), dice_coef, precision, sensitivity, specificity, dice_coef_necrotic, dice_coef_edema, dice_coef_enhancing])
+                           metrics=['accuracy', tf.keras.metrics.MeanIoU(num_classes=4), *segmentation_metrics(self.num_classes)])
+        self._compiled = True
+        self._compile_settings = (self.model.dtype_policy.name == "mixed_float16", False)
         self.model.load_weights(weights_path)
         print(f"Loaded weights from {weights_path}")
         
@@ -299,13 +399,30 @@ class Unet:
 
 
 
+    def predict_slices(self, X):
+        """Runs a batch of slices through the inference graph, traced once and reused afterwards."""
+        if self._forward is None:
+            self._forward = tf.function(lambda x: self.model(x, training=False), reduce_retracing=True)
+        return self._forward(tf.convert_to_tensor(X, dtype=tf.float32)).numpy()
+
+    def predict_volume(self, X, chunk_slices=INFERENCE_CHUNK_SLICES, skip_empty=False, tta=1):
+        """Softmax of every slice of X in chunks, optionally skipping slices without brain tissue and
+        averaging test-time augmentation variants (see inference.predict_volume)."""
+        return predict_volume(self.predict_slices, X, self.num_classes, chunk_slices, skip_empty, tta,
+                              counter=self.slice_counter)
+
+    def evaluate_streaming(self, case_ids, results_path, resume=True, prefetch=2, progress_callback=None, should_stop=None):
+        """Evaluates the model case by case with per-case metrics written to results_path (JSON lines).
+
+        Returns a flat dict of aggregate metrics; an interrupted run resumes from results_path.
+        """
+        evaluator = StreamingEvaluator(self.predict_slices, case_ids, results_path, prefetch=prefetch)
+        return evaluator.run(resume=resume, progress_callback=progress_callback, should_stop=should_stop)
+
     def evaluate(self, test_generator):
         """Evaluates the model on the test data."""
-        self.model.compile(loss="categorical_crossentropy", 
-                           optimizer=tf.keras.optimizers.Adam(learning_rate=self.learning_rate), 
-                           metrics=['accuracy', tf.keras.metrics.MeanIoU(num_classes=self.num_classes), 
-                                    dice_coef, precision, sensitivity, specificity, 
-                                    dice_coef_necrotic, dice_coef_edema, dice_coef_enhancing])
+        if not self._compiled:
+            self.compile_model()
         results = self.model.evaluate(test_generator, batch_size=100)
         descriptions = ["Loss", "Accuracy", "MeanIOU", "Dice coefficient", "Precision", "Sensitivity", 
                         "Specificity", "Dice coef Necrotic", "Dice coef Edema", "Dice coef Enhancing"]
@@ -322,26 +439,17 @@ class Unet:
     def predictFromFiles(self, flair_file_path: str, t1ce_file_path: str):
         """Predicts the segmentation given uploaded flair and t1ce .nii files."""
         
-        # Initialize the volume array
-        X = np.empty((VOLUME_SLICES, self.img_size, self.img_size, 2))
-
-        # Load the flair and t1ce .nii files
-        flair = nib.load(flair_file_path).get_fdata()
-        ce = nib.load(t1ce_file_path).get_fdata()
-
-        # Process the slices for prediction
-        for j in range(VOLUME_SLICES):
-            X[j,:,:,0] = cv2.resize(flair[:,:,j+VOLUME_START_AT], (self.img_size, self.img_size))
-            X[j,:,:,1] = cv2.resize(ce[:,:,j+VOLUME_START_AT], (self.img_size, self.img_size))
-
-        # Normalize the input and pass it through the model
-        print("Start getting prediction")
-        p = self.model.predict(X / np.max(X), verbose=1)
+        with stage("preprocessing"):
+            # Load the flair and t1ce .nii files, resize the slab slices and normalize
+            flair = nib.load(flair_file_path).get_fdata(dtype=np.float32)
+            ce = nib.load(t1ce_file_path).get_fdata(dtype=np.float32)
+            X = build_input(flair, ce, img_size=self.img_size)
+
+        # Only the slices with brain tissue go through the model, the rest is background
+        with stage("model"):
+            p = self.predict_volume(X, skip_empty=SKIP_EMPTY_SLICES)
         
-        # Optionally, display the predictions
-        print("Start displaying prediction results")
-        self.showPredictsFromFile(p, flair, start_slice=60)
-        print("End of display")
+        # Previews are rendered on request by render.py (/render/{slice}), not with matplotlib here
 
         return p
 
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+import onnxruntime as ort
+
+from config import IMG_SIZE, INFERENCE_CHUNK_SLICES
+from inference import predict_volume, SliceCounter
+from evaluation import StreamingEvaluator
+
+
+class OnnxUnet:
+    """The exported U-Net (see onnx_export.py) on ONNX Runtime's CPU provider.
+
+    Has the inference methods of model.Unet the serving code uses, without importing TensorFlow.
+    """
+
+    def __init__(self, model_path, img_size=IMG_SIZE, num_classes=4, intra_op_threads=None):
+        self.model_path = model_path
+        self.img_size = img_size
+        self.num_classes = num_classes
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads is None and os.getenv("ORT_INTRA_OP_THREADS"):
+            intra_op_threads = int(os.getenv("ORT_INTRA_OP_THREADS"))
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.slice_counter = SliceCounter()
+
+    def predict_slices(self, X):
+        """Softmax of a batch of (img_size, img_size, 2) slices; the batch dimension is dynamic."""
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(X, dtype=np.float32)})[0]
+
+    def predict_volume(self, X, chunk_slices=INFERENCE_CHUNK_SLICES, skip_empty=False, tta=1):
+        """Same as model.Unet.predict_volume."""
+        return predict_volume(self.predict_slices, X, self.num_classes, chunk_slices, skip_empty, tta,
+                              counter=self.slice_counter)
+
+    def evaluate_streaming(self, case_ids, results_path, resume=True, prefetch=2, progress_callback=None, should_stop=None):
+        """Same as model.Unet.evaluate_streaming."""
+        evaluator = StreamingEvaluator(self.predict_slices, case_ids, results_path, prefetch=prefetch)
+        return evaluator.run(resume=resume, progress_callback=progress_callback, should_stop=should_stop)
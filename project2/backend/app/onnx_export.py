@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from preprocess import load_nifti, build_input
+
+# Oldest opset with every op of the U-Net as exported by tf2onnx, supported by current ONNX Runtime releases
+DEFAULT_OPSET = 17
+
+
+def export_onnx(unet_model, output_path, opset=DEFAULT_OPSET):
+    """Writes the inference graph of a model.Unet to output_path as ONNX, with a dynamic batch dimension."""
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, unet_model.img_size, unet_model.img_size, 2), tf.float32, name="input"),)
+    forward = tf.function(lambda x: unet_model.model(x, training=False))
+    tmp_path = output_path + ".tmp"
+    tf2onnx.convert.from_function(forward, input_signature=spec, opset=opset, output_path=tmp_path)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def check_parity(unet_model, onnx_path, num_cases=2, atol=1e-4, data_dir=None):
+    """Compares the Keras and ONNX Runtime softmax on synthetic BraTS-shaped volumes.
+
+    Returns the largest and mean absolute difference, the share of voxels with the same argmax
+    label, the inference time of each backend and whether the largest difference is within atol.
+    """
+    from benchmark import make_synthetic_cases
+    from onnx_backend import OnnxUnet
+
+    data_dir = data_dir or tempfile.mkdtemp(prefix="onnx_parity_")
+    onnx_model = OnnxUnet(onnx_path, img_size=unet_model.img_size, num_classes=unet_model.num_classes)
+    max_diff, diff_sum, same_labels, voxels = 0.0, 0.0, 0, 0
+    seconds = {"keras": 0.0, "onnx": 0.0}
+    for case_id in make_synthetic_cases(data_dir, num_cases):
+        case_path = os.path.join(data_dir, case_id)
+        X = build_input(load_nifti(os.path.join(case_path, f"{case_id}_flair.nii")),
+                        load_nifti(os.path.join(case_path, f"{case_id}_t1ce.nii")))
+        predictions = {}
+        for name, backend in [("keras", unet_model), ("onnx", onnx_model)]:
+            start = time.perf_counter()
+            predictions[name] = backend.predict_slices(X)
+            seconds[name] += time.perf_counter() - start
+        diff = np.abs(predictions["keras"] - predictions["onnx"])
+        max_diff = max(max_diff, float(diff.max()))
+        diff_sum += float(diff.sum())
+        same_labels += int((predictions["keras"].argmax(-1) == predictions["onnx"].argmax(-1)).sum())
+        voxels += diff.shape[0] * diff.shape[1] * diff.shape[2]
+    return {
+        "cases": num_cases,
+        "max_abs_diff": max_diff,
+        "mean_abs_diff": diff_sum / (voxels * unet_model.num_classes),
+        "label_agreement": same_labels / voxels,
+        "seconds": seconds,
+        "passed": max_diff <= atol,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the U-Net to ONNX and check it against Keras")
+    parser.add_argument("--weights", default="my_model.keras")
+    parser.add_argument("--output", default="my_model.onnx")
+    parser.add_argument("--opset", type=int, default=DEFAULT_OPSET)
+    parser.add_argument("--check-cases", type=int, default=2, help="synthetic cases of the parity check, 0 to skip it")
+    parser.add_argument("--atol", type=float, default=1e-4, help="largest absolute softmax difference accepted")
+    args = parser.parse_args()
+
+    from batch import load_unet
+
+    unet_model = load_unet(args.weights)
+    export_onnx(unet_model, args.output, args.opset)
+    print(f"Exported {args.weights} to {args.output}", file=sys.stderr)
+    if args.check_cases > 0:
+        report = check_parity(unet_model, args.output, args.check_cases, args.atol)
+        json.dump(report, sys.stdout, indent=2)
+        if not report["passed"]:
+            sys.exit(f"ONNX output differs from Keras by {report['max_abs_diff']:.2e} > {args.atol:.0e}")
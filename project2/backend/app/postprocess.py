@@ -0,0 +1,87 @@
+import gzip
+import numpy as np
+import nibabel as nib
+
+from config import VOLUME_START_AT, SEGMENT_CLASSES, BRATS_LABELS
+
+
+def labels_of(prediction):
+    """uint8 argmax class labels of a (slices, H, W, classes) softmax prediction."""
+    return np.argmax(prediction, axis=-1).astype(np.uint8)
+
+
+def brats_labels(labels):
+    """Class indices mapped to the BraTS label convention (0, 1, 2, 4) of the input datasets."""
+    return np.asarray(BRATS_LABELS, dtype=np.uint8)[labels]
+
+
+def upsample_labels(labels, height, width):
+    """Nearest-neighbour resize of (slices, h, w) label maps to (slices, height, width) in one gather.
+
+    Native pixel r reads model pixel floor(r * h / height), the inverse of the mapping cv2's
+    INTER_NEAREST uses when the inputs are downsized.
+    """
+    rows = (np.arange(height) * labels.shape[1]) // height
+    cols = (np.arange(width) * labels.shape[2]) // width
+    return labels[:, rows[:, np.newaxis], cols[np.newaxis, :]]
+
+
+def native_label_volume(labels, shape, start=VOLUME_START_AT):
+    """(H, W, D) BraTS label volume (see brats_labels) in the input geometry: upsampled in-plane,
+    slices outside [start, start + len(labels)) labelled background."""
+    height, width, depth = shape[:3]
+    volume = np.zeros((height, width, depth), dtype=np.uint8)
+    end = min(depth, start + len(labels))
+    volume[:, :, start:end] = brats_labels(upsample_labels(labels[:end - start], height, width)).transpose(1, 2, 0)
+    return volume
+
+
+def segmentation_image(prediction, reference, start=VOLUME_START_AT):
+    """Nifti1Image of the predicted labels, as BraTS labels (enhancing tumour 4), with the shape,
+    affine and header of the input volume."""
+    return label_image(labels_of(prediction), reference, start)
+
+
+def label_image(labels, reference, start=VOLUME_START_AT):
+    """segmentation_image of (slices, h, w) labels already taken from a prediction."""
+    volume = native_label_volume(labels, reference.shape, start)
+    header = reference.header.copy()
+    header.set_data_dtype(np.uint8)
+    # The labels are stored as is, not scaled like the input intensities may be
+    header.set_slope_inter(1, 0)
+    return nib.Nifti1Image(volume, reference.affine, header=header)
+
+
+def segmentation_bytes(prediction, reference, start=VOLUME_START_AT, compresslevel=1):
+    """Gzipped .nii.gz bytes of segmentation_image."""
+    return gzip.compress(segmentation_image(prediction, reference, start).to_bytes(), compresslevel=compresslevel)
+
+
+def save_segmentation(prediction, reference, path, start=VOLUME_START_AT):
+    """Writes segmentation_image to path (.nii.gz for a compressed file)."""
+    nib.save(segmentation_image(prediction, reference, start), path)
+    return path
+
+
+def segmentation_summary(prediction, reference, start=VOLUME_START_AT):
+    """Per-class voxel counts, volumes and mean softmax confidence of a prediction, plus the
+    slices (indices into the prediction, the first one being axial slice start) that contain
+    any tumor class."""
+    labels = labels_of(prediction)
+    counts = np.bincount(labels.ravel(), minlength=len(SEGMENT_CLASSES))
+    # One model voxel covers this many native voxels in-plane
+    in_plane_scale = reference.shape[0] * reference.shape[1] / (labels.shape[1] * labels.shape[2])
+    voxel_ml = float(np.prod(reference.header.get_zooms()[:3])) / 1000
+    classes = {}
+    for c, name in SEGMENT_CLASSES.items():
+        confidence = prediction[..., c][labels == c]
+        classes[name] = {
+            "voxels": int(counts[c]),
+            "volume_ml": round(float(counts[c] * in_plane_scale * voxel_ml), 3),
+            "mean_probability": round(float(confidence.mean()), 4) if confidence.size else None,
+        }
+    return {
+        "classes": classes,
+        "start": start,
+        "tumor_slices": np.flatnonzero((labels > 0).any(axis=(1, 2))).tolist(),
+    }
@@ -0,0 +1,111 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+import nibabel as nib
+
+from config import VOLUME_START_AT
+
+# What postprocess.segmentation_image needs of the input volume, without its voxels
+ImageGeometry = namedtuple("ImageGeometry", ["shape", "affine", "header"])
+
+
+def content_id(*contents, salt=""):
+    """Content hash of the uploaded files (and model version), used as the ID of their prediction."""
+    digest = hashlib.sha256(salt.encode())
+    for content in contents:
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()[:32]
+
+
+def geometry_of(image):
+    return ImageGeometry(tuple(image.shape), image.affine, image.header.copy())
+
+
+class PredictionCache:
+    """Predictions of uploaded cases by content hash, so a case is run through the model once
+    however many slices, overlays or encodings of it are requested.
+
+    Entries are dicts with the softmax "prediction", the resized "flair" slices the model saw, the
+    input "geometry" and the axial index of the first predicted slice, "start". The last max_items entries are kept in memory; older ones are spilled to
+    spill_dir as .npz (probabilities as float16) when it is set, and dropped otherwise.
+    """
+
+    def __init__(self, max_items=8, spill_dir=None):
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.npz")
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._load_spilled(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.max_items:
+                evicted.append(self.entries.popitem(last=False))
+        for evicted_key, evicted_entry in evicted:
+            self._spill(evicted_key, evicted_entry)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self.entries:
+                return True
+        return bool(self.spill_dir) and os.path.exists(self._spill_path(key))
+
+    def _spill(self, key, entry):
+        if not self.spill_dir or os.path.exists(self._spill_path(key)):
+            return
+        geometry = entry["geometry"]
+        tmp_path = self._spill_path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, prediction=entry["prediction"].astype(np.float16), flair=entry["flair"].astype(np.float16),
+                     start=entry["start"], model_version=np.array(entry.get("model_version") or ""), shape=np.array(geometry.shape), affine=geometry.affine,
+                     header=np.frombuffer(geometry.header.binaryblock, dtype=np.uint8))
+        os.replace(tmp_path, self._spill_path(key))
+
+    def _load_spilled(self, key):
+        if not self.spill_dir or not os.path.exists(self._spill_path(key)):
+            return None
+        try:
+            with np.load(self._spill_path(key)) as data:
+                header = nib.Nifti1Header(binaryblock=data["header"].tobytes())
+                return {
+                    "prediction": data["prediction"].astype(np.float32),
+                    "flair": data["flair"].astype(np.float32),
+                    "geometry": ImageGeometry(tuple(int(n) for n in data["shape"]), data["affine"], header),
+                    "start": int(data["start"]) if "start" in data else VOLUME_START_AT,
+                    "model_version": str(data["model_version"]) if "model_version" in data else None,
+                }
+        except (OSError, KeyError, ValueError):
+            # A corrupt spill file is a miss, the case is predicted again
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {"in_memory": len(self.entries), "max_items": self.max_items,
+                    "hits": self.hits, "misses": self.misses, "spill_dir": self.spill_dir}
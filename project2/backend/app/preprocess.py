@@ -0,0 +1,94 @@
+import os
+import cv2
+import numpy as np
+import nibabel as nib
+from dotenv import load_dotenv
+
+from config import IMG_SIZE, VOLUME_SLICES, VOLUME_START_AT, INFERENCE_MODES
+from config import BRAIN_INTENSITY_THRESHOLD, MIN_TISSUE_FRACTION
+
+load_dotenv()
+# From env file
+TRAIN_DATASET_PATH = os.getenv('DATASET_BASE_PATH')
+
+# cv2.resize handles at most CV_CN_MAX channels in one call: 512 up to OpenCV 4, 128 from OpenCV 5
+CV_MAX_CHANNELS = getattr(cv2, "CV_CN_MAX", 128)
+
+
+def load_nifti(path):
+    """Loads a .nii volume as float32 (get_fdata defaults to float64, twice the memory)."""
+    return nib.load(path).get_fdata(dtype=np.float32)
+
+
+def resize_slices(volume, start=VOLUME_START_AT, count=VOLUME_SLICES, img_size=IMG_SIZE, interpolation=cv2.INTER_LINEAR):
+    """Resizes axial slices [start, start + count) of a (H, W, D) volume.
+
+    The slices are passed to cv2.resize as channels of one image instead of one call per slice.
+
+    Returns:
+        np.ndarray of shape (count, img_size, img_size)
+    """
+    resized = np.empty((count, img_size, img_size), dtype=volume.dtype)
+    for chunk_start in range(0, count, CV_MAX_CHANNELS):
+        chunk = volume[:, :, start + chunk_start:start + min(count, chunk_start + CV_MAX_CHANNELS)]
+        out = cv2.resize(np.ascontiguousarray(chunk), (img_size, img_size), interpolation=interpolation)
+        if out.ndim == 2:
+            out = out[:, :, np.newaxis]
+        resized[chunk_start:chunk_start + out.shape[2]] = np.moveaxis(out, -1, 0)
+    return resized
+
+
+def build_input(flair, t1ce, start=VOLUME_START_AT, count=VOLUME_SLICES, img_size=IMG_SIZE):
+    """Stacks the resized flair and t1ce slices into the (count, img_size, img_size, 2) model input.
+
+    It is scaled by its max over the training slab [VOLUME_START_AT, VOLUME_START_AT + VOLUME_SLICES),
+    as in training and "window" mode, so a slice gets the same input whatever the inference mode;
+    in "full" mode the slices outside the slab can exceed 1. An input not overlapping the slab uses its own max.
+    """
+    X = np.empty((count, img_size, img_size, 2), dtype=np.float32)
+    X[..., 0] = resize_slices(flair, start, count, img_size)
+    X[..., 1] = resize_slices(t1ce, start, count, img_size)
+    slab = X[max(0, VOLUME_START_AT - start):max(0, VOLUME_START_AT + VOLUME_SLICES - start)]
+    max_value = np.max(slab) if slab.size else np.max(X)
+    if max_value > 0:
+        X /= max_value
+    return X
+
+
+def inference_slab(mode, depth):
+    """(start, count) of the axial slices predicted in an inference mode, for a volume of depth slices."""
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode {mode}, expected one of {INFERENCE_MODES}")
+    if mode == "full":
+        return 0, depth
+    return VOLUME_START_AT, VOLUME_SLICES
+
+
+def tissue_fractions(X, intensity_threshold=BRAIN_INTENSITY_THRESHOLD):
+    """Fraction of each slice of a model input covered by the brain mask: scaled flair above intensity_threshold.
+
+    BraTS volumes are skull-stripped, so the background is zero and a threshold is enough.
+    """
+    mask = X[..., 0] > intensity_threshold
+    return mask.reshape(len(X), -1).mean(axis=1)
+
+
+def tissue_slices(X, intensity_threshold=BRAIN_INTENSITY_THRESHOLD, min_fraction=MIN_TISSUE_FRACTION):
+    """Indices of the slices of a model input with at least min_fraction brain tissue."""
+    return np.flatnonzero(tissue_fractions(X, intensity_threshold) >= min_fraction)
+
+
+def build_labels(seg, start=VOLUME_START_AT, count=VOLUME_SLICES, img_size=IMG_SIZE):
+    """Resized ground truth labels (count, img_size, img_size) as uint8, with label 4 mapped to 3."""
+    labels = resize_slices(seg.astype(np.uint8), start, count, img_size, interpolation=cv2.INTER_NEAREST)
+    labels[labels == 4] = 3
+    return labels
+
+
+def load_case(case_id, base_path=TRAIN_DATASET_PATH):
+    """Loads one BraTS case as model input X and ground truth labels."""
+    case_path = os.path.join(base_path, case_id)
+    flair = load_nifti(os.path.join(case_path, f'{case_id}_flair.nii'))
+    t1ce = load_nifti(os.path.join(case_path, f'{case_id}_t1ce.nii'))
+    seg = load_nifti(os.path.join(case_path, f'{case_id}_seg.nii'))
+    return build_input(flair, t1ce), build_labels(seg)
@@ -0,0 +1,221 @@
+import os
+import random
+import hashlib
+import threading
+import traceback
+from datetime import datetime, timezone
+import numpy as np
+
+from config import IMG_SIZE, INFERENCE_CHUNK_SLICES
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_nbytes(model, path):
+    """Memory held by a loaded model: its weights for Keras, the size of the file for ONNX."""
+    keras_model = getattr(model, "model", None)
+    if keras_model is not None:
+        return sum(int(np.prod(w.shape)) * np.dtype(w.dtype).itemsize for w in keras_model.weights)
+    return os.path.getsize(path)
+
+
+def warm_up(model, batch_size=INFERENCE_CHUNK_SLICES):
+    """Runs a full chunk through the model, so its graph is traced before it takes traffic."""
+    model.predict_slices(np.zeros((batch_size, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32))
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ModelVersion:
+    def __init__(self, path):
+        self.path = path
+        # Set by identify(), on the loading thread: hashing a large weights file takes seconds
+        self.digest = None
+        self.version = None
+        self.model = None
+        self.nbytes = 0
+        self.status = "loading"
+        self.error = None
+        self.loaded_at = None
+        self.last_used = 0.0
+        # Set once the load has finished, ready or failed
+        self.done = threading.Event()
+
+    def identify(self):
+        self.digest = file_digest(self.path)
+        self.version = self.digest[:12]
+
+    def to_dict(self):
+        return {"version": self.version, "path": self.path, "status": self.status, "error": self.error,
+                "bytes": self.nbytes, "loaded_at": self.loaded_at,
+                "slices": self.model.slice_counter.to_dict() if self.model is not None else None}
+
+
+class ModelRegistry:
+    """Versions of the U-Net held in memory, by the first 12 hex digits of their file's digest.
+
+    New versions are loaded and warmed up on a background thread while the active one keeps
+    serving, then swapped in with activate(). get() returns the active version, the canary
+    version for a `canary_fraction` share of requests, or the version a request names.
+    Versions other than the active and canary ones are unloaded, least recently used first,
+    to keep the loaded weights within byte_budget; a version is checked against the budget
+    with the size of its file before it is loaded, and with its actual weights after.
+    """
+
+    def __init__(self, loader, byte_budget, warmup=warm_up):
+        self.loader = loader
+        self.byte_budget = byte_budget
+        self.warmup = warmup
+        self.versions = {}
+        # Versions being hashed, before they have a version key
+        self.pending = []
+        # Bytes set aside for the versions being loaded
+        self.reserved = 0
+        self.active = None
+        self.canary = None
+        self.canary_fraction = 0.0
+        self._lock = threading.Lock()
+        self._clock = 0
+
+    def load(self, path, activate=False, background=True, canary_fraction=0.0):
+        """Loads the model at path as a new version; returns its ModelVersion (status "loading" until ready).
+
+        Once ready, it becomes the active version with activate, or the canary with a canary_fraction > 0.
+        Its version is only known once the background thread has hashed the file.
+        """
+        entry = ModelVersion(path)
+        with self._lock:
+            self.pending.append(entry)
+        if background:
+            threading.Thread(target=self._load, args=(entry, activate, canary_fraction), daemon=True).start()
+        else:
+            self._load(entry, activate, canary_fraction)
+            if entry.status == "failed":
+                raise RuntimeError(f"Could not load {path}: {entry.error}")
+        return entry
+
+    def _load(self, entry, activate, canary_fraction):
+        try:
+            entry.identify()
+            while True:
+                with self._lock:
+                    existing = self.versions.get(entry.version)
+                    if existing is None or existing.status not in ("loading", "ready"):
+                        self.pending.remove(entry)
+                        self.versions[entry.version] = entry
+                        # The file size stands in for the weights until they are loaded, so a version that
+                        # cannot fit is refused before the loader allocates anything
+                        estimate = os.path.getsize(entry.path)
+                        self._make_room(estimate, keep=entry.version)
+                        self.reserved += estimate
+                        break
+                    if existing.status == "ready":
+                        # Already loaded from the same weights
+                        self.pending.remove(entry)
+                        self._route(existing, activate, canary_fraction)
+                        entry.status, entry.model, entry.nbytes = existing.status, existing.model, existing.nbytes
+                        entry.loaded_at = existing.loaded_at
+                        return
+                # Being loaded from the same weights by another thread: wait for it, and load them
+                # here if it fails
+                existing.done.wait()
+            try:
+                model = self.loader(entry.path)
+                self.warmup(model)
+                nbytes = model_nbytes(model, entry.path)
+            finally:
+                with self._lock:
+                    self.reserved -= estimate
+            with self._lock:
+                self._make_room(nbytes, keep=entry.version)
+                entry.model, entry.nbytes = model, nbytes
+                entry.status, entry.loaded_at = "ready", _now()
+                self._route(entry, activate or self.active is None, canary_fraction)
+        except Exception as e:
+            entry.status, entry.error = "failed", str(e)
+            traceback.print_exc()
+        finally:
+            entry.done.set()
+
+    def _route(self, entry, activate, canary_fraction):
+        if activate:
+            self.active = entry.version
+            if self.canary == entry.version:
+                self.canary, self.canary_fraction = None, 0.0
+        elif canary_fraction > 0:
+            self.canary, self.canary_fraction = entry.version, canary_fraction
+
+    def _make_room(self, nbytes, keep):
+        pinned = {self.active, self.canary, keep}
+        loaded = sorted((v for v in self.versions.values() if v.status == "ready" and v.version not in pinned),
+                        key=lambda v: v.last_used)
+        used = sum(v.nbytes for v in self.versions.values() if v.status == "ready") + self.reserved
+        while used + nbytes > self.byte_budget and loaded:
+            evicted = loaded.pop(0)
+            used -= evicted.nbytes
+            self._unload(evicted)
+        if used + nbytes > self.byte_budget:
+            raise MemoryError(f"{nbytes} bytes do not fit in the model budget of {self.byte_budget} bytes "
+                              f"next to the active and canary versions")
+
+    def _unload(self, entry):
+        entry.model, entry.status = None, "unloaded"
+        del self.versions[entry.version]
+
+    def get(self, version=None):
+        """The ready ModelVersion to serve a request with; KeyError when the named version is not ready."""
+        with self._lock:
+            if version is None:
+                version = self.active
+                if self.canary is not None and random.random() < self.canary_fraction:
+                    version = self.canary
+            entry = self.versions.get(version)
+            if entry is None or entry.status != "ready":
+                raise KeyError(version)
+            self._clock += 1
+            entry.last_used = self._clock
+            return entry
+
+    def activate(self, version):
+        """Atomically routes the default traffic to a ready version."""
+        with self._lock:
+            entry = self.versions.get(version)
+            if entry is None or entry.status != "ready":
+                raise KeyError(version)
+            self._route(entry, True, 0.0)
+            return entry
+
+    def set_canary(self, version, fraction):
+        """Sends a fraction of the default traffic to a ready version; version None stops the canary."""
+        with self._lock:
+            if version is not None:
+                entry = self.versions.get(version)
+                if entry is None or entry.status != "ready":
+                    raise KeyError(version)
+            self.canary, self.canary_fraction = version, fraction if version is not None else 0.0
+
+    def unload(self, version):
+        with self._lock:
+            entry = self.versions.get(version)
+            if entry is None:
+                raise KeyError(version)
+            if version in (self.active, self.canary):
+                raise ValueError("The active and canary versions cannot be unloaded")
+            if entry.status == "loading":
+                raise ValueError("The version is still loading")
+            self._unload(entry)
+
+    def describe(self):
+        with self._lock:
+            return {"active": self.active, "canary": self.canary, "canary_fraction": self.canary_fraction,
+                    "byte_budget": self.byte_budget,
+                    "bytes": sum(v.nbytes for v in self.versions.values() if v.status == "ready"),
+                    "versions": [v.to_dict() for v in [*self.versions.values(), *self.pending]]}
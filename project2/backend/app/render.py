@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+# Colors of the segmentation cmap in load_data.py, one per class of SEGMENT_CLASSES
+CLASS_COLORS = np.array([[0x44, 0x00, 0x54], [0x3b, 0x52, 0x8b], [0x18, 0xb8, 0x80], [0xe6, 0xd7, 0x4f]], dtype=np.float32)
+FORMATS = {"png": ("image/png", ".png"), "webp": ("image/webp", ".webp")}
+
+
+def to_gray(image):
+    """Min-max scales a 2D slice to uint8."""
+    image = np.asarray(image, dtype=np.float32)
+    low, high = image.min(), image.max()
+    if high <= low:
+        return np.zeros(image.shape, dtype=np.uint8)
+    return ((image - low) * (255 / (high - low))).astype(np.uint8)
+
+
+def overlay(image, labels, alpha=0.4, classes=(1, 2, 3), colors=CLASS_COLORS):
+    """RGB uint8 slice with the voxels of the given classes blended with their class color."""
+    rgb = np.repeat(to_gray(image)[:, :, np.newaxis], 3, axis=2).astype(np.float32)
+    mask = np.isin(labels, classes)
+    rgb[mask] = (1 - alpha) * rgb[mask] + alpha * colors[labels[mask]]
+    return rgb.astype(np.uint8)
+
+
+def panels(image, labels, alpha=0.4, separator=4):
+    """The preview panels side by side: the image, all classes, then necrotic/core, edema and enhancing."""
+    views = [overlay(image, labels, alpha, classes=())]
+    views += [overlay(image, labels, alpha, classes=classes) for classes in [(1, 2, 3), (1,), (2,), (3,)]]
+    gap = np.zeros((image.shape[0], separator, 3), dtype=np.uint8)
+    return np.concatenate([part for view in views for part in (view, gap)][:-1], axis=1)
+
+
+def upscale(rgb, scale):
+    """Nearest-neighbour upscaling, so label borders stay sharp."""
+    if scale == 1:
+        return rgb
+    return np.repeat(np.repeat(rgb, scale, axis=0), scale, axis=1)
+
+
+def encode_image(rgb, fmt="png"):
+    """(bytes, media type) of an RGB uint8 image as PNG or WebP."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    media_type, extension = FORMATS[fmt]
+    # Fast PNG compression: previews are rendered per request, size matters less than latency
+    params = [cv2.IMWRITE_PNG_COMPRESSION, 1] if fmt == "png" else [cv2.IMWRITE_WEBP_QUALITY, 90]
+    ok, encoded = cv2.imencode(extension, np.ascontiguousarray(rgb[:, :, ::-1]), params)
+    if not ok:
+        raise ValueError(f"Could not encode the image as {fmt}")
+    return encoded.tobytes(), media_type
+
+
+def render_slice(image, labels, layout="overlay", alpha=0.4, scale=1, fmt="png"):
+    """Encoded preview of one slice: its image with the predicted labels overlaid, or all panels."""
+    rgb = overlay(image, labels, alpha) if layout == "overlay" else panels(image, labels, alpha)
+    return encode_image(upscale(rgb, scale), fmt)
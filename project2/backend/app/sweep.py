@@ -0,0 +1,274 @@
+import os
+import json
+import math
+import random
+import hashlib
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import keras
+import numpy as np
+from dotenv import load_dotenv
+
+from config import IMG_SIZE, VOLUME_SLICES, SPLIT_SEED
+from preprocess import load_case
+from checkpointing import save_optimizer_state, load_optimizer_state
+
+load_dotenv()
+MODELS_DIR = os.getenv('MODELS_DIR')
+
+# Values the Unet constructor arguments are sampled from
+SEARCH_SPACE = {
+    "learning_rate": [1e-4, 3e-4, 1e-3, 3e-3],
+    "dropout": [0.0, 0.1, 0.2, 0.3],
+    "ker_init": ["he_normal", "glorot_uniform"],
+}
+
+
+def build_slice_cache(case_ids, cache_dir, slice_stride=4):
+    """Preprocesses the cases once into X.npy / labels.npy, keeping every slice_stride-th slice.
+
+    The cache is keyed by the case ids and stride, so every trial of a sweep (and later sweeps on
+    the same split) memory-maps the same files instead of reading the NIfTI volumes again.
+    """
+    key = hashlib.sha1(json.dumps([sorted(case_ids), slice_stride]).encode()).hexdigest()[:12]
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(path, "labels.npy")):
+        return path
+    os.makedirs(path, exist_ok=True)
+    slices = len(range(0, VOLUME_SLICES, slice_stride))
+    X = np.lib.format.open_memmap(os.path.join(path, "X.tmp.npy"), mode="w+", dtype=np.float32,
+                                  shape=(len(case_ids) * slices, IMG_SIZE, IMG_SIZE, 2))
+    labels = np.empty((len(case_ids) * slices, IMG_SIZE, IMG_SIZE), dtype=np.uint8)
+    for i, case_id in enumerate(case_ids):
+        case_X, case_labels = load_case(case_id)
+        X[i * slices:(i + 1) * slices] = case_X[::slice_stride]
+        labels[i * slices:(i + 1) * slices] = case_labels[::slice_stride]
+    X.flush()
+    del X
+    os.replace(os.path.join(path, "X.tmp.npy"), os.path.join(path, "X.npy"))
+    # labels.npy is written last and marks the cache as complete
+    np.save(os.path.join(path, "labels.tmp.npy"), labels)
+    os.replace(os.path.join(path, "labels.tmp.npy"), os.path.join(path, "labels.npy"))
+    return path
+
+
+class CachedSlices(keras.utils.Sequence):
+    """Batches of a slice cache, with the labels one-hot encoded per batch."""
+
+    def __init__(self, path, batch_size=32, shuffle=True, seed=0):
+        super().__init__()
+        self.X = np.load(os.path.join(path, "X.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.labels) / self.batch_size)
+
+    def __getitem__(self, index):
+        # Sorted so the memmap reads stay sequential within a batch
+        batch = np.sort(self.indexes[index * self.batch_size:(index + 1) * self.batch_size])
+        return np.asarray(self.X[batch]), np.eye(4, dtype=np.float32)[self.labels[batch]]
+
+    def on_epoch_end(self):
+        self.indexes = np.arange(len(self.labels))
+        if self.shuffle:
+            self.rng.shuffle(self.indexes)
+
+
+def sample_trials(num_trials, search_space=SEARCH_SPACE, seed=0):
+    rng = random.Random(seed)
+    return [{"trial_id": i, "params": {name: rng.choice(values) for name, values in search_space.items()}}
+            for i in range(num_trials)]
+
+
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"]
+
+
+def _limit_threads(threads):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_trial(trial, epochs_done, epochs, train_cache, val_cache, sweep_dir, tracking_uri, experiment, batch_size=32):
+    """Trains one trial from epochs_done up to epochs and returns its final val_loss.
+
+    The weights and optimizer state are kept in the sweep directory between rungs and the trial
+    logs to the same mlflow run every rung, so a promoted trial continues where it stopped.
+    A trial that raises is marked FAILED in mlflow and returned with its error instead of a val_loss.
+    """
+    import mlflow
+
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment)
+    with mlflow.start_run(run_id=trial.get("run_id"), run_name=f"trial_{trial['trial_id']:03d}") as run:
+        if trial.get("run_id") is None:
+            mlflow.log_params(trial["params"])
+        try:
+            val_loss = _train_rung(trial, epochs_done, epochs, train_cache, val_cache, sweep_dir, batch_size)
+        except Exception as e:
+            traceback.print_exc()
+            mlflow.set_tag("error", str(e))
+            mlflow.end_run(status="FAILED")
+            return {"trial_id": trial["trial_id"], "run_id": run.info.run_id, "val_loss": None, "error": str(e)}
+        mlflow.log_metric("rung_val_loss", val_loss, step=epochs)
+        return {"trial_id": trial["trial_id"], "run_id": run.info.run_id, "val_loss": val_loss}
+
+
+def _train_rung(trial, epochs_done, epochs, train_cache, val_cache, sweep_dir, batch_size):
+    import mlflow
+    from model import Unet
+
+    weights_path = os.path.join(sweep_dir, f"trial_{trial['trial_id']:03d}.weights.h5")
+    optimizer_path = os.path.join(sweep_dir, f"trial_{trial['trial_id']:03d}.optimizer.npz")
+    unet = Unet(img_size=IMG_SIZE, num_classes=4, **trial["params"])
+    unet.compile_model()
+    if epochs_done and os.path.exists(weights_path):
+        unet.model.load_weights(weights_path)
+        # Adam's moments and step count, so a rung continues the training instead of restarting it
+        if os.path.exists(optimizer_path):
+            load_optimizer_state(unet.model, optimizer_path)
+
+    class _MlflowLogger(keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            mlflow.log_metrics({key: float(value) for key, value in (logs or {}).items()}, step=epoch)
+
+    history = unet.model.fit(
+        CachedSlices(train_cache, batch_size=batch_size, seed=trial["trial_id"] * 1000 + epochs_done),
+        validation_data=CachedSlices(val_cache, batch_size=batch_size, shuffle=False),
+        epochs=epochs,
+        initial_epoch=epochs_done,
+        callbacks=[_MlflowLogger()],
+        verbose=0,
+    )
+    unet.model.save_weights(weights_path)
+    save_optimizer_state(unet.model, optimizer_path)
+    return float(history.history["val_loss"][-1])
+
+
+def _mark_failed(record, error, tracking_uri, experiment):
+    """Records a trial whose worker process died as a FAILED mlflow run."""
+    import mlflow
+
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment)
+    with mlflow.start_run(run_id=record.get("run_id"), run_name=f"trial_{record['trial_id']:03d}") as run:
+        if record.get("run_id") is None:
+            mlflow.log_params(record["params"])
+        mlflow.set_tag("error", error)
+        mlflow.end_run(status="FAILED")
+        return run.info.run_id
+
+
+def successive_halving(trials, train_cache, val_cache, sweep_dir, min_epochs=1, max_epochs=9, eta=3,
+                       workers=2, threads_per_trial=None, experiment="unet_sweep", batch_size=32):
+    """Runs the trials with successive halving: every rung trains the surviving trials in parallel
+    for eta times the previous budget and keeps the best 1/eta of them by val_loss.
+
+    Returns the trial records (params, mlflow run id, val_loss per rung), best first. A trial that
+    fails is dropped from the following rungs with its "error" recorded, and the others go on.
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    tracking_uri = "file:" + os.path.abspath(os.path.join(sweep_dir, "mlruns"))
+    threads_per_trial = threads_per_trial or max(1, (os.cpu_count() or 1) // workers)
+    records = {trial["trial_id"]: dict(trial, rungs=[]) for trial in trials}
+
+    # The pool processes are spawned (no inherited tensorflow state) with the thread limits in their
+    # environment, which is read when tensorflow is first imported there
+    context = multiprocessing.get_context("spawn")
+    saved_environ = {variable: os.environ.get(variable)
+                     for variable in THREAD_VARIABLES + ["TF_NUM_INTEROP_THREADS", "CUDA_VISIBLE_DEVICES"]}
+    os.environ.update({variable: str(threads_per_trial) for variable in THREAD_VARIABLES}, TF_NUM_INTEROP_THREADS="1")
+    if workers > 1:
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    try:
+        records = _run_rungs(records, context, train_cache, val_cache, sweep_dir, tracking_uri, experiment,
+                             min_epochs, max_epochs, eta, workers, threads_per_trial, batch_size)
+    finally:
+        for variable, value in saved_environ.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+    def final_loss(record):
+        # Failed trials rank last, and trials stopped early behind every trial that reached a later rung
+        if record.get("error") is not None:
+            return (1, 0, 0.0)
+        return (0, -len(record["rungs"]), record["rungs"][-1]["val_loss"])
+    return sorted(records.values(), key=final_loss)
+
+
+def _run_rungs(records, context, train_cache, val_cache, sweep_dir, tracking_uri, experiment,
+               min_epochs, max_epochs, eta, workers, threads_per_trial, batch_size):
+    survivors = list(records)
+    epochs_done, budget = 0, min_epochs
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_limit_threads, initargs=(threads_per_trial,)) as pool:
+        while survivors:
+            futures = [pool.submit(run_trial, records[trial_id], epochs_done, budget, train_cache, val_cache,
+                                   sweep_dir, tracking_uri, experiment, batch_size)
+                       for trial_id in survivors]
+            for trial_id, future in zip(survivors, futures):
+                record = records[trial_id]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process died, so the trial could not record its failure itself
+                    traceback.print_exc()
+                    result = {"trial_id": trial_id, "val_loss": None, "error": str(e),
+                              "run_id": _mark_failed(record, str(e), tracking_uri, experiment)}
+                record["run_id"] = result["run_id"]
+                if result.get("error") is not None:
+                    record["error"] = result["error"]
+                else:
+                    record["rungs"].append({"epochs": budget, "val_loss": result["val_loss"]})
+            with open(os.path.join(sweep_dir, "sweep.json"), "w") as f:
+                json.dump(list(records.values()), f, indent=2)
+
+            survivors = [trial_id for trial_id in survivors if records[trial_id].get("error") is None]
+            if budget >= max_epochs or len(survivors) <= 1:
+                break
+            survivors = sorted(survivors, key=lambda t: records[t]["rungs"][-1]["val_loss"])
+            survivors = survivors[:max(1, len(survivors) // eta)]
+            epochs_done, budget = budget, min(max_epochs, budget * eta)
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Successive halving sweep over the Unet hyperparameters")
+    parser.add_argument("--trials", type=int, default=9)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-trial", type=int, default=None)
+    parser.add_argument("--min-epochs", type=int, default=1)
+    parser.add_argument("--max-epochs", type=int, default=9)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--max-cases", type=int, default=20, help="train/val cases used by the sweep")
+    parser.add_argument("--slice-stride", type=int, default=4)
+    parser.add_argument("--sweep-dir", default=os.path.join(MODELS_DIR or "./", "sweeps"))
+    parser.add_argument("--seed", type=int, default=0, help="seed of the trial sampling")
+    parser.add_argument("--split-seed", type=int, default=SPLIT_SEED,
+                        help="seed of the train/val/test split, the serving and evaluation one by default")
+    args = parser.parse_args()
+
+    from load_data import Datasource
+
+    source = Datasource()
+    # The split training and /evaluate/ use, so no trial is tuned on a test case
+    source.pathListIntoIds(random_state=args.split_seed)
+    cache_dir = os.path.join(args.sweep_dir, "cache")
+    train_cache = build_slice_cache(source.train_ids[:args.max_cases], cache_dir, args.slice_stride)
+    val_cache = build_slice_cache(source.val_ids[:args.max_cases], cache_dir, args.slice_stride)
+
+    results = successive_halving(sample_trials(args.trials, seed=args.seed), train_cache, val_cache, args.sweep_dir,
+                                 min_epochs=args.min_epochs, max_epochs=args.max_epochs, eta=args.eta,
+                                 workers=args.workers, threads_per_trial=args.threads_per_trial)
+    best = results[0]
+    if best.get("error") is not None:
+        raise SystemExit(f"All {len(results)} trials failed, see {args.sweep_dir}/sweep.json")
+    print(f"Best trial {best['trial_id']}: {best['params']} val_loss={best['rungs'][-1]['val_loss']:.6f}")
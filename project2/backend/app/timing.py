@@ -0,0 +1,224 @@
+# Kept identical in project1/backend/app/timing.py and project2/backend/app/timing.py: each image only
+# copies its own backend/app. Change both (project2/backend/tests/test_shared_modules.py checks it).
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_request_timer = ContextVar("request_timer", default=None)
+
+# Seconds, from a cache hit to a full-volume or long report inference
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Prometheus text exposition format, as served at /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class StageTimer:
+    """Wall time spent in the named stages (upload_parse, preprocessing, model, ...) of one request."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds."""
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages.items())
+
+
+@contextmanager
+def stage(name):
+    """Times the block as stage `name` of the current request (a no-op outside a request)."""
+    timer = _request_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value per combination of label values, only ever increased."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # A metric without labels has its single series from the start
+        self.values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """(name, {label: value}, value) of every series."""
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """A value per combination of label values that goes up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Counter):
+    """Observations per combination of label values, counted in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self.values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+def snapshot(metric_class, name, help, values, labelnames=()):
+    """A metric holding values read at scrape time: a number, or {label values tuple: number}."""
+    metric = metric_class(name, help, labelnames)
+    metric.values = values if isinstance(values, dict) else {(): values}
+    return metric
+
+
+class MetricsRegistry:
+    """The metrics of a service, rendered in the Prometheus text format.
+
+    Collectors are called on every render and return metrics read from state kept elsewhere
+    (cache statistics, queue lengths, ...), usually built with snapshot().
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        # Registering a name twice returns the first metric, so modules can be imported again
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        metrics = list(self.metrics.values())
+        for collector in self.collectors:
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text
+                             else f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+REQUESTS = METRICS.counter("http_requests_total", "Requests by endpoint and status code", ("method", "endpoint", "status"))
+REQUEST_SECONDS = METRICS.histogram("http_request_duration_seconds", "Request latency by endpoint", ("method", "endpoint"))
+IN_FLIGHT = METRICS.gauge("http_requests_in_flight", "Requests being served")
+STAGE_SECONDS = METRICS.histogram("http_request_stage_duration_seconds",
+                                  "Time per stage (upload_parse, preprocessing, model, ...) of a request",
+                                  ("endpoint", "stage"))
+
+
+def add_timing_middleware(app, server_timing_header=None, metrics_path="/metrics"):
+    """Records the latency and stages of every request in METRICS, served at metrics_path.
+
+    The stages are also reported in each Server-Timing response header, unless disabled with
+    server_timing_header=False or the SERVER_TIMING=0 environment variable.
+    """
+    from fastapi.responses import Response
+
+    if server_timing_header is None:
+        server_timing_header = os.getenv("SERVER_TIMING", "1") != "0"
+
+    @app.middleware("http")
+    async def server_timing(request, call_next):
+        timer = StageTimer()
+        token = _request_timer.set(timer)
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            _request_timer.reset(token)
+            IN_FLIGHT.dec()
+            # The route template, not the path, so IDs in paths do not make new series
+            route = request.scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            REQUESTS.inc(method=request.method, endpoint=endpoint, status=status_code)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint)
+            for name, seconds in timer.stages.items():
+                STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=name)
+        if server_timing_header and timer.stages:
+            response.headers["Server-Timing"] = timer.server_timing()
+        return response
+
+    @app.get(metrics_path, include_in_schema=False)
+    async def metrics():
+        return Response(content=METRICS.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,36 @@
+import numpy as np
+
+# In-plane transforms of the dihedral group as (quarter turns, flip), in the order variants are added:
+# identity, the flips, then the rotations. Each is applied to a whole (slices, H, W, C) batch at once.
+TRANSFORMS = [(0, False), (0, True), (2, True), (2, False), (1, False), (3, False), (1, True), (3, True)]
+MAX_VARIANTS = len(TRANSFORMS)
+
+
+def _apply(X, turns, flip):
+    if flip:
+        X = X[:, :, ::-1]
+    return np.rot90(X, turns, axes=(1, 2))
+
+
+def _invert(P, turns, flip):
+    P = np.rot90(P, -turns, axes=(1, 2))
+    if flip:
+        P = P[:, :, ::-1]
+    return P
+
+
+def augment(X, variants):
+    """The first `variants` transforms of a batch of square slices, stacked into one batch of
+    variants * len(X) slices for a single forward pass."""
+    if not 1 <= variants <= MAX_VARIANTS:
+        raise ValueError(f"variants must be between 1 and {MAX_VARIANTS}")
+    return np.concatenate([_apply(X, *transform) for transform in TRANSFORMS[:variants]])
+
+
+def merge(P, variants):
+    """Mean of the predictions of an augment batch, each mapped back to the orientation of the input."""
+    P = P.reshape(variants, -1, *P.shape[1:])
+    merged = np.zeros(P.shape[1:], dtype=np.float32)
+    for variant, transform in zip(P, TRANSFORMS[:variants]):
+        merged += _invert(variant, *transform)
+    return merged / variants
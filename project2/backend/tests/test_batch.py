@@ -0,0 +1,93 @@
+import json
+import numpy as np
+import nibabel as nib
+import pytest
+
+from batch import BatchCase, BatchPredictor
+from prediction_cache import geometry_of
+
+GEOMETRY = geometry_of(nib.Nifti1Image(np.zeros((8, 8, 6), dtype=np.float32), np.eye(4)))
+CASES = [BatchCase(f"case_{i}", f"case_{i}_flair.nii", f"case_{i}_t1ce.nii") for i in range(6)]
+
+
+class Crash(BaseException):
+    """Stands in for the process being killed: not caught as a failed case."""
+
+
+def fake_load(case, mode):
+    # The case number in every voxel, so the predictor knows which case it is given
+    X = np.full((2, 4, 4, 2), int(case.case_id.split("_")[1]), dtype=np.float32)
+    return X, GEOMETRY, 1
+
+
+class FakePredictor:
+    """One-hot predictions of class (case number % 4); raises crash after `crash_after` cases."""
+
+    def __init__(self, crash_after=None, fail=()):
+        self.crash_after = crash_after
+        self.fail = set(fail)
+        self.seen = []
+
+    def __call__(self, X):
+        case = int(X[0, 0, 0, 0])
+        if self.crash_after is not None and len(self.seen) == self.crash_after:
+            raise Crash()
+        self.seen.append(case)
+        if case in self.fail:
+            raise RuntimeError("out of memory")
+        return np.eye(4, dtype=np.float32)[np.full(X.shape[:3], case % 4)]
+
+
+def _predictor(output_dir, predict_fn, mode="window"):
+    return BatchPredictor(predict_fn, CASES, str(output_dir), prefetch=2, writers=1, mode=mode, load_fn=fake_load)
+
+
+def test_batch_writes_every_case(tmp_path):
+    stats = _predictor(tmp_path, FakePredictor()).run()
+    assert (stats["predicted"], stats["skipped"], stats["failed"]) == (6, 0, 0)
+    volume = np.asarray(nib.load(tmp_path / "case_3_pred.nii.gz").dataobj)
+    # Class 3 is written as BraTS label 4 on the predicted slices [1, 3) only
+    assert sorted(np.unique(volume[:, :, 1:3])) == [4]
+    assert not volume[:, :, [0, 3, 4, 5]].any()
+
+
+def test_resume_after_crash_skips_logged_cases(tmp_path):
+    with pytest.raises(Crash):
+        _predictor(tmp_path, FakePredictor(crash_after=3)).run()
+    logged = set(_predictor(tmp_path, FakePredictor()).load_log())
+    assert logged and logged < {case.case_id for case in CASES}
+
+    predictor = FakePredictor()
+    stats = _predictor(tmp_path, predictor).run()
+    redone = {f"case_{case}" for case in predictor.seen}
+    assert not redone & logged
+    assert redone | logged == {case.case_id for case in CASES}
+    assert (stats["skipped"], stats["predicted"]) == (len(logged), len(redone))
+    assert all((tmp_path / f"{case.case_id}_pred.nii.gz").exists() for case in CASES)
+
+
+def test_failed_cases_are_retried_on_the_next_run(tmp_path):
+    stats = _predictor(tmp_path, FakePredictor(fail={2})).run()
+    assert (stats["predicted"], stats["failed"]) == (5, 1)
+    predictor = FakePredictor()
+    stats = _predictor(tmp_path, predictor).run()
+    assert predictor.seen == [2]
+    assert (stats["skipped"], stats["predicted"]) == (5, 1)
+
+
+def test_log_is_ignored_for_another_mode_or_a_torn_line(tmp_path):
+    _predictor(tmp_path, FakePredictor()).run()
+    with open(tmp_path / "predictions.jsonl", "a") as f:
+        f.write(json.dumps({"case_id": "case_0", "path": None, "error": "killed"})[:20])
+    assert set(_predictor(tmp_path, FakePredictor()).load_log()) == {case.case_id for case in CASES}
+
+    predictor = FakePredictor()
+    _predictor(tmp_path, predictor, mode="full").run()
+    assert sorted(predictor.seen) == list(range(6))
+
+
+def test_no_resume_predicts_everything_again(tmp_path):
+    _predictor(tmp_path, FakePredictor()).run()
+    predictor = FakePredictor()
+    stats = _predictor(tmp_path, predictor).run(resume=False)
+    assert (stats["skipped"], stats["predicted"]) == (0, 6)
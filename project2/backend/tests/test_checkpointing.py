@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("keras")
+
+from checkpointing import MANIFEST, CheckpointManager, ResumedEpoch
+
+x = np.random.default_rng(0).random((8, 3)).astype(np.float32)
+y = np.random.default_rng(1).random((8, 2)).astype(np.float32)
+
+
+def _model():
+    model = keras.Sequential([keras.Input((3,)), keras.layers.Dense(2)])
+    model.compile(optimizer=keras.optimizers.Adam(1e-2), loss="mse")
+    return model
+
+
+def _callbacks(tmp_path):
+    reduce_lr = keras.callbacks.ReduceLROnPlateau(monitor="val_loss", factor=0.5, patience=1)
+    model_checkpoint = keras.callbacks.ModelCheckpoint(str(tmp_path / "best.weights.h5"), save_best_only=True,
+                                                       save_weights_only=True)
+    manager = CheckpointManager(str(tmp_path / "checkpoints"), save_every_steps=2, keep_latest=2, keep_best=1)
+    manager.tracked_callbacks = {"reduce_lr": reduce_lr, "model_checkpoint": model_checkpoint}
+    return [reduce_lr, model_checkpoint, manager]
+
+
+def test_rotation_keeps_latest_and_best(tmp_path):
+    *_, manager = callbacks = _callbacks(tmp_path)
+    # 4 steps per epoch: checkpoints at steps 2 and 4 and at the end of each of the 4 epochs
+    _model().fit(x, y, batch_size=2, epochs=4, validation_data=(x, y), callbacks=callbacks, verbose=0)
+
+    assert manager.manifest["latest"] == ["ckpt-e003-s000004", "ckpt-e003-end"]
+    assert len(manager.manifest["best"]) == 1
+    kept = set(manager.manifest["latest"]) | {b["name"] for b in manager.manifest["best"]}
+    on_disk = set(os.listdir(tmp_path / "checkpoints")) - {MANIFEST}
+    assert on_disk == kept
+
+
+def test_restore_puts_back_weights_optimizer_and_callback_state(tmp_path):
+    model = _model()
+    reduce_lr, model_checkpoint, manager = callbacks = _callbacks(tmp_path)
+    model.fit(x, y, batch_size=2, epochs=3, validation_data=(x, y), callbacks=callbacks, verbose=0)
+
+    restored = _model()
+    new_reduce_lr, new_model_checkpoint, new_manager = _callbacks(tmp_path)
+    state = new_manager.restore(restored)
+    assert (state["epoch"], state["end_of_epoch"]) == (2, True)
+    for saved, loaded in zip(model.weights, restored.weights):
+        np.testing.assert_array_equal(saved.numpy(), loaded.numpy())
+    assert int(restored.optimizer.iterations.numpy()) == int(model.optimizer.iterations.numpy()) == 12
+
+    # Keras resets the callbacks when fit starts; the manager, listed after them, puts the saved state back
+    for callback in [new_reduce_lr, new_model_checkpoint, new_manager]:
+        callback.set_model(restored)
+        callback.on_train_begin()
+    assert (new_reduce_lr.wait, new_reduce_lr.cooldown_counter) == (reduce_lr.wait, reduce_lr.cooldown_counter)
+    assert new_reduce_lr.best == pytest.approx(float(reduce_lr.best))
+    assert new_model_checkpoint.best == pytest.approx(float(model_checkpoint.best))
+
+
+def test_resumed_epoch_starts_at_the_saved_step(tmp_path):
+    class Batches(keras.utils.Sequence):
+        def __init__(self):
+            super().__init__()
+            self.epochs_ended = 0
+
+        def __len__(self):
+            return 4
+
+        def __getitem__(self, index):
+            return x[2 * index:2 * index + 2], y[2 * index:2 * index + 2]
+
+        def on_epoch_end(self):
+            self.epochs_ended += 1
+
+    batches = Batches()
+    resumed = ResumedEpoch(batches, 3)
+    assert len(resumed) == 1
+    np.testing.assert_array_equal(resumed[0][0], batches[3][0])
+    resumed.on_epoch_end()
+    assert batches.epochs_ended == 1
+
+    *_, manager = callbacks = _callbacks(tmp_path)
+    manager.step_offset = 3
+    _model().fit(resumed, epochs=1, validation_data=(x, y), callbacks=callbacks, verbose=0)
+    # Steps are counted from the start of the interrupted epoch
+    assert manager.manifest["latest"] == ["ckpt-e000-s000004", "ckpt-e000-end"]
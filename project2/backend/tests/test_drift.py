@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+stats = pytest.importorskip("scipy.stats")
+
+from drift import chi_square_column, detect_drift, ks_columns, psi_columns
+
+
+def test_ks_columns_matches_scipy():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(300, 3))
+    current = np.column_stack([rng.normal(size=200), rng.normal(0.5, size=200),
+                               rng.integers(0, 3, size=200).astype(float)])
+    reference[:, 2] = rng.integers(0, 3, size=300)
+    statistic, p_value = ks_columns(reference, current)
+    for column in range(3):
+        expected = stats.ks_2samp(reference[:, column], current[:, column], method="asymp")
+        assert statistic[column] == pytest.approx(expected.statistic)
+        assert p_value[column] == pytest.approx(expected.pvalue, rel=1e-3, abs=1e-9)
+
+
+def test_ks_columns_needs_rows():
+    with pytest.raises(ValueError):
+        ks_columns(np.zeros((0, 2)), np.zeros((3, 2)))
+
+
+def test_psi_is_zero_for_the_same_sample_and_grows_with_shift():
+    rng = np.random.default_rng(1)
+    reference = rng.normal(size=(1000, 1))
+    assert psi_columns(reference, reference)[0] == pytest.approx(0.0)
+    assert psi_columns(reference, reference + 1.0)[0] > psi_columns(reference, reference + 0.1)[0] > 0
+
+
+def test_chi_square_column():
+    assert chi_square_column(["a"] * 10, ["a"] * 10) == (0.0, 1.0)
+    _, p_value = chi_square_column(["a"] * 50 + ["b"] * 50, ["a"] * 90 + ["b"] * 10)
+    assert p_value < 0.05
+
+
+def test_detect_drift_flags_shifted_columns():
+    rng = np.random.default_rng(2)
+    reference = pd.DataFrame({"age": rng.normal(50, 10, 500), "size": rng.normal(size=500),
+                              "site": rng.choice(["a", "b"], 500)})
+    current = pd.DataFrame({"age": rng.normal(70, 10, 500), "size": rng.normal(size=500),
+                            "site": rng.choice(["a", "b"], 500)})
+    result = detect_drift(reference, current)
+    assert result["columns"]["age"]["drift_detected"]
+    assert result["columns"]["age"]["stattest"] == "ks"
+    assert result["columns"]["site"]["stattest"] == "chisquare"
+    assert result["n_drifted_columns"] >= 1
+    assert result["dataset_drift"] == (result["share_drifted_columns"] >= 0.5)
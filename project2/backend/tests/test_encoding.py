@@ -0,0 +1,78 @@
+import io
+import gzip
+import numpy as np
+import nibabel as nib
+import pytest
+
+from encoding import JSON, NIFTI, NPY, NPZ, encode_prediction, negotiate
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, JSON),
+    ("", JSON),
+    ("*/*", JSON),
+    ("application/x-npz", NPZ),
+    ("application/x-npy;q=0.5, application/x-npz;q=0.9", NPZ),
+    ("application/x-nifti, application/x-npz", NIFTI),
+    ("text/html, application/*;q=0.1", JSON),
+    ("application/x-npz;q=0", None),
+    ("text/html", None),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(accept) == expected
+
+
+@pytest.fixture
+def prediction():
+    # (slices, H, W, classes) with every class somewhere, class 3 on the first column
+    labels = np.tile(np.arange(4, dtype=np.uint8), (2, 4, 1))
+    return np.eye(4, dtype=np.float32)[labels]
+
+
+def test_npy_labels_and_probabilities(prediction):
+    body, headers = encode_prediction(prediction, NPY)
+    np.testing.assert_array_equal(np.load(io.BytesIO(body)), np.argmax(prediction, axis=-1))
+    assert headers["X-Prediction-Shape"] == "2,4,4,4"
+
+    body, headers = encode_prediction(prediction, NPY, probabilities=True, accept_gzip=True)
+    assert headers["Content-Encoding"] == "gzip"
+    probabilities = np.load(io.BytesIO(gzip.decompress(body)))
+    assert probabilities.dtype == np.float16
+    np.testing.assert_array_equal(probabilities, prediction)
+
+
+def test_npz_carries_probabilities_on_request(prediction):
+    body, _ = encode_prediction(prediction, NPZ)
+    assert set(np.load(io.BytesIO(body)).files) == {"labels"}
+    body, _ = encode_prediction(prediction, NPZ, probabilities=True)
+    with np.load(io.BytesIO(body)) as data:
+        np.testing.assert_array_equal(data["labels"], np.argmax(prediction, axis=-1))
+        np.testing.assert_array_equal(data["probabilities"], prediction)
+
+
+def test_nifti_without_reference_uses_brats_labels(prediction):
+    body, headers = encode_prediction(prediction, NIFTI)
+    assert "segmentation.nii.gz" in headers["Content-Disposition"]
+    volume = np.asarray(nib.Nifti1Image.from_bytes(gzip.decompress(body)).dataobj)
+    assert volume.shape == (4, 4, 2)
+    assert sorted(np.unique(volume)) == [0, 1, 2, 4]
+
+
+def test_nifti_with_reference_matches_input_geometry(prediction):
+    affine = np.diag([2.0, 2.0, 3.0, 1.0])
+    reference = nib.Nifti1Image(np.zeros((8, 8, 6), dtype=np.float32), affine)
+    body, _ = encode_prediction(prediction, NIFTI, reference=reference, start=1)
+    image = nib.Nifti1Image.from_bytes(gzip.decompress(body))
+    volume = np.asarray(image.dataobj)
+    assert volume.shape == (8, 8, 6)
+    np.testing.assert_array_equal(image.affine, affine)
+    # Only the predicted slices [start, start + slices) carry labels
+    assert not volume[:, :, [0, 3, 4, 5]].any()
+    assert sorted(np.unique(volume[:, :, 1:3])) == [0, 1, 2, 4]
+
+
+def test_unsupported_requests_raise(prediction):
+    with pytest.raises(ValueError):
+        encode_prediction(prediction, NIFTI, probabilities=True)
+    with pytest.raises(ValueError):
+        encode_prediction(prediction, "text/csv")
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from evaluation import CLASS_KEYS, StreamingEvaluator
+
+rng = np.random.default_rng(0)
+CASE_IDS = [f"case_{i}" for i in range(5)]
+LABELS = {case_id: rng.integers(0, 4, size=(3, 6, 6)) for case_id in CASE_IDS}
+LOGITS = {case_id: rng.normal(size=(3, 6, 6, 4)) + 2 * np.eye(4)[LABELS[case_id]] for case_id in CASE_IDS}
+PROBABILITIES = {case_id: np.exp(l) / np.exp(l).sum(axis=-1, keepdims=True) for case_id, l in LOGITS.items()}
+
+
+class Crash(BaseException):
+    """Stands in for the process being killed."""
+
+
+def fake_load(case_id):
+    # The case number in every voxel, so the predictor knows which case it is given
+    return np.full((3, 6, 6, 2), int(case_id.split("_")[1]), dtype=np.float32), LABELS[case_id]
+
+
+class FakeModel:
+    def __init__(self, crash_after=None):
+        self.crash_after = crash_after
+        self.seen = []
+
+    def __call__(self, X):
+        if self.crash_after is not None and len(self.seen) == self.crash_after:
+            raise Crash()
+        case_id = f"case_{int(X[0, 0, 0, 0])}"
+        self.seen.append(case_id)
+        return PROBABILITIES[case_id]
+
+
+def _evaluator(tmp_path, model):
+    return StreamingEvaluator(model, CASE_IDS, str(tmp_path / "results.jsonl"), load_fn=fake_load)
+
+
+def test_streamed_metrics_match_a_direct_computation(tmp_path):
+    summary = _evaluator(tmp_path, FakeModel()).run()
+
+    labels = np.concatenate([LABELS[c].ravel() for c in CASE_IDS])
+    probabilities = np.concatenate([PROBABILITIES[c].reshape(-1, 4) for c in CASE_IDS])
+    predicted = probabilities.argmax(axis=-1)
+    dice, iou = [], []
+    for c in range(4):
+        truth, prediction = labels == c, predicted == c
+        intersection = np.sum(truth & prediction)
+        dice.append(2 * intersection / (truth.sum() + prediction.sum()))
+        iou.append(intersection / np.sum(truth | prediction))
+    for c in range(1, 4):
+        assert summary[f"Dice {CLASS_KEYS[c]}"] == pytest.approx(dice[c], abs=1e-4)
+        assert summary[f"Dice coef {CLASS_KEYS[c]}"] == summary[f"Dice {CLASS_KEYS[c]}"]
+        case_dice = [2 * np.sum((LABELS[i] == c) & (PROBABILITIES[i].argmax(-1) == c))
+                     / (np.sum(LABELS[i] == c) + np.sum(PROBABILITIES[i].argmax(-1) == c)) for i in CASE_IDS]
+        assert summary[f"Mean case dice {CLASS_KEYS[c]}"] == pytest.approx(np.mean(case_dice), abs=1e-4)
+    assert summary["Cases"] == len(CASE_IDS)
+    assert summary["Dice coefficient"] == pytest.approx(np.mean(dice), abs=1e-4)
+    assert summary["MeanIOU"] == pytest.approx(np.mean(iou), abs=1e-4)
+    assert summary["Accuracy"] == pytest.approx(np.mean(labels == predicted), abs=1e-4)
+    loss = -np.mean(np.log(probabilities[np.arange(len(labels)), labels]))
+    assert summary["Loss"] == pytest.approx(loss, abs=1e-4)
+
+
+def test_resume_skips_the_evaluated_cases(tmp_path):
+    expected = _evaluator(tmp_path / "uninterrupted", FakeModel()).run()
+
+    with pytest.raises(Crash):
+        _evaluator(tmp_path, FakeModel(crash_after=2)).run()
+    model = FakeModel()
+    assert _evaluator(tmp_path, model).run() == expected
+    assert model.seen == CASE_IDS[2:]
+
+    model = FakeModel()
+    assert _evaluator(tmp_path, model).run(resume=False) == expected
+    assert model.seen == CASE_IDS
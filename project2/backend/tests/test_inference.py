@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from config import VOLUME_SLICES, VOLUME_START_AT
+from inference import SliceCounter, predict_volume
+from preprocess import build_input, inference_slab
+
+
+def _volume(depth=140, seed=0):
+    volume = np.random.default_rng(seed).random((32, 32, depth), dtype=np.float32)
+    # Much brighter than the training slab, on a slice only "full" mode predicts
+    volume[:, :, 5] *= 10
+    return volume
+
+
+def test_full_mode_scales_like_the_training_window():
+    flair, t1ce = _volume(seed=0), _volume(seed=1)
+    window = build_input(flair, t1ce, *inference_slab("window", flair.shape[2]), img_size=16)
+    full = build_input(flair, t1ce, *inference_slab("full", flair.shape[2]), img_size=16)
+    assert window.max() == pytest.approx(1.0)
+    np.testing.assert_array_equal(full[VOLUME_START_AT:VOLUME_START_AT + VOLUME_SLICES], window)
+    assert full[5].max() > 1
+
+
+class FakeModel:
+    """Softmax of class 1 everywhere; records the batch sizes it is called with."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, X):
+        self.batches.append(len(X))
+        return np.broadcast_to(np.eye(4, dtype=np.float32)[1], (*X.shape[:3], 4)).copy()
+
+
+def _input(tissue):
+    X = np.zeros((len(tissue), 8, 8, 2), dtype=np.float32)
+    X[np.flatnonzero(tissue)] = 0.5
+    return X
+
+
+@pytest.mark.parametrize("tta", [1, 4])
+def test_empty_slices_are_skipped_as_background(tta):
+    tissue = np.array([0, 1, 1, 0, 1, 0, 1, 1, 1, 0], dtype=bool)
+    model, counter = FakeModel(), SliceCounter()
+    prediction = predict_volume(model, _input(tissue), 4, chunk_slices=8, skip_empty=True, tta=tta, counter=counter)
+
+    labels = prediction.argmax(axis=-1)
+    assert (labels[tissue] == 1).all()
+    assert (labels[~tissue] == 0).all()
+    np.testing.assert_array_equal(prediction[~tissue], np.broadcast_to(np.eye(4)[0], (4, 8, 8, 4)))
+    assert counter.to_dict() == {"predicted": 6, "skipped": 4}
+    # Only the tissue slices reach the model, never more than chunk_slices per call with their variants
+    assert sum(model.batches) == 6 * tta
+    assert max(model.batches) <= 8
+
+
+def test_without_skipping_every_slice_is_predicted():
+    tissue = np.array([0, 1, 0], dtype=bool)
+    model, counter = FakeModel(), SliceCounter()
+    labels = predict_volume(model, _input(tissue), 4, chunk_slices=2, counter=counter).argmax(axis=-1)
+    assert (labels == 1).all()
+    assert model.batches == [2, 1]
+    assert counter.to_dict() == {"predicted": 3, "skipped": 0}
@@ -0,0 +1,70 @@
+import time
+import threading
+
+from jobs import JobManager
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.status in ("queued", "running"):
+        assert time.monotonic() < deadline, f"job still {job.status}"
+        time.sleep(0.01)
+    return job
+
+
+def test_job_runs_and_reports_progress():
+    def work(job):
+        job.set_progress(3, 3)
+        return {"cases": 3}
+
+    job = _wait(JobManager().submit("evaluation", work))
+    assert job.status == "done"
+    assert job.result == {"cases": 3}
+    assert job.to_dict()["progress"] == {"done": 3, "total": 3}
+    assert job.started_at and job.finished_at
+
+
+def test_failed_job_keeps_its_error():
+    def work(job):
+        raise RuntimeError("no cases found")
+
+    job = _wait(JobManager().submit("evaluation", work))
+    assert job.status == "failed"
+    assert job.error == "no cases found"
+
+
+def test_cached_results_survive_a_restart(tmp_path):
+    history_path = str(tmp_path / "history" / "jobs.json")
+    calls = []
+
+    def work(job):
+        calls.append(job.id)
+        return {"dice": 0.9}
+
+    first = _wait(JobManager(history_path).submit("evaluation", work, cache_key="split-1"))
+    again = JobManager(history_path).submit("evaluation", work, cache_key="split-1")
+    assert again.status == "done" and again.cached
+    assert again.result == first.result
+    assert len(calls) == 1
+
+
+def test_same_key_joins_the_running_job():
+    release = threading.Event()
+    manager = JobManager()
+    first = manager.submit("evaluation", lambda job: release.wait(5), cache_key="split-1")
+    assert manager.submit("evaluation", lambda job: None, cache_key="split-1") is first
+    release.set()
+    _wait(first)
+
+
+def test_cancelled_queued_job_is_not_run():
+    release = threading.Event()
+    ran = []
+    manager = JobManager()
+    blocker = manager.submit("blocker", lambda job: release.wait(5))
+    queued = manager.submit("evaluation", lambda job: ran.append(job.id))
+    manager.cancel(queued.id)
+    release.set()
+    _wait(blocker)
+    assert _wait(queued).status == "cancelled"
+    assert ran == []
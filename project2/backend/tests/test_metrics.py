@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from metrics import SUM_TRUE, TP, SegmentationCounts, segmentation_metrics
+
+
+def test_counts_stay_exact_past_float32_precision():
+    counts = SegmentationCounts(num_classes=4)
+    counts.counts.assign(tf.fill(counts.counts.shape, tf.constant(2.0 ** 24, counts.counts.dtype)))
+    y = tf.one_hot([[1, 2]], 4)
+    counts.update_state(y, y)
+    # In float32, 2**24 + 1 rounds back to 2**24
+    assert counts.result().numpy()[SUM_TRUE, 1] == 2 ** 24 + 1
+    assert counts.result().numpy()[TP, 2] == 2 ** 24 + 1
+
+
+def test_views_report_float32_values_of_the_totals():
+    labels = np.random.default_rng(0).integers(0, 4, size=(2, 8, 8))
+    y = tf.one_hot(labels, 4)
+    metrics = segmentation_metrics()
+    for metric in metrics:
+        metric.update_state(y, y)
+    results = {metric.name: metric.result() for metric in metrics}
+    assert all(value.dtype == tf.float32 for value in results.values())
+    assert float(results["precision"]) == pytest.approx(1.0)
+    assert float(results["dice_coef_edema"]) == pytest.approx(1.0)
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("tf2onnx")
+pytest.importorskip("onnxruntime")
+
+
+def test_onnx_export_matches_keras(tmp_path, monkeypatch):
+    import model
+    from loadtest import _tiny_build_model
+    from onnx_export import export_onnx, check_parity
+
+    # The U-Net's input and output shapes, small enough to export in seconds
+    monkeypatch.setattr(model.Unet, "build_model", _tiny_build_model)
+    unet_model = model.Unet(img_size=128, num_classes=4)
+    onnx_path = export_onnx(unet_model, str(tmp_path / "model.onnx"))
+
+    report = check_parity(unet_model, onnx_path, num_cases=1, data_dir=str(tmp_path / "cases"))
+    assert report["passed"], report
+    assert report["label_agreement"] > 0.999
@@ -0,0 +1,55 @@
+import numpy as np
+import nibabel as nib
+
+from prediction_cache import PredictionCache, content_id, geometry_of
+
+
+def _entry(value):
+    image = nib.Nifti1Image(np.zeros((4, 4, 3), dtype=np.float32), np.diag([2.0, 2.0, 2.0, 1.0]))
+    return {"prediction": np.full((2, 4, 4, 4), value, dtype=np.float32),
+            "flair": np.full((2, 4, 4), value, dtype=np.float32),
+            "geometry": geometry_of(image), "start": 5, "model_version": "abc123"}
+
+
+def test_content_id_depends_on_contents_order_and_salt():
+    assert content_id(b"flair", b"t1ce") == content_id(b"flair", b"t1ce")
+    assert content_id(b"flair", b"t1ce") != content_id(b"t1ce", b"flair")
+    assert content_id(b"flair", b"t1ce") != content_id(b"flair", b"t1ce", salt="v2")
+    # Boundaries between files count: the contents are hashed separately
+    assert content_id(b"ab", b"c") != content_id(b"a", b"bc")
+
+
+def test_least_recently_used_entry_is_dropped_without_spill_dir():
+    cache = PredictionCache(max_items=2)
+    cache.put("a", _entry(0.1))
+    cache.put("b", _entry(0.2))
+    assert cache.get("a") is not None
+    cache.put("c", _entry(0.3))
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats() == {"in_memory": 2, "max_items": 2, "hits": 3, "misses": 1, "spill_dir": None}
+
+
+def test_evicted_entries_are_spilled_and_read_back(tmp_path):
+    cache = PredictionCache(max_items=1, spill_dir=str(tmp_path))
+    cache.put("a", _entry(0.25))
+    cache.put("b", _entry(0.5))
+    assert (tmp_path / "a.npz").exists()
+    assert "a" in cache
+
+    entry = cache.get("a")
+    assert entry["prediction"].dtype == np.float32
+    np.testing.assert_array_equal(entry["prediction"], 0.25)
+    np.testing.assert_array_equal(entry["flair"], 0.25)
+    assert entry["start"] == 5 and entry["model_version"] == "abc123"
+    assert entry["geometry"].shape == (4, 4, 3)
+    np.testing.assert_array_equal(entry["geometry"].affine, np.diag([2.0, 2.0, 2.0, 1.0]))
+    assert entry["geometry"].header.get_zooms() == (2.0, 2.0, 2.0)
+
+
+def test_corrupt_spill_file_is_a_miss(tmp_path):
+    cache = PredictionCache(max_items=1, spill_dir=str(tmp_path))
+    (tmp_path / "broken.npz").write_bytes(b"not an npz file")
+    assert cache.get("broken") is None
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,123 @@
+import threading
+import pytest
+
+from inference import SliceCounter
+from registry import ModelRegistry
+
+
+class FakeModel:
+    """Stands in for a loaded model; its size is that of its file (see registry.model_nbytes)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.slice_counter = SliceCounter()
+
+
+@pytest.fixture
+def weights(tmp_path):
+    def write(name, nbytes):
+        path = tmp_path / name
+        path.write_bytes(name.encode().ljust(nbytes, b"\0"))
+        return str(path)
+    return write
+
+
+def _registry(byte_budget, loaded=None):
+    def loader(path):
+        if loaded is not None:
+            loaded.append(path)
+        return FakeModel(path)
+    return ModelRegistry(loader, byte_budget, warmup=lambda model: None)
+
+
+def test_first_version_becomes_active(weights):
+    registry = _registry(1000)
+    entry = registry.load(weights("a.h5", 100), background=False)
+    assert entry.status == "ready" and len(entry.version) == 12
+    assert registry.active == entry.version
+    assert registry.get() is entry
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+
+def test_same_weights_are_loaded_once(weights):
+    loaded = []
+    registry = _registry(1000, loaded)
+    path = weights("a.h5", 100)
+    first = registry.load(path, background=False)
+    second = registry.load(path, background=False)
+    assert second.version == first.version and second.status == "ready"
+    assert second.model is first.model
+    assert len(loaded) == 1
+
+
+def test_least_recently_used_version_is_unloaded(weights):
+    registry = _registry(250)
+    active = registry.load(weights("a.h5", 100), background=False)
+    old = registry.load(weights("b.h5", 100), background=False)
+    registry.load(weights("c.h5", 100), background=False)
+    assert registry.active == active.version
+    assert old.status == "unloaded"
+    assert old.version not in registry.versions
+
+
+def test_version_over_budget_is_refused_before_loading(weights):
+    loaded = []
+    registry = _registry(150, loaded)
+    registry.load(weights("a.h5", 100), background=False)
+    with pytest.raises(RuntimeError, match="budget"):
+        registry.load(weights("b.h5", 100), background=False)
+    # The active version is pinned, and the new one never reached the loader
+    assert len(loaded) == 1
+    assert registry.describe()["bytes"] == 100
+
+
+def test_activate_and_canary_routing(weights, monkeypatch):
+    registry = _registry(1000)
+    stable = registry.load(weights("a.h5", 100), background=False)
+    candidate = registry.load(weights("b.h5", 100), background=False, canary_fraction=0.5)
+    assert (registry.canary, registry.canary_fraction) == (candidate.version, 0.5)
+
+    monkeypatch.setattr("registry.random.random", lambda: 0.1)
+    assert registry.get() is candidate
+    monkeypatch.setattr("registry.random.random", lambda: 0.9)
+    assert registry.get() is stable
+
+    with pytest.raises(ValueError):
+        registry.unload(candidate.version)
+    registry.activate(candidate.version)
+    assert registry.active == candidate.version and registry.canary is None
+    registry.unload(stable.version)
+    assert [v["version"] for v in registry.describe()["versions"]] == [candidate.version]
+
+
+def _blocking_registry(fail_first):
+    """A registry whose loader waits for `release`; the first call raises with fail_first."""
+    release, started, calls = threading.Event(), threading.Event(), []
+
+    def loader(path):
+        calls.append(path)
+        started.set()
+        assert release.wait(5)
+        if fail_first and len(calls) == 1:
+            raise OSError("truncated weights")
+        return FakeModel(path)
+
+    return ModelRegistry(loader, 1000, warmup=lambda model: None), release, started, calls
+
+
+@pytest.mark.parametrize("fail_first", [False, True])
+def test_concurrent_loads_of_the_same_weights(weights, fail_first):
+    registry, release, started, calls = _blocking_registry(fail_first)
+    path = weights("a.h5", 100)
+    first = registry.load(path)
+    assert started.wait(5)
+    second = registry.load(path)
+    release.set()
+    assert first.done.wait(5) and second.done.wait(5)
+
+    # The second load waits for the first, and loads the weights itself only if that one failed
+    assert first.status == ("failed" if fail_first else "ready")
+    assert second.status == "ready" and second.version == first.version
+    assert len(calls) == (2 if fail_first else 1)
+    assert registry.get() is (second if fail_first else first)
@@ -0,0 +1,18 @@
+import os
+import pytest
+
+APP_DIRS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", project, "backend", "app")
+            for project in ("project1", "project2")]
+
+
+@pytest.mark.parametrize("module", ["drift.py", "timing.py", "load_client.py"])
+def test_shared_modules_are_identical(module):
+    # Each project's image only copies its own backend/app, so these modules are kept in both
+    contents = []
+    for app_dir in APP_DIRS:
+        path = os.path.join(app_dir, module)
+        if not os.path.exists(path):
+            pytest.skip(f"{path} is not checked out")
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    assert contents[0] == contents[1], f"project1 and project2 {module} differ"
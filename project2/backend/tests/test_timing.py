@@ -0,0 +1,80 @@
+import pytest
+
+from timing import Counter, Gauge, MetricsRegistry, StageTimer, _request_timer, snapshot, stage
+
+
+def test_stages_add_up_within_a_request():
+    timer = StageTimer()
+    token = _request_timer.set(timer)
+    try:
+        with stage("model"):
+            pass
+        with stage("model"):
+            pass
+        with stage("encode"):
+            pass
+    finally:
+        _request_timer.reset(token)
+    assert list(timer.stages) == ["model", "encode"]
+    assert timer.server_timing().startswith("model;dur=")
+    # Outside a request the block just runs
+    with stage("model"):
+        pass
+
+
+def test_render_prometheus_text_format():
+    metrics = MetricsRegistry()
+    requests = metrics.counter("requests_total", "Requests", ("endpoint", "status"))
+    requests.inc(endpoint="/predict", status=200)
+    requests.inc(2, endpoint="/predict", status=200)
+    requests.inc(endpoint='/say "hi"\n', status=500)
+    in_flight = metrics.gauge("in_flight", "Requests being served")
+    in_flight.inc()
+    in_flight.dec()
+    latency = metrics.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    metrics.add_collector(lambda: [snapshot(Gauge, "cache_items", "Cached cases", {("memory",): 3}, ("where",))])
+
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ["# HELP requests_total Requests", "# TYPE requests_total counter"]
+    assert 'requests_total{endpoint="/predict",status="200"} 3' in lines
+    assert 'requests_total{endpoint="/say \\"hi\\"\\n",status="500"} 1' in lines
+    assert "in_flight 0" in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert "latency_seconds_sum 0.55" in lines
+    assert "latency_seconds_count 2" in lines
+    assert 'cache_items{where="memory"} 3' in lines
+
+
+def test_registering_a_name_twice_returns_the_first_metric():
+    metrics = MetricsRegistry()
+    first = metrics.counter("requests_total", "Requests")
+    assert metrics.counter("requests_total", "Requests") is first
+    assert isinstance(first, Counter)
+
+
+def test_middleware_records_requests():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from timing import add_timing_middleware
+
+    app = FastAPI()
+    add_timing_middleware(app)
+
+    @app.get("/cases/{case_id}")
+    def case(case_id):
+        with stage("lookup"):
+            return {"case_id": case_id}
+
+    client = TestClient(app)
+    response = client.get("/cases/BraTS20_001")
+    assert response.headers["Server-Timing"].startswith("lookup;dur=")
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",endpoint="/cases/{case_id}",status="200"}' in body
+    assert 'http_request_stage_duration_seconds_count{endpoint="/cases/{case_id}",stage="lookup"} 1' in body
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from tta import MAX_VARIANTS, augment, merge
+
+
+@pytest.mark.parametrize("variants", range(1, MAX_VARIANTS + 1))
+def test_merge_inverts_augment(variants):
+    X = np.random.default_rng(0).random((3, 8, 8, 4)).astype(np.float32)
+    batch = augment(X, variants)
+    assert batch.shape == (variants * 3, 8, 8, 4)
+    # An identity "model" gives back each variant as is, so the merged prediction is the input
+    np.testing.assert_allclose(merge(batch, variants), X, rtol=1e-6)
+
+
+def test_variants_are_distinct():
+    X = np.arange(16, dtype=np.float32).reshape(1, 4, 4, 1)
+    variants = augment(X, MAX_VARIANTS)
+    assert len({v.tobytes() for v in variants}) == MAX_VARIANTS
+
+
+@pytest.mark.parametrize("variants", [0, MAX_VARIANTS + 1])
+def test_augment_rejects_variant_counts(variants):
+    with pytest.raises(ValueError):
+        augment(np.zeros((1, 4, 4, 2), dtype=np.float32), variants)
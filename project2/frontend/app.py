@@ -52,8 +52,10 @@ def show_drift():
         st.error("Error in fetching drift status.")
 
 # Function to send authenticated request, updated to support file uploads and query parameters
-def authenticated_request(endpoint, method="GET", params=None, json=None, files=None):
+def authenticated_request(endpoint, method="GET", params=None, json=None, files=None, accept=None):
     headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
+    if accept:
+        headers["Accept"] = accept
     if method == "GET":
         response = requests.get(f"{BASE_URL}{endpoint}", headers=headers, params=params)
     elif method == "POST":
@@ -61,6 +63,8 @@ def authenticated_request(endpoint, method="GET", params=None, json=None, files=
             response = requests.post(f"{BASE_URL}{endpoint}", headers=headers, files=files, params=params)
         else:
             response = requests.post(f"{BASE_URL}{endpoint}", headers=headers, json=json, params=params)
+    elif method == "DELETE":
+        response = requests.delete(f"{BASE_URL}{endpoint}", headers=headers, params=params)
     return response
 
 # ---- MAIN APP LOGIC ----
@@ -104,6 +108,10 @@ if is_authenticated() and st.session_state.is_logged_in:
             st.write("FLAIR Image:", uploaded_flair.name)
             st.write("T1CE Image:", uploaded_t1ce.name)
 
+            # The 100-slice training slab, or every axial slice of the volume
+            mode = st.radio("Slices to segment", ["window", "full"], horizontal=True)
+            case_key = (uploaded_flair.name, uploaded_t1ce.name, mode)
+
             # Prediction
             if st.button("View Predictions"):
                 with st.spinner("Generating segmentation plot..."):
@@ -111,27 +119,45 @@ if is_authenticated() and st.session_state.is_logged_in:
                         "flair": (uploaded_flair.name, uploaded_flair, uploaded_flair.type),
                         "t1ce": (uploaded_t1ce.name, uploaded_t1ce, uploaded_t1ce.type)
                     }
-                    response = authenticated_request("/predictbypath/", method="POST", files=files)
+                    # Predicted once by the backend, the slices are then fetched by case_id
+                    response = authenticated_request("/predictions/", method="POST", files=files, params={"mode": mode})
                     if response.status_code == 200:
+                        st.session_state.case_id = response.json()["case_id"]
+                        st.session_state.case_files = case_key
+                        st.session_state.case_slices = response.json()["slices"]
                         st.success("Prediction successful")
-                        # You can handle displaying the prediction results here
+                        st.json(response.json()["summary"]["classes"])
                     else:
                         st.error(f"Failed to predict segmentation: {response.text}")
 
             # Display Segmented Predictions
             st.subheader("View Predicted Segmentations")
             try:
-                slice_to_plot = st.slider("Select Slice to Plot", min_value=0, max_value=100, value=60)
+                max_slice = (st.session_state.get("case_slices") or 100) - 1
+                slice_to_plot = st.slider("Select Slice to Plot", min_value=0, max_value=max_slice, value=min(60, max_slice))
                 if st.button("Show Predicted Segmentations"):
                     with st.spinner("Generating segmentation plot..."):
-                        files = [
-                            ("files", (uploaded_flair.name, uploaded_flair, uploaded_flair.type)),
-                            ("files", (uploaded_t1ce.name, uploaded_t1ce, uploaded_t1ce.type))
-                        ]
-                        show_segmented_response = authenticated_request("/showPredictSegmented/", method="POST", files=files, params={"slice_to_plot": slice_to_plot})
+                        # Only the case of the files currently uploaded
+                        same_files = st.session_state.get("case_files") == case_key
+                        case_id = st.session_state.get("case_id") if same_files else None
+                        show_segmented_response = None
+                        if case_id:
+                            show_segmented_response = authenticated_request(f"/predictions/{case_id}/slices/{slice_to_plot}",
+                                                                            params={"layout": "panels"})
+                        # Not predicted yet, or evicted from the backend cache: upload the case again
+                        if show_segmented_response is None or show_segmented_response.status_code == 404:
+                            files = [
+                                ("files", (uploaded_flair.name, uploaded_flair, uploaded_flair.type)),
+                                ("files", (uploaded_t1ce.name, uploaded_t1ce, uploaded_t1ce.type))
+                            ]
+                            show_segmented_response = authenticated_request("/showPredictSegmented/", method="POST", files=files, params={"slice_to_plot": slice_to_plot, "mode": mode})
+                            if show_segmented_response.status_code == 200:
+                                st.session_state.case_id = show_segmented_response.headers.get("X-Case-Id")
+                                st.session_state.case_files = case_key
                         if show_segmented_response.status_code == 200:
                             st.success("Predicted segmentations displayed")
-                            # You may want to show images or segmented results here
+                            st.image(show_segmented_response.content,
+                                     caption="Flair, all classes, necrotic/core, edema, enhancing", use_column_width=True)
                         else:
                             st.error(f"Failed to show predicted segmentations: {show_segmented_response.text}")
             except ValueError:
@@ -145,19 +171,46 @@ if is_authenticated() and st.session_state.is_logged_in:
         st.write("Evaluate the segmentation model on the test dataset.")
         
         if st.button("Evaluate Model"):
+            # Evaluation runs as a background job on the backend, we only keep its id
             response = authenticated_request("/evaluate/", method="POST")
             if response.status_code == 200:
+                st.session_state.evaluation_job = response.json()
+            else:
+                st.error("Failed to evaluate model")
+
+        job = st.session_state.get("evaluation_job")
+        if job is not None:
+            if job["status"] in ("queued", "running"):
+                response = authenticated_request(f"/evaluate/{job['job_id']}")
+                if response.status_code == 200:
+                    job = response.json()
+                    st.session_state.evaluation_job = job
+
+            if job["status"] == "done":
                 st.subheader("Model Evaluation Metrics")
-                # Assuming response.text contains your JSON-like string
-                response_json = response.json()  # Convert JSON string to a dictionary
+                if job["cached"]:
+                    st.caption("Cached result for the current model weights and test split.")
 
                 # Convert dictionary to DataFrame
-                df = pd.DataFrame(list(response_json.items()), columns=["Metric", "Value"],index=None)
+                df = pd.DataFrame(list(job["result"].items()), columns=["Metric", "Value"],index=None)
 
                 # Display the DataFrame as a table
                 st.table(df.style.hide(axis='index'))
+            elif job["status"] in ("queued", "running"):
+                progress = job["progress"]
+                if progress["total"]:
+                    st.progress(progress["done"] / progress["total"], text=f"Evaluated {progress['done']} / {progress['total']} cases")
+                else:
+                    st.info(f"Evaluation {job['status']}...")
+                col1, col2 = st.columns(2)
+                if col1.button("Refresh"):
+                    st.rerun()
+                if col2.button("Cancel evaluation"):
+                    authenticated_request(f"/evaluate/{job['job_id']}", method="DELETE")
+                    st.session_state.evaluation_job = None
+                    st.rerun()
             else:
-                st.error("Failed to evaluate model")
+                st.error(f"Evaluation {job['status']}: {job.get('error') or ''}")
 
     # Drift Detection Page
     if page == "Drift Detection":